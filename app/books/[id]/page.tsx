@@ -5,6 +5,7 @@ import { Button } from "@/components/ui/button"
 import { Card, CardContent, CardFooter, CardHeader } from "@/components/ui/card"
 import { Skeleton } from "@/components/ui/skeleton"
 import BookDetails from "@/components/book-details"
+import SimilarBooks from "@/components/similar-books"
 
 export default function BookPage({ params }: { params: { id: string } }) {
   return (
@@ -25,6 +26,7 @@ export default function BookPage({ params }: { params: { id: string } }) {
         <Suspense fallback={<BookDetailsSkeleton />}>
           <BookDetails id={params.id} />
         </Suspense>
+        <SimilarBooks id={params.id} />
       </main>
     </div>
   )
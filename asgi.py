@@ -0,0 +1,284 @@
+"""
+ASGI entry point for the library API.
+
+Serves the same routes over the same library object as index.py:
+
+    uvicorn asgi:app --port 5328
+
+The library is opened during the lifespan startup, before the server
+accepts connections (or by the first request, under servers that do not
+send lifespan events).
+
+The cached listings (books, recent, borrowed, dashboard), stats and book
+lookups are answered directly on the event loop, which keeps many
+concurrent clients cheap. Every other route is handed to the Flask app in
+a worker thread, so writes, batches, bulk import and export behave exactly
+as they do under index.py, and their request and response bodies are
+still streamed. Requests answered here are recorded in index.metrics under
+the same route names as Flask uses; requests asking to be profiled go
+through Flask, where the profiler hooks are.
+"""
+import asyncio
+import io
+import json
+import sys
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags
+
+import index
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Bytes gathered from a streaming Flask response before they are sent
+STREAM_CHUNK_SIZE = 64 * 1024
+
+CACHED_ROUTES = {
+    "/api/books": index.books_listing,
+    "/api/books/recent": index.recent_listing,
+    "/api/books/borrowed": index.borrowed_listing,
+    "/api/dashboard": index.dashboard_listing,
+}
+
+# Route name of each cached listing in the metrics, as Flask names it
+ROUTE_NAMES = {path: path for path in CACHED_ROUTES}
+BOOK_ROUTE = "/api/books/<book_id>"
+STATS_ROUTE = "/api/stats"
+
+PROFILE_HEADER = index.instrumentation.PROFILE_HEADER.lower().encode("latin-1")
+
+# Second path segments under /api/books/ that are routes, not book ids
+RESERVED_BOOK_PATHS = frozenset(("search", "borrowed", "recent", "export", "bulk"))
+
+
+async def _read(function: Callable[..., Any], *args: Any) -> Any:
+    # The in-memory library answers reads without blocking; SQLite queries
+    # are moved off the event loop
+    if not isinstance(index.library, index.Library):
+        return await asyncio.to_thread(function, *args)
+    return function(*args)
+
+
+async def _respond(send: Send, status: int, body: bytes = b"",
+                   headers: Optional[List[Tuple[bytes, bytes]]] = None) -> None:
+    headers = list(headers or [])
+    if body:
+        headers.append((b"content-type", b"application/json"))
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _header(scope: Scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _args(scope: Scope) -> MultiDict:
+    return MultiDict(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+
+
+async def cached_listing(scope: Scope, send: Send, build: Callable[[MultiDict], Tuple[bytes, Optional[str]]]) -> None:
+    # Same contract as index.cached_json_response: ETag, 304 and X-Next-Cursor
+    etag = await _read(lambda: index.library.etag)
+    headers = [(b"etag", f'"{etag}"'.encode())]
+    if parse_etags(_header(scope, b"if-none-match")).contains(etag):
+        await _respond(send, 304, headers=headers)
+        return
+
+    try:
+        body, next_cursor = await _read(build, _args(scope))
+    except ValueError as e:
+        await _respond(send, 400, json.dumps({"error": str(e)}).encode())
+        return
+    if next_cursor is not None:
+        headers.append((b"x-next-cursor", next_cursor.encode()))
+    await _respond(send, 200, body, headers)
+
+
+async def get_book(scope: Scope, send: Send, book_id: str) -> None:
+    try:
+        fields = index.fields_arg(_args(scope))
+    except ValueError as e:
+        await _respond(send, 400, json.dumps({"error": str(e)}).encode())
+        return
+    book = await _read(index.library.get_book, book_id)
+    if not book:
+        await _respond(send, 404, b'{"error":"Book not found"}')
+        return
+    await _respond(send, 200, json.dumps(book.to_dict(fields), separators=(",", ":")).encode())
+
+
+async def get_stats(send: Send) -> None:
+    stats = await _read(index.library.get_stats)
+    await _respond(send, 200, json.dumps(stats, separators=(",", ":")).encode())
+
+
+class RequestBody(io.RawIOBase):
+    """Blocking file over the ASGI receive channel, read from a worker thread."""
+
+    def __init__(self, receive: Receive, loop: asyncio.AbstractEventLoop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b""
+        self._more = True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while not self._buffer and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message["type"] == "http.disconnect":
+                self._more = False
+                break
+            self._buffer = message.get("body", b"")
+            self._more = message.get("more_body", False)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def wsgi_environ(scope: Scope, body: io.BufferedReader) -> Dict[str, Any]:
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope["headers"]:
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name == "content-length":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def call_flask(scope: Scope, receive: Receive, send: Send) -> None:
+    loop = asyncio.get_running_loop()
+    environ = wsgi_environ(scope, io.BufferedReader(RequestBody(receive, loop)))
+    started = {}
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info: Any = None) -> None:
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                              for name, value in headers]
+
+    chunks = await asyncio.to_thread(index.app, environ, start_response)
+    iterator = iter(chunks)
+
+    def next_chunk() -> Tuple[bytes, bool]:
+        # Gathers small chunks so a large export needs few thread hops
+        parts, size = [], 0
+        for part in iterator:
+            parts.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK_SIZE:
+                return b"".join(parts), True
+        return b"".join(parts), False
+
+    try:
+        await send({"type": "http.response.start", "status": started["status"],
+                    "headers": started["headers"]})
+        more = True
+        while more:
+            data, more = await asyncio.to_thread(next_chunk)
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+    finally:
+        if hasattr(chunks, "close"):
+            await asyncio.to_thread(chunks.close)
+
+
+def native_handler(scope: Scope) -> Tuple[Optional[str], Optional[Callable[[Send], Awaitable[None]]]]:
+    """Return the route name and handler for a request answered on the loop, if any."""
+    if scope["method"] != "GET" or _header(scope, PROFILE_HEADER) is not None:
+        return None, None
+    path = scope["path"]
+    if path in CACHED_ROUTES:
+        return ROUTE_NAMES[path], lambda send: cached_listing(scope, send, CACHED_ROUTES[path])
+    if path == STATS_ROUTE:
+        return STATS_ROUTE, get_stats
+    book_id = path[len("/api/books/"):] if path.startswith("/api/books/") else ""
+    if book_id and "/" not in book_id and book_id not in RESERVED_BOOK_PATHS:
+        return BOOK_ROUTE, lambda send: get_book(scope, send, book_id)
+    return None, None
+
+
+async def instrumented(scope: Scope, send: Send, route: str,
+                       handler: Callable[[Send], Awaitable[None]]) -> None:
+    timer = index.metrics.start_request()
+    status = 500
+
+    async def send_and_record(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    try:
+        await handler(send_and_record)
+    finally:
+        index.metrics.finish_request(timer, route, scope["method"], status)
+
+
+async def lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Open the library before the server accepts requests, off the
+            # event loop, so no request waits on it
+            try:
+                await asyncio.to_thread(index.start)
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": f"Could not open the library: {e}"})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if getattr(index.library, "store", None) is not None:
+                index.library.store.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    route, handler = native_handler(scope)
+    if handler is not None:
+        if index.library is None:
+            # Without lifespan events the first request opens the library
+            # (see index.start), which may load a large image: not on the
+            # event loop
+            await asyncio.to_thread(index.start)
+        await instrumented(scope, send, route, handler)
+        return
+    await call_flask(scope, receive, send)
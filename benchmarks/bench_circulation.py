@@ -0,0 +1,105 @@
+"""
+Benchmark checkouts sent one request at a time against POST /api/circulation/batch.
+
+For each backend (in memory, in memory with a journal fsynced on every
+record, and a SQLite file) it lends and then returns --ops books through
+the Flask test client, first with one borrow/return request per book and
+then in batches of each --batch-sizes size, and reports as JSON the
+operations per second of each.
+
+Usage:
+    python benchmarks/bench_circulation.py --books 10000 --ops 2000 --batch-sizes 10,100,1000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.pop("LIBRARY_DATA_DIR", None)
+os.environ.pop("LIBRARY_BACKEND", None)
+os.environ["LIBRARY_OVERDUE_INTERVAL"] = "0"
+
+import index  # noqa: E402
+from sqlite_library import SqliteLibrary  # noqa: E402
+from storage import LibraryStore  # noqa: E402
+
+GENRES = ["Fantasy", "Science Fiction", "Romance", "Horror", "Fiction",
+          "Mystery", "Thriller", "Biography", "History", "Self-Help"]
+
+
+def make_books(count: int) -> List[index.Book]:
+    return [index.Book(f"Title {i}", f"Author {i % 5000}", GENRES[i % len(GENRES)], 1900 + i % 120)
+            for i in range(count)]
+
+
+def backends(directory: str, count: int) -> Dict[str, Callable[[], Any]]:
+    def memory() -> Any:
+        library = index.Library()
+        library.add_books(make_books(count))
+        return library
+
+    def journaled() -> Any:
+        library = index.Library()
+        store = LibraryStore(os.path.join(directory, f"journal-{time.monotonic_ns()}"), snapshot_every=0)
+        store.load(library)
+        library.add_books(make_books(count))
+        return library
+
+    def sqlite() -> Any:
+        library = SqliteLibrary(os.path.join(directory, f"library-{time.monotonic_ns()}.db"), index.Book)
+        library.add_books(make_books(count))
+        return library
+
+    return {"memory": memory, "journaled": journaled, "sqlite": sqlite}
+
+
+def ops_per_second(library: Any, ids: List[str], batch_size: int) -> float:
+    """Lend and then return every book of ids; 0 sends one request per operation."""
+    index.library = library
+    client = index.app.test_client()
+    started = time.perf_counter()
+    for op in ("borrow", "return"):
+        if batch_size == 0:
+            for book_id in ids:
+                response = client.post(f"/api/books/{book_id}/{op}", json={"borrower": "Desk"})
+                assert response.status_code == 200, response.get_json()
+            continue
+        for start in range(0, len(ids), batch_size):
+            operations = [{"op": op, "id": book_id, "borrower": "Desk"}
+                          for book_id in ids[start:start + batch_size]]
+            response = client.post("/api/circulation/batch", json={"operations": operations})
+            assert response.status_code == 200, response.get_json()
+    return 2 * len(ids) / (time.perf_counter() - started)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--ops", type=int, default=2000, help="books lent and returned per measurement")
+    parser.add_argument("--batch-sizes", default="10,100,1000")
+    parser.add_argument("--backends", help="comma-separated subset of memory,journaled,sqlite")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.batch_sizes.split(",")]
+    ids = [str(i) for i in range(1, min(args.ops, args.books) + 1)]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        factories = backends(directory, args.books)
+        names = args.backends.split(",") if args.backends else list(factories)
+        for name in names:
+            result = {"single_requests": round(ops_per_second(factories[name](), ids, 0))}
+            for size in sizes:
+                result[f"batches_of_{size}"] = round(ops_per_second(factories[name](), ids, size))
+            results[name] = result
+    print(json.dumps({"python": sys.version.split()[0], "operations": 2 * len(ids),
+                      "ops_per_second": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Benchmark cold starts of the Flask app.
+
+Each scenario starts fresh Python processes that import index and serve a
+first and a second request through the test client, and reports (median
+over --repeat runs) the time to import the app, the time until the first
+response (which opens the library) and the second response, and the
+wall time of the whole process including interpreter startup.
+
+Scenarios: an empty library, the sample books (LIBRARY_SEED=sample), and a
+catalogue of --books books loaded from a JSON lines snapshot, from a binary
+snapshot image (both under LIBRARY_DATA_DIR), from a prebuilt image
+(LIBRARY_IMAGE) and from SQLite.
+
+Usage:
+    python benchmarks/bench_cold_start.py --books 100000 --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The parent process only builds the catalogues
+os.environ.pop("LIBRARY_DATA_DIR", None)
+os.environ.pop("LIBRARY_BACKEND", None)
+os.environ.pop("LIBRARY_IMAGE", None)
+os.environ.pop("LIBRARY_SEED", None)
+
+from index import Book, Library  # noqa: E402
+from sqlite_library import SqliteLibrary  # noqa: E402
+from storage import LibraryStore  # noqa: E402
+
+GENRES = ["Fantasy", "Science Fiction", "Romance", "Horror", "Fiction",
+          "Mystery", "Thriller", "Biography", "History", "Self-Help"]
+
+# Run in each child process; prints its timings as JSON
+CHILD = """
+import json, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+client = index.app.test_client()
+assert client.get("/api/books?limit=20").status_code == 200
+first = time.perf_counter()
+assert client.get("/api/books/1").status_code in (200, 404)
+second = time.perf_counter()
+print(json.dumps({"import_seconds": imported - started, "first_request_seconds": first - started,
+                  "second_request_ms": (second - first) * 1000, "books": len(index.library)}))
+"""
+
+
+def make_books(count: int) -> List[Book]:
+    books = []
+    for i in range(count):
+        book = Book(f"Title {i}", f"Author {i % 5000}", GENRES[i % len(GENRES)],
+                    1900 + i % 120, str(9780000000000 + i))
+        book.description = f"Description of book {i}. " * 10
+        books.append(book)
+    return books
+
+
+def build_catalogues(directory: str, count: int) -> Dict[str, Dict[str, str]]:
+    """Write the catalogue in each stored form; return each scenario's environment."""
+    library = Library()
+    library.add_books(make_books(count))
+    for i in range(1, count + 1, 10):
+        library.borrow_book(str(i), "Reader")
+
+    environments = {"empty": {}, "sample": {"LIBRARY_SEED": "sample"}}
+    for name, images in (("jsonl_snapshot", False), ("image_snapshot", True)):
+        data_dir = os.path.join(directory, name)
+        store = LibraryStore(data_dir, snapshot_every=0, images=images)
+        store.load(library)
+        store.snapshot()
+        store.close()
+        library.store = None
+        environments[name] = {"LIBRARY_DATA_DIR": data_dir}
+
+    image = os.path.join(directory, "catalogue.img")
+    library.save_image(image, {})
+    environments["prebuilt_image"] = {"LIBRARY_IMAGE": image}
+
+    db_path = os.path.join(directory, "library.db")
+    sqlite = SqliteLibrary(db_path, Book)
+    sqlite.add_books(make_books(count))
+    sqlite.close()
+    environments["sqlite"] = {"LIBRARY_BACKEND": "sqlite", "LIBRARY_DB_PATH": db_path}
+    return environments
+
+
+def run(environment: Dict[str, str], repeat: int) -> Dict[str, Any]:
+    """Start repeat fresh processes and report the median of each timing."""
+    env = dict(os.environ, LIBRARY_OVERDUE_INTERVAL="0", PYTHONPATH=ROOT, **environment)
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", CHILD], env=env, cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        timings = json.loads(output)
+        timings["process_seconds"] = time.perf_counter() - started
+        runs.append(timings)
+    result = {"books": runs[0]["books"]}
+    for key in ("import_seconds", "first_request_seconds", "second_request_ms", "process_seconds"):
+        result[key] = round(statistics.median(run[key] for run in runs), 4)
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--books", type=int, default=100000, help="catalogue size of the stored scenarios")
+    parser.add_argument("--repeat", type=int, default=5, help="processes started per scenario")
+    parser.add_argument("--scenarios", help="comma-separated subset of the scenarios to run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        environments = build_catalogues(directory, args.books)
+        names = args.scenarios.split(",") if args.scenarios else list(environments)
+        results = {name: run(environments[name], args.repeat) for name in names}
+    print(json.dumps({"python": sys.version.split()[0], "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+Benchmark the library at scale and check for regressions.
+
+Builds synthetic catalogues of each requested size and times the core
+operations of index.Library and library_manager.Library, then drives the
+Flask routes through the test client. Reports throughput, p50/p99 latency
+and the peak memory of building each catalogue as JSON.
+
+With --baseline, results are compared with a stored run: a drop in
+throughput or a rise in peak memory beyond --tolerance is a regression and
+the exit status is 1. --save-baseline stores the current run.
+
+Usage:
+    python benchmarks/bench_library.py --sizes 10000,100000 --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_library.py --sizes 10000,100000 --baseline benchmarks/baseline.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Measure the library alone: no journal and no overdue scheduler thread
+os.environ.pop("LIBRARY_DATA_DIR", None)
+os.environ.pop("LIBRARY_BACKEND", None)
+os.environ["LIBRARY_OVERDUE_INTERVAL"] = "0"
+
+import index  # noqa: E402
+import library_manager  # noqa: E402
+
+GENRES = ["Fantasy", "Science Fiction", "Romance", "Horror", "Fiction",
+          "Mystery", "Thriller", "Biography", "History", "Self-Help"]
+AUTHORS = 5000
+
+Result = Dict[str, Any]
+
+
+def make_book(book_class: Callable[..., Any], i: int) -> Any:
+    return book_class(f"Title {i}", f"Author {i % AUTHORS}", GENRES[i % len(GENRES)],
+                      1900 + i % 120, str(9780000000000 + i))
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(operation: Callable[..., Any], arguments: Iterable[Tuple[Any, ...]],
+            samples: int, budget: float) -> Result:
+    """Time operation once per argument tuple, up to samples calls or budget seconds."""
+    latencies = []
+    deadline = time.perf_counter() + budget
+    for args in arguments:
+        started = time.perf_counter()
+        operation(*args)
+        finished = time.perf_counter()
+        latencies.append(finished - started)
+        if len(latencies) >= samples or finished > deadline:
+            break
+    total = sum(latencies)
+    return {
+        "samples": len(latencies),
+        "ops_per_sec": round(len(latencies) / total, 1) if total else None,
+        "p50_us": round(percentile(latencies, 0.5) * 1e6, 2),
+        "p99_us": round(percentile(latencies, 0.99) * 1e6, 2),
+    }
+
+
+def build(create: Callable[[], Any], add: Callable[[Any, int], None], count: int) -> Tuple[Any, Result]:
+    """Build a catalogue of count books, tracking time and peak traced memory."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    library = create()
+    for i in range(count):
+        add(library, i)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return library, {
+        "seconds": round(elapsed, 3),
+        "peak_bytes": peak,
+        "bytes_per_book": round(peak / count, 1),
+    }
+
+
+def bench_index(count: int, samples: int, budget: float, rng: random.Random) -> Tuple[index.Library, Dict[str, Result]]:
+    library, build_result = build(index.Library, lambda lib, i: lib.add_book(make_book(index.Book, i)), count)
+    results = {"build": build_result}
+    # Distinct books, so every borrow and return succeeds
+    ids = [str(i) for i in rng.sample(range(1, count + 1), min(samples, count))]
+    authors = [(f"Author {rng.randrange(AUTHORS)}",) for _ in range(samples)]
+
+    results["add_book"] = measure(library.add_book, ((make_book(index.Book, count + i),) for i in range(samples)),
+                                  samples, budget)
+    results["get_book"] = measure(library.get_book, ((book_id,) for book_id in ids), samples, budget)
+    results["search_books"] = measure(library.search_books, authors, samples, budget)
+    results["borrow_book"] = measure(library.borrow_book, ((book_id, "Reader") for book_id in ids), samples, budget)
+    results["return_book"] = measure(library.return_book, ((book_id,) for book_id in ids), samples, budget)
+    results["get_stats"] = measure(library.get_stats, (() for _ in range(samples)), samples, budget)
+    results["get_recently_added_books"] = measure(library.get_recently_added_books, (() for _ in range(samples)),
+                                                  samples, budget)
+    victims = rng.sample(range(1, count + 1), min(samples, count))
+    results["delete_book"] = measure(library.delete_book, ((str(i),) for i in victims), samples, budget)
+    return library, results
+
+
+def bench_library_manager(count: int, samples: int, budget: float, rng: random.Random) -> Dict[str, Result]:
+    # library_manager reports every call on stdout
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        library, build_result = build(library_manager.Library,
+                                      lambda lib, i: lib.add_book(make_book(library_manager.Book, i)), count)
+        results = {"build": build_result}
+        titles = [f"Title {i}" for i in rng.sample(range(count), min(samples, count))]
+        authors = [(f"Author {rng.randrange(AUTHORS)}",) for _ in range(samples)]
+
+        results["add_book"] = measure(library.add_book,
+                                      ((make_book(library_manager.Book, count + i),) for i in range(samples)),
+                                      samples, budget)
+        results["search_books"] = measure(library.search_books, authors, samples, budget)
+        results["borrow_book"] = measure(library.borrow_book, ((title, "Reader") for title in titles),
+                                         samples, budget)
+        results["return_book"] = measure(library.return_book, ((title,) for title in titles), samples, budget)
+        results["get_stats"] = measure(library.get_statistics, (() for _ in range(samples)), samples, budget)
+        victims = rng.sample(range(count), min(samples, count))
+        results["delete_book"] = measure(library.remove_book, ((f"Title {i}",) for i in victims), samples, budget)
+    return results
+
+
+def bench_routes(library: index.Library, samples: int, budget: float, rng: random.Random) -> Dict[str, Result]:
+    # The routes read the module-level library at call time
+    index.library = library
+    client = index.app.test_client()
+    ids = rng.sample(list(library.books), min(samples, len(library)))
+
+    def call(method: str, path: str, body: Optional[Dict[str, Any]] = None) -> None:
+        response = client.open(path, method=method, json=body)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}")
+
+    routes = {
+        "GET /api/books/<id>": (("GET", f"/api/books/{book_id}") for book_id in ids),
+        "GET /api/books": (("GET", "/api/books?limit=100") for _ in ids),
+        "GET /api/books?genre=": (("GET", f"/api/books?genre={rng.choice(GENRES)}&limit=100") for _ in ids),
+        "GET /api/books/search": (("GET", f"/api/books/search?q=Author+{rng.randrange(AUTHORS)}&limit=20")
+                                  for _ in ids),
+        "POST /api/books/<id>/borrow": (("POST", f"/api/books/{book_id}/borrow", {"borrower": "Reader"})
+                                        for book_id in ids),
+        "POST /api/books/<id>/return": (("POST", f"/api/books/{book_id}/return") for book_id in ids),
+        "GET /api/stats": (("GET", "/api/stats") for _ in ids),
+        "GET /api/books/recent": (("GET", "/api/books/recent") for _ in ids),
+        "GET /api/dashboard": (("GET", "/api/dashboard?limit=20") for _ in ids),
+    }
+    return {route: measure(call, arguments, samples, budget) for route, arguments in routes.items()}
+
+
+def flatten(run: Dict[str, Any]) -> Dict[str, Result]:
+    """Key every measurement by "books/target/operation"."""
+    return {f"{size}/{target}/{operation}": result
+            for size, targets in run["results"].items()
+            for target, operations in targets.items()
+            for operation, result in operations.items()}
+
+
+def compare(run: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Describe every measurement that regressed beyond tolerance."""
+    regressions = []
+    current, previous = flatten(run), flatten(baseline)
+    for key, result in current.items():
+        before = previous.get(key)
+        if before is None:
+            continue
+        if result.get("ops_per_sec") and before.get("ops_per_sec"):
+            if result["ops_per_sec"] < before["ops_per_sec"] * (1 - tolerance):
+                regressions.append(f"{key}: {result['ops_per_sec']} ops/s, "
+                                   f"baseline {before['ops_per_sec']} ops/s")
+        if result.get("peak_bytes") and before.get("peak_bytes"):
+            if result["peak_bytes"] > before["peak_bytes"] * (1 + tolerance):
+                regressions.append(f"{key}: peak {result['peak_bytes']} bytes, "
+                                   f"baseline {before['peak_bytes']} bytes")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000",
+                        help="comma-separated catalogue sizes (e.g. 10000,100000,1000000)")
+    parser.add_argument("--samples", type=int, default=2000, help="calls timed per operation")
+    parser.add_argument("--budget", type=float, default=5.0,
+                        help="seconds allowed per operation (linear-time ones stop early)")
+    parser.add_argument("--targets", default="index,library_manager,routes")
+    parser.add_argument("--baseline", help="stored run to compare with")
+    parser.add_argument("--save-baseline", help="store this run here")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown or memory growth")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    targets = set(args.targets.split(","))
+    run = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "samples": args.samples,
+        "results": {},
+    }
+    for size in (int(size) for size in args.sizes.split(",")):
+        rng = random.Random(args.seed)
+        results = run["results"][str(size)] = {}
+        if targets & {"index", "routes"}:
+            library, index_results = bench_index(size, args.samples, args.budget, rng)
+            if "index" in targets:
+                results["index.Library"] = index_results
+            if "routes" in targets:
+                results["flask"] = bench_routes(library, args.samples, args.budget, rng)
+            del library
+        if "library_manager" in targets:
+            results["library_manager.Library"] = bench_library_manager(size, args.samples, args.budget, rng)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        run["regressions"] = compare(run, baseline, args.tolerance)
+        status = 1 if run["regressions"] else 0
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+
+    print(json.dumps(run, indent=2))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
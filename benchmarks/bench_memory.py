@@ -0,0 +1,79 @@
+"""
+Compare the memory footprint of the slotted Book classes with the original
+dict-backed implementation.
+
+Usage:
+    python benchmarks/bench_memory.py --books 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import index  # noqa: E402
+import library_manager  # noqa: E402
+
+GENRES = ["Fantasy", "Science Fiction", "Romance", "Horror", "Fiction",
+          "Mystery", "Thriller", "Biography", "History", "Self-Help"]
+
+
+class LegacyBook:
+    """The Book class from index.py before it was slotted."""
+
+    def __init__(self, title, author, genre, publication_year=None, isbn=None):
+        self.id = None
+        self.title = title
+        self.author = author
+        self.genre = genre
+        self.publication_year = publication_year
+        self.isbn = isbn
+        self.date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.is_borrowed = False
+        self.borrowed_date = None
+        self.return_date = None
+        self.borrower = None
+        self.description = None
+
+
+def measure(book_class, count: int) -> dict:
+    """Allocate count books (half of them borrowed) and report the bytes used."""
+    gc.collect()
+    tracemalloc.start()
+    books = []
+    for i in range(count):
+        # Genre and author strings arrive fresh from parsing, as they would from JSON
+        book = book_class(f"Title {i}", "".join(["Author ", str(i % 5000)]),
+                          "".join([GENRES[i % len(GENRES)]]), 1900 + i % 120, str(9780000000000 + i))
+        if i % 2:
+            book.is_borrowed = True
+            book.borrowed_date = datetime.now().strftime("%Y-%m-%d")
+        books.append(book)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "class": f"{book_class.__module__}.{book_class.__qualname__}",
+        "books": count,
+        "bytes": current,
+        "bytes_per_book": round(current / count, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--books", type=int, default=1000000)
+    args = parser.parse_args()
+
+    results = [measure(cls, args.books) for cls in (LegacyBook, index.Book, library_manager.Book)]
+    baseline = results[0]["bytes"]
+    for result in results:
+        result["relative_to_legacy"] = round(result["bytes"] / baseline, 3)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark GET /api/books/<id>/similar.
+
+Builds a catalogue of --books books with descriptions, and --loans loans by
+--readers readers who each favour a few genres, then reports as JSON:
+
+- the first lookup, which builds the recommender from every book and loan;
+- lookups of books whose neighbours are cached, and of books whose are not;
+- lookups right after --batch more loans, which are fed in incrementally.
+
+Usage:
+    python benchmarks/bench_recommendations.py --books 100000 --loans 200000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Measure the library alone: no journal and no overdue scheduler thread
+os.environ.pop("LIBRARY_DATA_DIR", None)
+os.environ.pop("LIBRARY_BACKEND", None)
+os.environ["LIBRARY_OVERDUE_INTERVAL"] = "0"
+
+import index  # noqa: E402
+
+GENRES = ["Fantasy", "Science Fiction", "Romance", "Horror", "Fiction",
+          "Mystery", "Thriller", "Biography", "History", "Self-Help"]
+WORDS = [f"word{i}" for i in range(5000)]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def latencies_ms(values: List[float]) -> Dict[str, Any]:
+    return {
+        "samples": len(values),
+        "p50_ms": round(percentile(values, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--loans", type=int, default=200000)
+    parser.add_argument("--readers", type=int, default=5000)
+    parser.add_argument("--samples", type=int, default=500, help="lookups per measurement")
+    parser.add_argument("--batch", type=int, default=100, help="loans made between incremental lookups")
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    library = index.Library()
+    books = []
+    for i in range(args.books):
+        book = index.Book(f"Title {i}", f"Author {i % 5000}", GENRES[i % len(GENRES)], 1900 + i % 120)
+        book.description = " ".join(rng.choices(WORDS, k=40))
+        books.append(book)
+    library.add_books(books)
+    by_genre = {genre: [str(i + 1) for i in range(args.books) if i % len(GENRES) == genre_index]
+                for genre_index, genre in enumerate(GENRES)}
+    tastes = {f"Reader {n}": rng.sample(GENRES, 2) for n in range(args.readers)}
+
+    def lend(count: int) -> None:
+        for _ in range(count):
+            reader = rng.choice(list(tastes))
+            book_id = rng.choice(by_genre[rng.choice(tastes[reader])])
+            if library.borrow_book(book_id, reader):
+                library.return_book(book_id)
+
+    lend(args.loans)
+    index.library = library
+    client = index.app.test_client()
+
+    def lookup(book_id: str) -> float:
+        started = time.perf_counter()
+        response = client.get(f"/api/books/{book_id}/similar?fields=id,title")
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"similar of {book_id} returned {response.status_code}")
+        return elapsed
+
+    first = lookup("1")
+
+    ids = [str(i) for i in rng.sample(range(1, args.books + 1), args.samples)]
+    # A book's first lookup computes its lists; the second is served from the cache
+    misses = [lookup(book_id) for book_id in ids]
+    hits = [lookup(book_id) for book_id in ids]
+    incremental = []
+    for book_id in ids[:max(1, args.samples // 10)]:
+        lend(args.batch)
+        incremental.append(lookup(book_id))
+
+    print(json.dumps({
+        "python": sys.version.split()[0],
+        "books": args.books,
+        "loans": len(library.loans),
+        "first_lookup_seconds": round(first, 3),
+        "cached_lookup": latencies_ms(hits),
+        "uncached_lookup": latencies_ms(misses),
+        f"lookup_after_{args.batch}_loans": latencies_ms(incremental),
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Benchmark LibraryStore: snapshot writing and cold-start loading (JSON lines
+and binary images), and journal append throughput for the Flask app's
+Library.
+
+Usage:
+    python benchmarks/bench_storage.py --books 1000000 --appends 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index import Book, Library  # noqa: E402
+from storage import LibraryStore  # noqa: E402
+
+GENRES = ["Fantasy", "Science Fiction", "Romance", "Horror", "Fiction",
+          "Mystery", "Thriller", "Biography", "History", "Self-Help"]
+
+
+def build_library(count: int) -> Library:
+    """Create an in-memory library of synthetic books."""
+    library = Library()
+    for i in range(count):
+        book = Book(f"Title {i}", f"Author {i % 5000}", GENRES[i % len(GENRES)],
+                    1900 + i % 120, f"{9780000000000 + i}")
+        library.add_book(book)
+    return library
+
+
+def bench_snapshot(directory: str, library: Library, images: bool) -> dict:
+    """Time writing a snapshot (JSON lines, plus a binary image if images) and loading it back."""
+    store = LibraryStore(directory, snapshot_every=0, images=images)
+    store.load(library)
+
+    start = time.perf_counter()
+    store.snapshot()
+    write_seconds = time.perf_counter() - start
+    store.close()
+    library.store = None
+
+    start = time.perf_counter()
+    restored = LibraryStore(directory, snapshot_every=0).load(Library())
+    load_seconds = time.perf_counter() - start
+    restored.store.close()
+
+    assert len(restored.books) == len(library.books)
+    return {
+        "format": "image" if images else "jsonl",
+        "books": len(library.books),
+        "snapshot_bytes": os.path.getsize(store.image_path if images else store.snapshot_path),
+        "snapshot_write_seconds": round(write_seconds, 3),
+        "cold_start_seconds": round(load_seconds, 3),
+    }
+
+
+def bench_journal(directory: str, appends: int, fsync_every: int) -> dict:
+    """Time borrow/return appends with a given fsync batch size."""
+    library = build_library(1000)
+    store = LibraryStore(directory, fsync_every=fsync_every, snapshot_every=0)
+    store.load(library)
+
+    start = time.perf_counter()
+    for i in range(appends):
+        book_id = str(i % 1000 + 1)
+        if library.get_book(book_id).is_borrowed:
+            library.return_book(book_id)
+        else:
+            library.borrow_book(book_id, "Reader")
+    store.sync()
+    seconds = time.perf_counter() - start
+    store.close()
+
+    return {
+        "fsync_every": fsync_every,
+        "appends": appends,
+        "appends_per_second": round(appends / seconds),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--books", type=int, default=1000000)
+    parser.add_argument("--appends", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {"snapshot": [], "journal": []}
+    with tempfile.TemporaryDirectory() as directory:
+        library = build_library(args.books)
+        for images in (False, True):
+            path = os.path.join(directory, "image" if images else "jsonl")
+            results["snapshot"].append(bench_snapshot(path, library, images))
+        del library
+        for fsync_every in (1, 64, 0):
+            path = os.path.join(directory, f"journal-{fsync_every}")
+            results["journal"].append(bench_journal(path, args.appends, fsync_every))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Load-test a running API server: the dashboard fetched route by route versus
+the combined /api/dashboard payload, plus book detail pages.
+
+Start the servers to compare (same data, different ports), e.g.
+
+    flask --app index run --port 5328 --with-threads
+    uvicorn asgi:app --port 8000
+
+then:
+
+    python benchmarks/load_test.py --target flask=http://127.0.0.1:5328 \\
+        --target asgi=http://127.0.0.1:8000 --concurrency 32 --seconds 10
+
+Each simulated client keeps one HTTP/1.1 connection open and loads pages
+back to back. Reports pages/s, requests/s and p50/p99 page latency per
+target and scenario as JSON.
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# The requests one page load makes, per scenario
+SCENARIOS = {
+    "dashboard_separate": ["/api/stats", "/api/books?limit=100", "/api/books/recent",
+                           "/api/books/borrowed"],
+    "dashboard_combined": ["/api/dashboard?limit=100"],
+    "book_detail": ["/api/books/1"],
+}
+
+
+class Connection:
+    """Minimal keep-alive HTTP/1.1 client for GET requests."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def get(self, path: str) -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode())
+        await self.writer.drain()
+
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        if "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            parts = []
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                parts.append(await self.reader.readexactly(size + 2))
+                if size == 0:
+                    break
+            body = b"".join(part[:-2] for part in parts)
+        else:
+            body = await self.reader.read()
+            headers["connection"] = "close"
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, body
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_scenario(url: str, paths: List[str], concurrency: int, seconds: float) -> Dict[str, float]:
+    parts = urlsplit(url)
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client() -> None:
+        nonlocal errors
+        connection = Connection(parts.hostname, parts.port or 80)
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                for path in paths:
+                    status, _ = await connection.get(path)
+                    if status >= 400:
+                        errors += 1
+                latencies.append(time.perf_counter() - started)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "pages": len(latencies),
+        "pages_per_second": round(len(latencies) / elapsed, 1),
+        "requests_per_second": round(len(latencies) * len(paths) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "errors": errors,
+    }
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Dict[str, Dict[str, float]]]:
+    results = {}
+    for target in args.target:
+        name, _, url = target.partition("=")
+        results[name] = {}
+        for scenario in args.scenario or SCENARIOS:
+            results[name][scenario] = await run_scenario(url, SCENARIOS[scenario],
+                                                         args.concurrency, args.seconds)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--target", action="append", required=True,
+                        help="name=url of a running server; repeat to compare")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Hammer index.Library from many threads and check its invariants.
+
+Threads race to borrow and return a small set of books (so most attempts
+collide), while others add books and read listings. Afterwards every book
+must have exactly one more successful borrow than return if it is
+borrowed (and equal counts otherwise), the borrowed counter must match
+the books, and added books must have unique ids. Exits non-zero on any
+violation.
+
+Usage:
+    python benchmarks/stress_concurrency.py --threads 16 --ops 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index import Book, Library  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=20000, help="operations per thread")
+    parser.add_argument("--books", type=int, default=8, help="books contended for")
+    args = parser.parse_args()
+
+    # Switch threads as often as possible to provoke interleavings
+    sys.setswitchinterval(1e-6)
+
+    library = Library()
+    book_ids = [library.add_book(Book(f"Title {i}", "Author", "Genre")).id
+                for i in range(args.books)]
+    borrows = Counter()
+    returns = Counter()
+    added = []
+    counts_lock = threading.Lock()
+    start_barrier = threading.Barrier(args.threads)
+
+    def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        local_borrows, local_returns, local_added = Counter(), Counter(), []
+        start_barrier.wait()
+        for _ in range(args.ops):
+            action = rng.random()
+            book_id = rng.choice(book_ids)
+            if action < 0.45:
+                if library.borrow_book(book_id, f"reader-{seed}"):
+                    local_borrows[book_id] += 1
+            elif action < 0.9:
+                if library.return_book(book_id):
+                    local_returns[book_id] += 1
+            elif action < 0.95:
+                local_added.append(library.add_book(Book("Extra", f"Author {seed}", "Genre")).id)
+            else:
+                library.get_borrowed_books_json()
+                library.search_books("title")
+        with counts_lock:
+            borrows.update(local_borrows)
+            returns.update(local_returns)
+            added.extend(local_added)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    errors = []
+    for book_id in book_ids:
+        expected = 1 if library.get_book(book_id).is_borrowed else 0
+        if borrows[book_id] - returns[book_id] != expected:
+            errors.append(f"book {book_id}: {borrows[book_id]} borrows, "
+                          f"{returns[book_id]} returns, is_borrowed={bool(expected)}")
+    actual_borrowed = sum(1 for book in library.books.values() if book.is_borrowed)
+    if library.stats.borrowed_books != actual_borrowed:
+        errors.append(f"borrowed counter {library.stats.borrowed_books} != {actual_borrowed}")
+    if len(set(added)) != len(added):
+        errors.append("duplicate ids handed out by add_book")
+    if library.stats.total_books != len(library.books) or len(library.books) != args.books + len(added):
+        errors.append("total_books does not match the catalogue")
+
+    print(json.dumps({
+        "threads": args.threads,
+        "operations": args.threads * args.ops,
+        "seconds": round(elapsed, 3),
+        "successful_borrows": sum(borrows.values()),
+        "successful_returns": sum(returns.values()),
+        "books_added": len(added),
+        "errors": errors,
+    }, indent=2))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+from typing import Any, Dict
+
+from timestamps import to_day, to_timestamp, today
+
+# Book fields that hold text (or None)
+TEXT_FIELDS = ("title", "author", "genre", "isbn", "borrower", "description")
+
+# Date fields and the conversion that checks them
+DATE_FIELDS = (("date_added", to_timestamp), ("borrowed_date", to_day), ("return_date", to_day))
+
+
+def check_book_data(data: Dict[str, Any]) -> None:
+    """
+    Check the values of book fields before any of them is stored.
+
+    Only the fields present in data are checked; None is always allowed.
+
+    Raises:
+        ValueError: If data is not an object, a text field is not a
+            string, publication_year is not an integer, is_borrowed is not
+            a boolean or a date is invalid
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Book data must be an object")
+    for field in TEXT_FIELDS:
+        if data.get(field) is not None and not isinstance(data[field], str):
+            raise ValueError(f"{field} must be a string")
+    year = data.get("publication_year")
+    if year is not None and (not isinstance(year, int) or isinstance(year, bool)):
+        raise ValueError("publication_year must be an integer")
+    if data.get("is_borrowed") is not None and not isinstance(data["is_borrowed"], bool):
+        raise ValueError("is_borrowed must be a boolean")
+    for field, convert in DATE_FIELDS:
+        if data.get(field) is not None:
+            convert(data[field])
+
+
+def lending_changes(data: Dict[str, Any], was_borrowed: bool) -> Dict[str, Any]:
+    """
+    Complete checked changes to a book that lend it, as borrowing it would.
+
+    Changes setting is_borrowed on a book that was not borrowed must name
+    the borrower, and the book is lent today unless they give a
+    borrowed_date. Other changes are returned as they are.
+
+    Raises:
+        ValueError: If the changes lend the book to no one
+    """
+    if not data.get("is_borrowed") or was_borrowed:
+        return data
+    if not data.get("borrower"):
+        raise ValueError("Borrower name is required")
+    if data.get("borrowed_date") is None:
+        data = dict(data, borrowed_date=today())
+    return data
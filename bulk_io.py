@@ -0,0 +1,156 @@
+import csv
+import io
+import json
+from itertools import islice
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from book_data import check_book_data
+
+# Columns written by CSV exports and understood by CSV imports
+CSV_FIELDS = ("id", "title", "author", "genre", "publication_year", "isbn", "date_added",
+              "is_borrowed", "borrowed_date", "return_date", "borrower", "description")
+
+REQUIRED_FIELDS = ("title", "author", "genre")
+
+# Books inserted per batch during an import
+DEFAULT_BATCH_SIZE = 1000
+
+# Per-row errors reported back for one import; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = ("ndjson", "csv")
+
+
+def detect_format(name: Optional[str]) -> str:
+    """Guess the format from a content type or file name (default NDJSON)."""
+    if name and ("csv" in name.lower()):
+        return "csv"
+    return "ndjson"
+
+
+def read_rows(stream: IO[str], fmt: str) -> Iterator[Tuple[int, Any]]:
+    """
+    Yield (row number, record) pairs from an NDJSON or CSV text stream.
+
+    Rows are read one at a time, so memory use does not depend on the size
+    of the input. A row that cannot be parsed yields a ValueError instead
+    of a record. Blank NDJSON lines are skipped.
+    """
+    if fmt == "csv":
+        for number, row in enumerate(csv.DictReader(stream), 1):
+            yield number, row
+        return
+
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            yield number, ValueError(f"Invalid JSON: {e}")
+
+
+def _optional(value: Any) -> Any:
+    return None if value == "" else value
+
+
+def validate_book_data(record: Any) -> Dict[str, Any]:
+    """
+    Check an imported row and normalize its values.
+
+    Returns:
+        The row without empty cells or nulls, with publication_year as an
+        int and is_borrowed as a bool
+
+    Raises:
+        ValueError: If the row is not an object or a field is invalid
+    """
+    if isinstance(record, ValueError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("Row must be an object")
+
+    # Empty cells and nulls are left out, so the book gets its defaults
+    data = {key: value for key, value in record.items()
+            if key in CSV_FIELDS and _optional(value) is not None}
+    for field in REQUIRED_FIELDS:
+        if not isinstance(data.get(field), str) or not data[field].strip():
+            raise ValueError(f"Missing required field: {field}")
+
+    year = data.get("publication_year")
+    if year is not None:
+        try:
+            data["publication_year"] = int(year)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid publication_year: {year!r}")
+
+    borrowed = data.get("is_borrowed")
+    if isinstance(borrowed, str):
+        data["is_borrowed"] = borrowed.strip().lower() in ("1", "true", "yes")
+    elif borrowed is not None:
+        data["is_borrowed"] = bool(borrowed)
+
+    if data.get("isbn") is not None:
+        data["isbn"] = str(data["isbn"])
+    check_book_data(data)
+    # Imported books always get new ids
+    data.pop("id", None)
+    return data
+
+
+def batched(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Split an iterable into lists of at most size items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_rows(rows: Iterable[Tuple[int, Any]], insert_batch,
+                batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Validate rows and hand the valid ones to insert_batch in batches.
+
+    Args:
+        rows: (row number, record) pairs, as produced by read_rows
+        insert_batch: Called with each list of validated book dicts
+        batch_size: Number of books per insert_batch call
+
+    Returns:
+        A summary with imported and failed counts and per-row errors
+    """
+    summary = {"imported": 0, "failed": 0, "errors": []}
+
+    def valid_rows():
+        for number, record in rows:
+            try:
+                yield validate_book_data(record)
+            except ValueError as e:
+                summary["failed"] += 1
+                if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                    summary["errors"].append({"row": number, "error": str(e)})
+
+    for batch in batched(valid_rows(), batch_size):
+        insert_batch(batch)
+        summary["imported"] += len(batch)
+    return summary
+
+
+def export_chunks(records: Iterable[Dict[str, Any]], fmt: str) -> Iterator[str]:
+    """Yield the records as NDJSON lines or CSV rows (after a header row)."""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+        return
+
+    for record in records:
+        yield json.dumps(record, separators=(",", ":")) + "\n"
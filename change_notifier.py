@@ -0,0 +1,87 @@
+import contextlib
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+# The file holds one little-endian signed 64-bit version
+_VERSION = struct.Struct("<q")
+
+
+class ChangeNotifier:
+    """
+    Version of a shared store, published to every process through a file.
+
+    Worker processes serving one SQLite database each map the same small
+    file. After committing a change, a writer publishes the store's new
+    version; readers see it with a plain memory read, so checking whether
+    their caches are current costs no query and no system call. Publishing
+    takes an exclusive lock on the file and only ever raises the version,
+    so writers finishing out of order cannot move it back.
+
+    A writer that dies between its commit and publish() would leave the
+    version stale, so readers also compare it with the store itself
+    (through read_version) every check_interval seconds.
+    """
+
+    def __init__(self, path: str, read_version: Callable[[], int], check_interval: float = 1.0):
+        """Map the version file at path, creating it if needed."""
+        self.path = path
+        self.read_version = read_version
+        self.check_interval = check_interval
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        # flock excludes other processes only; threads of this one take
+        # turns on this lock, which also lets lock() be nested
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        with self.lock():
+            if os.fstat(self._fd).st_size < _VERSION.size:
+                os.ftruncate(self._fd, _VERSION.size)
+        self._map = mmap.mmap(self._fd, _VERSION.size)
+        self._checked = 0.0
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        """Hold the exclusive lock on the version file, shared by every process."""
+        with self._thread_lock:
+            if not self._depth:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def version(self) -> int:
+        """The latest published version of the store."""
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            self._checked = now
+            self.publish(self.read_version())
+        return _VERSION.unpack_from(self._map)[0]
+
+    def publish(self, version: int) -> None:
+        """Announce that the store has reached version."""
+        if _VERSION.unpack_from(self._map)[0] >= version:
+            return
+        with self.lock():
+            if _VERSION.unpack_from(self._map)[0] < version:
+                _VERSION.pack_into(self._map, 0, version)
+
+    def close(self) -> None:
+        """Unmap and close the version file."""
+        self._map.close()
+        os.close(self._fd)
+
+
+def for_database(path: str, read_version: Callable[[], int]) -> Optional[ChangeNotifier]:
+    """Notifier for the SQLite database at path (None for in-memory databases)."""
+    if path == ":memory:":
+        return None
+    return ChangeNotifier(f"{path}-version", read_version)
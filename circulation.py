@@ -0,0 +1,132 @@
+from typing import Any, Callable, Dict, List, Optional
+
+from book_data import check_book_data, lending_changes
+from timestamps import to_day
+
+# Operations accepted by apply_batch
+OPERATIONS = ("borrow", "return", "update")
+
+# Why an operation of a rejected batch failed
+INVALID = "invalid"
+NOT_FOUND = "not_found"
+CONFLICT = "conflict"
+
+
+class BatchRejected(ValueError):
+    """
+    Raised by apply_batch when any operation of a batch fails.
+
+    Nothing of the batch has been applied. errors lists the failed
+    operations, each as {"index": ..., "reason": ..., "error": ...} with
+    reason one of INVALID, NOT_FOUND and CONFLICT.
+    """
+
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"{len(errors)} of the operations failed; none were applied")
+        self.errors = errors
+
+
+def failure(index: int, reason: str, error: str) -> Dict[str, Any]:
+    """One entry of BatchRejected.errors."""
+    return {"index": index, "reason": reason, "error": error}
+
+
+def parse_operation(operation: Any) -> Dict[str, Any]:
+    """
+    Check one circulation operation and normalize its values.
+
+    Operations are {"op": "borrow", "id": ..., "borrower": ..., "due_date": ...}
+    (due_date optional), {"op": "return", "id": ...} and
+    {"op": "update", "id": ..., "changes": {...}}.
+
+    Returns:
+        The operation with the id as a string and the due date as a day
+        ordinal (or None)
+
+    Raises:
+        ValueError: If the operation is malformed or has an invalid value
+    """
+    if not isinstance(operation, dict):
+        raise ValueError("Operation must be an object")
+    op = operation.get("op")
+    if op not in OPERATIONS:
+        raise ValueError(f"Unknown op: {op!r}")
+    book_id = operation.get("id")
+    if not isinstance(book_id, (str, int)) or isinstance(book_id, bool) or book_id == "":
+        raise ValueError("Book id is required")
+
+    parsed = {"op": op, "id": str(book_id)}
+    if op == "borrow":
+        borrower = operation.get("borrower")
+        if not isinstance(borrower, str) or not borrower:
+            raise ValueError("Borrower name is required")
+        parsed["borrower"] = borrower
+        parsed["due_date"] = to_day(operation.get("due_date"))
+    elif op == "update":
+        changes = operation.get("changes")
+        if not isinstance(changes, dict):
+            raise ValueError("Changes must be an object")
+        check_book_data(changes)
+        parsed["changes"] = changes
+    return parsed
+
+
+def parse_operations(operations: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Parse every operation of a batch with parse_operation.
+
+    Raises:
+        BatchRejected: Listing every malformed operation
+    """
+    parsed, errors = [], []
+    for index, operation in enumerate(operations):
+        try:
+            parsed.append(parse_operation(operation))
+        except ValueError as e:
+            errors.append(failure(index, INVALID, str(e)))
+    if errors:
+        raise BatchRejected(errors)
+    return parsed
+
+
+def check_loans(operations: List[Dict[str, Any]],
+                is_borrowed: Callable[[str], Optional[bool]]) -> None:
+    """
+    Check parsed operations in order against the books they change.
+
+    is_borrowed(book_id) gives whether a book is on loan, or None if there
+    is no such book. Each operation is checked as if the ones before it in
+    the batch had been applied, so a batch may return a book and lend it
+    again.
+
+    Raises:
+        BatchRejected: Listing every operation that would fail
+    """
+    states: Dict[str, bool] = {}
+    errors = []
+    for index, operation in enumerate(operations):
+        book_id = operation["id"]
+        borrowed = states[book_id] if book_id in states else is_borrowed(book_id)
+        if borrowed is None:
+            errors.append(failure(index, NOT_FOUND, "Book not found"))
+            continue
+        if operation["op"] == "borrow":
+            if borrowed:
+                errors.append(failure(index, CONFLICT, "Book already borrowed"))
+                continue
+            borrowed = True
+        elif operation["op"] == "return":
+            if not borrowed:
+                errors.append(failure(index, CONFLICT, "Book not borrowed"))
+                continue
+            borrowed = False
+        elif "is_borrowed" in operation["changes"]:
+            try:
+                lending_changes(operation["changes"], borrowed)
+            except ValueError as e:
+                errors.append(failure(index, INVALID, str(e)))
+                continue
+            borrowed = bool(operation["changes"]["is_borrowed"])
+        states[book_id] = borrowed
+    if errors:
+        raise BatchRejected(errors)
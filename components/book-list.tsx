@@ -1,6 +1,6 @@
 "use client"
 
-import { useState } from "react"
+import { useEffect, useState } from "react"
 import Link from "next/link"
 import { useRouter, useSearchParams } from "next/navigation"
 import { BookIcon, BookOpen, Edit, MoreHorizontal } from "lucide-react"
@@ -16,10 +16,12 @@ type BookType = {
   author: string
   genre: string
   publication_year: number | null
-  isbn: string | null
   is_borrowed: boolean
 }
 
+// Only what the list shows; descriptions and loan details stay on the server
+const LIST_FIELDS = "id,title,author,genre,publication_year,is_borrowed"
+
 export default function BookList() {
   const { toast } = useToast()
   const router = useRouter()
@@ -27,66 +29,34 @@ export default function BookList() {
   const search = searchParams.get("search") || ""
   const genre = searchParams.get("genre") || ""
 
-  // In a real app, this would be fetched from the API
-  const [books, setBooks] = useState<BookType[]>([
-    {
-      id: "1",
-      title: "The Hobbit",
-      author: "J.R.R. Tolkien",
-      genre: "Fantasy",
-      publication_year: 1937,
-      isbn: "9780547928227",
-      is_borrowed: false,
-    },
-    {
-      id: "2",
-      title: "Dune",
-      author: "Frank Herbert",
-      genre: "Science Fiction",
-      publication_year: 1965,
-      isbn: "9780441172719",
-      is_borrowed: true,
-    },
-    {
-      id: "3",
-      title: "Pride and Prejudice",
-      author: "Jane Austen",
-      genre: "Romance",
-      publication_year: 1813,
-      isbn: "9780141439518",
-      is_borrowed: false,
-    },
-    {
-      id: "4",
-      title: "The Shining",
-      author: "Stephen King",
-      genre: "Horror",
-      publication_year: 1977,
-      isbn: "9780307743657",
-      is_borrowed: false,
-    },
-    {
-      id: "5",
-      title: "The Alchemist",
-      author: "Paulo Coelho",
-      genre: "Fiction",
-      publication_year: 1988,
-      isbn: "9780062315007",
-      is_borrowed: true,
-    },
-  ])
+  const [books, setBooks] = useState<BookType[]>([])
 
-  // Filter books based on search and genre
-  const filteredBooks = books.filter((book) => {
-    const matchesSearch =
-      search === "" ||
-      book.title.toLowerCase().includes(search.toLowerCase()) ||
-      book.author.toLowerCase().includes(search.toLowerCase())
+  // Searching is done by the API's inverted index and genre filtering by its
+  // facet index, rather than in the browser
+  useEffect(() => {
+    const url = search
+      ? `/api/books/search?${new URLSearchParams({ q: search, type: "all", fields: LIST_FIELDS })}`
+      : genre
+        ? `/api/books?${new URLSearchParams({ genre, fields: LIST_FIELDS })}`
+        : `/api/books?${new URLSearchParams({ fields: LIST_FIELDS })}`
+    let cancelled = false
 
-    const matchesGenre = genre === "" || book.genre === genre
+    fetch(url)
+      .then((res) => (res.ok ? res.json() : []))
+      .then((data: BookType[] | { books: BookType[] }) => {
+        if (!cancelled) setBooks(Array.isArray(data) ? data : data.books)
+      })
+      .catch(() => {
+        if (!cancelled) setBooks([])
+      })
+
+    return () => {
+      cancelled = true
+    }
+  }, [search, genre])
 
-    return matchesSearch && matchesGenre
-  })
+  // Search results still need the genre filter applied here
+  const filteredBooks = books.filter((book) => genre === "" || book.genre === genre)
 
   const handleQuickBorrow = async (id: string) => {
     try {
@@ -0,0 +1,83 @@
+"use client"
+
+import { useEffect, useState } from "react"
+import Link from "next/link"
+import { BookIcon } from "lucide-react"
+import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card"
+import { Badge } from "@/components/ui/badge"
+
+type Book = {
+  id: string
+  title: string
+  author: string
+  genre: string
+}
+
+type Similar = {
+  also_borrowed: Book[]
+  more_like_this: Book[]
+}
+
+// Only what the lists show
+const SIMILAR_FIELDS = "id,title,author,genre"
+
+export default function SimilarBooks({ id }: { id: string }) {
+  const [similar, setSimilar] = useState<Similar>({ also_borrowed: [], more_like_this: [] })
+
+  // Neighbours are precomputed and cached by the API, so this is one cheap request
+  useEffect(() => {
+    let cancelled = false
+
+    fetch(`/api/books/${id}/similar?${new URLSearchParams({ fields: SIMILAR_FIELDS })}`)
+      .then((res) => (res.ok ? res.json() : { also_borrowed: [], more_like_this: [] }))
+      .then((data: Similar) => {
+        if (!cancelled) setSimilar(data)
+      })
+      .catch(() => {
+        if (!cancelled) setSimilar({ also_borrowed: [], more_like_this: [] })
+      })
+
+    return () => {
+      cancelled = true
+    }
+  }, [id])
+
+  return (
+    <div className="mt-6 grid grid-cols-1 gap-6 md:grid-cols-2">
+      <SimilarList title="Readers also borrowed" books={similar.also_borrowed} />
+      <SimilarList title="More like this" books={similar.more_like_this} />
+    </div>
+  )
+}
+
+function SimilarList({ title, books }: { title: string; books: Book[] }) {
+  if (books.length === 0) {
+    return null
+  }
+
+  return (
+    <Card>
+      <CardHeader>
+        <CardTitle className="text-lg">{title}</CardTitle>
+      </CardHeader>
+      <CardContent className="space-y-4">
+        {books.map((book) => (
+          <div key={book.id} className="flex items-start gap-4">
+            <div className="flex h-10 w-10 items-center justify-center rounded-md bg-muted">
+              <BookIcon className="h-5 w-5" />
+            </div>
+            <div>
+              <Link href={`/books/${book.id}`} className="font-medium hover:underline">
+                {book.title}
+              </Link>
+              <div className="text-sm text-muted-foreground">by {book.author}</div>
+              <Badge variant="outline" className="mt-1">
+                {book.genre}
+              </Badge>
+            </div>
+          </div>
+        ))}
+      </CardContent>
+    </Card>
+  )
+}
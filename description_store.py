@@ -0,0 +1,148 @@
+import os
+import threading
+from typing import Dict, Optional, Set
+
+DESCRIPTIONS_FILE = "descriptions.blob"
+
+# Each entry packs a description's offset and byte length into one int
+LENGTH_BITS = 32
+LENGTH_MASK = (1 << LENGTH_BITS) - 1
+
+# The file is compacted once dead bytes pass this size and outweigh live ones
+MIN_COMPACT_BYTES = 1 << 20
+
+# Entry of a book without a description in a library image's index
+NO_ENTRY = (1 << 64) - 1
+
+
+class DescriptionStore:
+    """
+    Book descriptions, kept apart from the book records.
+
+    Descriptions are long and only the detail view shows them, so listings
+    never need them. Without a path they are held in a dict. With one, they
+    are appended to that file and only their position is kept in memory, so
+    a large catalogue's descriptions stay on disk (and in the page cache)
+    until a book is looked at. The file is scratch space, recreated on open:
+    the journal and snapshot still record every description.
+
+    Replaced and deleted descriptions leave dead bytes behind; the file is
+    rewritten without them once they outweigh the live ones.
+
+    A library loaded from an image (see library_image) also reads the
+    descriptions it had then straight from the image's mapping, until they
+    are replaced or deleted.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """Open an empty store, in memory or in the file at path."""
+        self.path = path
+        self._texts: Dict[str, str] = {}
+        # id -> offset << LENGTH_BITS | length, when backed by a file
+        self._entries: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._size = 0
+        self._live = 0
+        # Descriptions of a mapped library image, indexed by book number,
+        # and the ids whose image description no longer applies
+        self._image: Optional[memoryview] = None
+        self._image_entries: Optional[memoryview] = None
+        self._replaced: Set[str] = set()
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    @classmethod
+    def from_env(cls, environ: Dict[str, str] = os.environ) -> 'DescriptionStore':
+        """Keep descriptions in LIBRARY_DESCRIPTIONS_FILE, else under LIBRARY_DATA_DIR, else in memory."""
+        path = environ.get("LIBRARY_DESCRIPTIONS_FILE")
+        if not path and environ.get("LIBRARY_DATA_DIR"):
+            path = os.path.join(environ["LIBRARY_DATA_DIR"], DESCRIPTIONS_FILE)
+        return cls(path or None)
+
+    def attach_image(self, descriptions: memoryview, entries: memoryview) -> None:
+        """Serve the descriptions of a library image (see library_image.load)."""
+        self._image = descriptions
+        self._image_entries = entries
+        self._replaced = set()
+
+    def get(self, book_id: str) -> Optional[str]:
+        """Description of book_id, or None."""
+        if self._fd is None:
+            description = self._texts.get(book_id)
+        else:
+            # Compaction moves entries, so reads wait for it
+            with self._lock:
+                entry = self._entries.get(book_id)
+                data = None if entry is None else os.pread(self._fd, entry & LENGTH_MASK, entry >> LENGTH_BITS)
+            description = None if data is None else data.decode("utf-8")
+        if description is None and self._image is not None and book_id not in self._replaced:
+            return self._image_get(book_id)
+        return description
+
+    def _image_get(self, book_id: str) -> Optional[str]:
+        if not book_id.isdigit() or int(book_id) >= len(self._image_entries):
+            return None
+        entry = self._image_entries[int(book_id)]
+        if entry == NO_ENTRY:
+            return None
+        offset = entry >> LENGTH_BITS
+        return str(self._image[offset:offset + (entry & LENGTH_MASK)], "utf-8")
+
+    def set(self, book_id: str, description: Optional[str]) -> None:
+        """Store (or, for None, drop) the description of book_id."""
+        if description is None:
+            self.discard(book_id)
+            return
+        if self._image is not None:
+            self._replaced.add(book_id)
+        if self._fd is None:
+            self._texts[book_id] = description
+            return
+        data = description.encode("utf-8")
+        with self._lock:
+            self._drop(book_id)
+            os.pwrite(self._fd, data, self._size)
+            self._entries[book_id] = self._size << LENGTH_BITS | len(data)
+            self._size += len(data)
+            self._live += len(data)
+            self._maybe_compact()
+
+    def discard(self, book_id: str) -> None:
+        """Forget the description of book_id, if any."""
+        if self._image is not None:
+            self._replaced.add(book_id)
+        if self._fd is None:
+            self._texts.pop(book_id, None)
+            return
+        with self._lock:
+            self._drop(book_id)
+            self._maybe_compact()
+
+    def _drop(self, book_id: str) -> None:
+        entry = self._entries.pop(book_id, None)
+        if entry is not None:
+            self._live -= entry & LENGTH_MASK
+
+    def _maybe_compact(self) -> None:
+        dead = self._size - self._live
+        if dead < MIN_COMPACT_BYTES or dead < self._live:
+            return
+        tmp_name = f"{self.path}.tmp"
+        fd = os.open(tmp_name, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        entries, size = {}, 0
+        for book_id, entry in self._entries.items():
+            length = entry & LENGTH_MASK
+            os.pwrite(fd, os.pread(self._fd, length, entry >> LENGTH_BITS), size)
+            entries[book_id] = size << LENGTH_BITS | length
+            size += length
+        os.replace(tmp_name, self.path)
+        os.close(self._fd)
+        self._fd, self._entries, self._size = fd, entries, size
+
+    def close(self) -> None:
+        """Close the backing file, if any."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
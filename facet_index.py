@@ -0,0 +1,142 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+# Facets a book is indexed under, in the order add() takes their values
+FACETS = ("genre", "author", "publication_year", "available")
+
+# Values reported per facet in the counts of a filtered listing
+MAX_FACET_VALUES = 20
+
+_EMPTY: Set[Hashable] = frozenset()
+
+
+class FacetIndex:
+    """
+    Posting sets of item ids for each facet value, for filtered listings.
+
+    Every value of every facet maps to the set of ids that have it, so a
+    filter is an intersection of sets, started from the smallest one, and
+    costs time proportional to that set rather than to the catalogue. Years
+    present are kept in a sorted list, so a year range needs no scan. The
+    facet values of each id are kept as well; they locate its postings on
+    removal and let the facets of a result be counted in one pass over it.
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self._postings: Dict[str, Dict[Any, Set[Hashable]]] = {facet: {} for facet in FACETS}
+        self._years: List[int] = []
+        self._values: Dict[Hashable, Tuple[Any, ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    @staticmethod
+    def _indexable(facet: str, value: Any) -> bool:
+        if facet == "publication_year":
+            # Only real years can be ordered for range queries
+            return isinstance(value, int) and not isinstance(value, bool)
+        return value is not None and value != ""
+
+    def add(self, item_id: Hashable, genre: Optional[str], author: Optional[str],
+            publication_year: Optional[int], available: bool) -> None:
+        """Index item_id under its facet values, replacing any previous ones."""
+        self.remove(item_id)
+        values = (genre, author, publication_year, available)
+        self._values[item_id] = values
+        for facet, value in zip(FACETS, values):
+            if not self._indexable(facet, value):
+                continue
+            postings = self._postings[facet]
+            ids = postings.get(value)
+            if ids is None:
+                ids = postings[value] = set()
+                if facet == "publication_year":
+                    insort(self._years, value)
+            ids.add(item_id)
+
+    def remove(self, item_id: Hashable) -> bool:
+        """Remove item_id from every posting set it is in."""
+        values = self._values.pop(item_id, None)
+        if values is None:
+            return False
+        for facet, value in zip(FACETS, values):
+            if not self._indexable(facet, value):
+                continue
+            postings = self._postings[facet]
+            ids = postings[value]
+            ids.discard(item_id)
+            if not ids:
+                del postings[value]
+                if facet == "publication_year":
+                    del self._years[bisect_left(self._years, value)]
+        return True
+
+    def filter(self, genre: Optional[str] = None, author: Optional[str] = None,
+               year_from: Optional[int] = None, year_to: Optional[int] = None,
+               available: Optional[bool] = None) -> Set[Hashable]:
+        """
+        Return the ids matching every given facet (None means any value).
+
+        Args:
+            genre: Exact genre
+            author: Exact author
+            year_from: Earliest publication year, inclusive
+            year_to: Latest publication year, inclusive
+            available: True for books on the shelf, False for borrowed ones
+
+        Returns:
+            A new set of ids
+        """
+        sets = []
+        for facet, value in (("genre", genre), ("author", author), ("available", available)):
+            if value is not None:
+                sets.append(self._postings[facet].get(value, _EMPTY))
+
+        if year_from is None and year_to is None:
+            if not sets:
+                return set(self._values)
+            sets.sort(key=len)
+            result = set(sets[0])
+            for ids in sets[1:]:
+                result &= ids
+            return result
+
+        low = float("-inf") if year_from is None else year_from
+        high = float("inf") if year_to is None else year_to
+        if not sets:
+            years = self._years[bisect_left(self._years, low):bisect_right(self._years, high)]
+            postings = self._postings["publication_year"]
+            return set().union(*(postings.get(year, _EMPTY) for year in years))
+
+        # Check the range on the (smaller) intersection instead of building
+        # the union of every year in it
+        sets.sort(key=len)
+        result = set(sets[0])
+        for ids in sets[1:]:
+            result &= ids
+        values = self._values
+        return {item_id for item_id in result
+                if self._in_range(values.get(item_id), low, high)}
+
+    @staticmethod
+    def _in_range(values: Optional[Tuple[Any, ...]], low: float, high: float) -> bool:
+        if values is None:
+            return False
+        year = values[2]
+        return isinstance(year, int) and not isinstance(year, bool) and low <= year <= high
+
+    def counts(self, item_ids: Iterable[Hashable],
+               limit: int = MAX_FACET_VALUES) -> Dict[str, Dict[Any, int]]:
+        """Count the facet values of item_ids: the limit most common per facet."""
+        counters = [Counter() for _ in FACETS]
+        values = self._values
+        for item_id in item_ids:
+            item_values = values.get(item_id)
+            if item_values is None:
+                continue
+            for facet, counter, value in zip(FACETS, counters, item_values):
+                if self._indexable(facet, value):
+                    counter[value] += 1
+        return {facet: dict(counter.most_common(limit)) for facet, counter in zip(FACETS, counters)}
@@ -0,0 +1,241 @@
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Words of this many characters or fewer are never corrected; longer ones
+# tolerate one typo, and words of at least LONG_WORD_LENGTH two
+MIN_FUZZY_LENGTH = 3
+LONG_WORD_LENGTH = 8
+
+# Marks the start and end of a word, so its first and last letters get
+# bigrams of their own
+PAD = "$"
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def max_typos(word: str) -> int:
+    """Edits tolerated when matching word."""
+    if len(word) <= MIN_FUZZY_LENGTH:
+        return 0
+    return 2 if len(word) >= LONG_WORD_LENGTH else 1
+
+
+def bigrams(word: str) -> Set[str]:
+    """Return the set of two-character substrings of the padded word."""
+    padded = f"{PAD}{word}{PAD}"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Damerau-Levenshtein (optimal string alignment) distance of a and b.
+
+    Insertions, deletions, substitutions and swaps of adjacent characters
+    cost one edit each. Gives up as soon as the distance must exceed limit
+    and returns limit + 1 then.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    # A common prefix and suffix cost nothing; most typos leave only a
+    # few characters in between to compare
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return min(len(a) + len(b), limit + 1)
+    before_previous: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                value = min(value, before_previous[j - 2] + 1)
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class FuzzyIndex:
+    """
+    Vocabulary of words with a bigram index, for typo-tolerant lookups.
+
+    Every distinct word is counted (so removals know when a word is gone)
+    and listed under each of its bigrams, split by word length. A word
+    within k edits of the query has the same length give or take k and
+    shares all but at most 3k of the query's bigrams (an edit touches at
+    most two bigrams, a swap three), so candidates are counted over the
+    postings of those lengths only, filtered by that bound, and verified
+    with a bounded edit distance. Words made only of digits (years,
+    numbers in titles) are not indexed.
+    """
+
+    def __init__(self):
+        """Initialize an empty vocabulary."""
+        self.counts: Dict[str, int] = {}
+        # bigram -> word length -> words
+        self._postings: Dict[str, Dict[int, Set[str]]] = {}
+        # word length -> words, for queries too short to filter by bigram
+        self._lengths: Dict[int, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.counts
+
+    def add(self, word: str) -> None:
+        """Count one more occurrence of word."""
+        if word.isdigit():
+            return
+        count = self.counts.get(word, 0)
+        self.counts[word] = count + 1
+        if count:
+            return
+        length = len(word)
+        self._lengths.setdefault(length, set()).add(word)
+        for gram in bigrams(word):
+            self._postings.setdefault(gram, {}).setdefault(length, set()).add(word)
+
+    def remove(self, word: str) -> None:
+        """Count one occurrence of word less, dropping it at zero."""
+        count = self.counts.get(word)
+        if count is None:
+            return
+        if count > 1:
+            self.counts[word] = count - 1
+            return
+        del self.counts[word]
+        length = len(word)
+        self._discard(self._lengths, length, word)
+        for gram in bigrams(word):
+            by_length = self._postings.get(gram)
+            if by_length is not None:
+                self._discard(by_length, length, word)
+                if not by_length:
+                    del self._postings[gram]
+
+    @staticmethod
+    def _discard(sets: Dict[int, Set[str]], length: int, word: str) -> None:
+        words = sets.get(length)
+        if words is not None:
+            words.discard(word)
+            if not words:
+                del sets[length]
+
+    def _candidates(self, word: str, typos: int) -> List[Tuple[int, str]]:
+        """(shared bigrams, word) of the words that may be within typos edits, most shared first."""
+        grams = bigrams(word)
+        lengths = range(max(1, len(word) - typos), len(word) + typos + 1)
+        threshold = len(grams) - 3 * typos
+        if threshold <= 0:
+            return [(0, candidate) for length in lengths for candidate in self._lengths.get(length, ())]
+        shared: Counter = Counter()
+        for gram in grams:
+            by_length = self._postings.get(gram)
+            if by_length is not None:
+                for length in lengths:
+                    # Counter.update runs over a set at C speed
+                    shared.update(by_length.get(length, ()))
+        candidates = [(count, candidate) for candidate, count in shared.items() if count >= threshold]
+        candidates.sort(reverse=True)
+        return candidates
+
+    def similar(self, word: str, typos: Optional[int] = None) -> List[Tuple[int, str]]:
+        """
+        Find the indexed words within typos edits of word.
+
+        Args:
+            word: A lowercased word
+            typos: Edits allowed (max_typos(word) if None)
+
+        Returns:
+            (distance, word) pairs, closest first and most frequent first
+            among equally close words
+        """
+        if typos is None:
+            typos = max_typos(word)
+        if typos <= 0:
+            return [(0, word)] if word in self.counts else []
+        matches = []
+        for _, candidate in self._candidates(word, typos):
+            distance = edit_distance(word, candidate, typos)
+            if distance <= typos:
+                matches.append((distance, -self.counts.get(candidate, 0), candidate))
+        matches.sort()
+        return [(distance, candidate) for distance, _, candidate in matches]
+
+    def closest(self, word: str, typos: Optional[int] = None) -> Optional[Tuple[int, str]]:
+        """
+        The first of similar(word, typos), found without measuring every candidate.
+
+        Candidates are tried from most to fewest shared bigrams. A word
+        sharing s of the query's g bigrams is at least (g - s) / 3 edits
+        away, so once that bound exceeds the closest distance found, the
+        rest are skipped.
+        """
+        if typos is None:
+            typos = max_typos(word)
+        if typos <= 0:
+            return (0, word) if word in self.counts else None
+        grams = len(bigrams(word))
+        best: Optional[Tuple[int, int, str]] = None
+        limit = typos
+        for shared, candidate in self._candidates(word, typos):
+            if shared and (grams - shared + 2) // 3 > limit:
+                break
+            distance = edit_distance(word, candidate, limit)
+            if distance > limit:
+                continue
+            key = (distance, -self.counts.get(candidate, 0), candidate)
+            if best is None or key < best:
+                best = key
+                limit = distance
+        return None if best is None else (best[0], best[2])
+
+
+def suggest(query: str, indexes: Iterable[FuzzyIndex]) -> Optional[str]:
+    """
+    Correct the words of query that no index knows.
+
+    Each unknown word is replaced by the closest word of any index (the
+    most frequent one on ties); known and uncorrectable words are kept.
+
+    Returns:
+        The corrected, lowercased query, or None if nothing was corrected
+    """
+    indexes = list(indexes)
+    corrected = False
+
+    def correct(match: "re.Match[str]") -> str:
+        nonlocal corrected
+        word = match.group(0)
+        if word.isdigit() or any(word in index for index in indexes):
+            return word
+        best = None
+        for index in indexes:
+            closest = index.closest(word)
+            if closest is not None:
+                distance, candidate = closest
+                key = (distance, -index.counts.get(candidate, 0), candidate)
+                if best is None or key < best:
+                    best = key
+        if best is None:
+            return word
+        corrected = True
+        return best[2]
+
+    result = _WORD_PATTERN.sub(correct, query.lower())
+    return result if corrected else None
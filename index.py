@@ -1,12 +1,87 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
+from flask import jsonify as flask_jsonify
+import io
+import atexit
+import gc
+import heapq
 import json
-from datetime import datetime
-from typing import List, Dict, Optional, Union, Any
+import os
+import sys
+import threading
+import uuid
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from itertools import repeat
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Sequence, Set, Tuple, Union, Any
+
+import bulk_io
+import circulation
+import instrumentation
+import library_image
+from book_data import check_book_data, lending_changes
+from description_store import DescriptionStore
+from facet_index import FacetIndex
+from instrumentation import count_scanned, timed, timed_methods
+from library_stats import LibraryStats
+from loan_ledger import Loan, LoanLedger, OverdueScheduler
+from ordered_index import OrderedIndex
+from recommender import TOP_K, Recommender
+from search_index import SearchIndex
+from storage import LibraryStore
+from timestamps import format_day, format_timestamp, now_timestamp, to_day, to_timestamp, today
+import sqlite_library
 
 app = Flask(__name__)
 
-# Book class from our original Python library manager
+# Request metrics for /api/metrics, and the opt-in profiler for slow requests
+metrics = instrumentation.Metrics()
+profiler = instrumentation.Profiler.from_env()
+
+# jsonify, timed as its own phase of each request
+jsonify = timed("jsonify")(flask_jsonify)
+
+# Number of locks that per-book operations are spread over
+LOCK_STRIPES = 64
+
+# Page sizes for cursor-paginated listings
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Sub-requests accepted by one POST /api/batch, and the routes that cannot be
+# batched (they stream their bodies, or would recurse)
+MAX_BATCH_OPERATIONS = 100
+BATCH_EXCLUDED_PATHS = frozenset(("/api/batch", "/api/books/bulk", "/api/books/export"))
+
+# Operations accepted by one POST /api/circulation/batch
+MAX_CIRCULATION_OPERATIONS = 1000
+
+# Status reported for each failed operation of a rejected circulation batch;
+# the operations that did not fail were not applied either (424)
+CIRCULATION_STATUS = {circulation.INVALID: 400, circulation.NOT_FOUND: 404, circulation.CONFLICT: 409}
+
+# Neighbours of each kind returned by GET /api/books/<id>/similar unless
+# ?limit= asks for more (at most recommender.TOP_K)
+SIMILAR_LIMIT = 5
+
+# Query arguments that filter GET /api/books by facet
+FILTER_ARGS = ("genre", "author", "year_from", "year_to", "available")
+
+# Book class from our original Python library manager. Books are slotted and
+# keep dates as integers (epoch seconds / day ordinals) with genre and author
+# interned, which keeps large catalogues small; to_dict renders the dates
+# back to their usual string formats. Once a book is in a library, its
+# description lives in the library's DescriptionStore and is only loaded
+# when asked for.
 class Book:
+    __slots__ = ("id", "title", "_author", "_genre", "publication_year", "isbn",
+                 "_date_added", "is_borrowed", "_borrowed_date", "_return_date",
+                 "borrower", "_description", "_descriptions")
+    
+    # Keys of to_dict, which are also the fields update_book may change
+    fields = ("id", "title", "author", "genre", "publication_year", "isbn",
+              "date_added", "is_borrowed", "borrowed_date", "return_date",
+              "borrower", "description")
+    
     def __init__(self, title: str, author: str, genre: str, 
                  publication_year: int = None, isbn: str = None):
         self.id = None  # Will be set when added to library
@@ -15,145 +90,1042 @@ class Book:
         self.genre = genre
         self.publication_year = publication_year
         self.isbn = isbn
-        self.date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._date_added = now_timestamp()
         self.is_borrowed = False
-        self.borrowed_date = None
-        self.return_date = None
+        self._borrowed_date = None
+        self._return_date = None
         self.borrower = None
-        self.description = None
+        self._description = None
+        self._descriptions: Optional[DescriptionStore] = None
+    
+    @property
+    def author(self) -> Optional[str]:
+        return self._author
+    
+    @author.setter
+    def author(self, value: Optional[str]) -> None:
+        self._author = sys.intern(value) if isinstance(value, str) else value
+    
+    @property
+    def genre(self) -> Optional[str]:
+        return self._genre
+    
+    @genre.setter
+    def genre(self, value: Optional[str]) -> None:
+        self._genre = sys.intern(value) if isinstance(value, str) else value
+    
+    @property
+    def date_added_ts(self) -> Optional[int]:
+        return self._date_added
+    
+    @property
+    def date_added(self) -> Optional[str]:
+        return format_timestamp(self._date_added)
+    
+    @date_added.setter
+    def date_added(self, value: Union[None, int, str]) -> None:
+        self._date_added = to_timestamp(value)
+    
+    @property
+    def borrowed_date(self) -> Optional[str]:
+        return format_day(self._borrowed_date)
     
-    def to_dict(self) -> Dict[str, Any]:
+    @borrowed_date.setter
+    def borrowed_date(self, value: Union[None, int, str]) -> None:
+        self._borrowed_date = to_day(value)
+    
+    @property
+    def return_date(self) -> Optional[str]:
+        return format_day(self._return_date)
+    
+    @return_date.setter
+    def return_date(self, value: Union[None, int, str]) -> None:
+        self._return_date = to_day(value)
+    
+    @property
+    def description(self) -> Optional[str]:
+        if self._descriptions is not None:
+            return self._descriptions.get(self.id)
+        return self._description
+    
+    @description.setter
+    def description(self, value: Optional[str]) -> None:
+        if self._descriptions is not None:
+            self._descriptions.set(self.id, value)
+        else:
+            self._description = value
+    
+    def attach_descriptions(self, descriptions: DescriptionStore) -> None:
+        # Moves the description into the store (the book must have its id)
+        descriptions.set(self.id, self._description)
+        self._description = None
+        self._descriptions = descriptions
+    
+    def detach_descriptions(self) -> None:
+        # Takes the description back out of the store
+        if self._descriptions is not None:
+            self._description = self._descriptions.get(self.id)
+            self._descriptions.discard(self.id)
+            self._descriptions = None
+    
+    @timed("serialize")
+    def to_dict(self, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        # Only the given fields (every field of Book.fields is an attribute),
+        # so the description is not even loaded unless it is asked for
+        if fields is not None:
+            return {field: getattr(self, field) for field in fields}
         return {
             "id": self.id,
             "title": self.title,
-            "author": self.author,
-            "genre": self.genre,
+            "author": self._author,
+            "genre": self._genre,
             "publication_year": self.publication_year,
             "isbn": self.isbn,
-            "date_added": self.date_added,
+            "date_added": format_timestamp(self._date_added),
             "is_borrowed": self.is_borrowed,
-            "borrowed_date": self.borrowed_date,
-            "return_date": self.return_date,
+            "borrowed_date": format_day(self._borrowed_date),
+            "return_date": format_day(self._return_date),
             "borrower": self.borrower,
             "description": self.description
         }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Book':
+        book = cls(
+            title=data.get("title"),
+            author=data.get("author"),
+            genre=data.get("genre"),
+            publication_year=data.get("publication_year"),
+            isbn=data.get("isbn")
+        )
+        for key in ("id", "date_added", "is_borrowed", "borrowed_date",
+                    "return_date", "borrower", "description"):
+            if key in data:
+                setattr(book, key, data[key])
+        return book
+
+# Fields of a book in listings unless ?fields= asks for others: everything
+# but the description, which only GET /api/books/<id> returns by default
+LIST_FIELDS = tuple(field for field in Book.fields if field != "description")
 
-# Library class to manage books
+# Slots of a Book saved (as columns) in a library image; descriptions are
+# saved apart
+IMAGE_SLOTS = tuple(slot for slot in Book.__slots__ if slot not in ("_description", "_descriptions"))
+
+# Fields the recommender compares books by
+RECOMMENDER_FIELDS = ("title", "author", "genre", "description")
+
+# Library attributes saved as they are in a library image
+IMAGE_STATE = ("next_id", "isbn_index", "title_index", "search_index", "facets", "stats",
+               "loans", "id_order", "date_order")
+
+def normalize_title(title: Optional[str]) -> str:
+    return " ".join(title.lower().split()) if title else ""
+
+# Library class to manage books. Public methods are timed as the "library"
+# phase of the request that calls them.
+@timed_methods("library")
 class Library:
-    def __init__(self):
-        self.books = []
+    def __init__(self, descriptions: Optional[DescriptionStore] = None):
+        # id -> Book, kept in insertion order so iteration matches the old list
+        self.books: Dict[str, Book] = {}
+        # Descriptions, kept out of the books (in memory unless given a file)
+        self.descriptions = descriptions if descriptions is not None else DescriptionStore()
         self.next_id = 1
+        # Secondary indexes: ISBN / normalized title -> ids of matching books
+        self.isbn_index: Dict[str, Set[str]] = {}
+        self.title_index: Dict[str, Set[str]] = {}
+        self.search_index = SearchIndex()
+        self.facets = FacetIndex()
+        self.stats = LibraryStats()
+        # History of every loan; books only hold their current state
+        self.loans = LoanLedger()
+        # Listing orders: by id (i.e. insertion) and by date_added
+        self.id_order = OrderedIndex()
+        self.date_order = OrderedIndex()
+        # Neighbours for GET /api/books/<id>/similar, built on first use and
+        # then fed the loans made and the books changed since it last ran
+        # (_stale_books is None until it is built)
+        self.recommender = Recommender()
+        self._recommended_loans = 0
+        self._stale_books: Optional[Set[str]] = None
+        self._recommend_lock = threading.Lock()
+        # Durable storage, attached by LibraryStore.load (None keeps it in memory)
+        self.store: Optional[LibraryStore] = None
+        # Bumped on every mutation; together with instance_id it is the ETag
+        # of every listing. Serialized books are cached until they change.
+        self.version = 0
+        self.instance_id = uuid.uuid4().hex[:12]
+        self._json_cache: Dict[str, bytes] = {}
+        # Concurrency: a striped lock per book makes check-then-act operations
+        # (borrow, return, update, delete) atomic per book. The shared lock is
+        # only held while indexes, counters and the journal are updated, so it
+        # never covers a whole request. Reads take no locks; they only rely on
+        # single dict/set operations being atomic.
+        self._book_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._lock = threading.RLock()
+        self._cache_lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self.books)
+    
+    @property
+    def etag(self) -> str:
+        return f"{self.instance_id}-{self.version}"
+    
+    def _book_lock(self, book_id: str) -> threading.Lock:
+        return self._book_locks[hash(book_id) % LOCK_STRIPES]
+    
+    @contextmanager
+    def _exclusive(self):
+        # Every stripe (in a fixed order) and then the shared lock
+        with ExitStack() as stack:
+            for lock in self._book_locks:
+                stack.enter_context(lock)
+            stack.enter_context(self._lock)
+            yield
+    
+    @contextmanager
+    def _locked(self, book_ids: Iterable[str]):
+        # The stripes of book_ids (in the same order as _exclusive) and then
+        # the shared lock
+        stripes = sorted({hash(book_id) % LOCK_STRIPES for book_id in book_ids})
+        with ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self._book_locks[stripe])
+            stack.enter_context(self._lock)
+            yield
+    
+    def _touch(self, book_id: str) -> None:
+        with self._cache_lock:
+            self.version += 1
+            self._json_cache.pop(book_id, None)
+    
+    def _content_changed(self, book_id: str) -> None:
+        # Queues the book for the recommender, once it has been built
+        with self._cache_lock:
+            if self._stale_books is not None:
+                self._stale_books.add(book_id)
+    
+    @timed("serialize")
+    def book_json(self, book: Book, fields: Optional[Sequence[str]] = None) -> bytes:
+        # The book as listed; only the default LIST_FIELDS are cached
+        if fields is not None and tuple(fields) != LIST_FIELDS:
+            return json.dumps(book.to_dict(fields), separators=(",", ":")).encode()
+        data = self._json_cache.get(book.id)
+        if data is None:
+            version = self.version
+            data = json.dumps(book.to_dict(LIST_FIELDS), separators=(",", ":")).encode()
+            # Only cache if no mutation happened while serializing
+            with self._cache_lock:
+                if self.version == version:
+                    self._json_cache[book.id] = data
+        return data
+    
+    def _json_list(self, book_ids: Iterable[str], fields: Optional[Sequence[str]] = None) -> bytes:
+        books = self.books
+        fragments = []
+        for book_id in book_ids:
+            book = books.get(book_id)
+            if book is not None:
+                fragments.append(self.book_json(book, fields))
+        count_scanned(len(fragments))
+        return b"[" + b",".join(fragments) + b"]"
+    
+    def _record(self, op: str, data: Dict[str, Any]) -> None:
+        if self.store is not None:
+            self.store.append(op, data)
+    
+    def _maybe_snapshot(self) -> None:
+        # Called with no locks held: a snapshot needs every book lock
+        if self.store is not None and self.store.snapshot_due:
+            with self._exclusive():
+                if self.store.snapshot_due:
+                    self.store.snapshot()
+    
+    def _index_book(self, book: Book) -> None:
+        if book.isbn:
+            self.isbn_index.setdefault(book.isbn, set()).add(book.id)
+        title_key = normalize_title(book.title)
+        if title_key:
+            self.title_index.setdefault(title_key, set()).add(book.id)
+    
+    def _unindex_book(self, book: Book) -> None:
+        for index, key in ((self.isbn_index, book.isbn),
+                           (self.title_index, normalize_title(book.title))):
+            ids = index.get(key)
+            if ids is None:
+                continue
+            ids.discard(book.id)
+            if not ids:
+                del index[key]
+    
+    def _index_facets(self, book: Book) -> None:
+        self.facets.add(book.id, book.genre, book.author, book.publication_year,
+                        not book.is_borrowed)
+    
+    @staticmethod
+    def _date_key(book: Book) -> int:
+        date_added = book.date_added_ts
+        return -1 if date_added is None else date_added
+    
+    def _insert(self, book: Book, touch: bool = True) -> None:
+        # The book is only listed once its key indexes took it
+        self._index_book(book)
+        self.books[book.id] = book
+        book.attach_descriptions(self.descriptions)
+        self.search_index.add(book.id, book.to_dict(self.search_index.fields))
+        self.stats.add_book(book)
+        self._index_facets(book)
+        self.id_order.insert(int(book.id), book.id)
+        self.date_order.insert(self._date_key(book), book.id)
+        self._content_changed(book.id)
+        if touch:
+            self._touch(book.id)
+    
+    def _open_initial_loan(self, book: Book) -> None:
+        # A book added as borrowed is on loan from its borrowed date (books
+        # restored from a snapshot are not: their loans are restored too)
+        if book.is_borrowed:
+            self.loans.open(book.id, book.borrower, to_day(book.borrowed_date) or today())
     
     def add_book(self, book: Book) -> Book:
-        book.id = str(self.next_id)
-        self.next_id += 1
-        self.books.append(book)
+        with self._lock:
+            book.id = str(self.next_id)
+            self.next_id += 1
+            self._insert(book)
+            self._open_initial_loan(book)
+            self._record("add", book.to_dict())
+        self._maybe_snapshot()
         return book
     
+    def add_books(self, books: List[Book]) -> List[Book]:
+        # Bulk insert: one version bump and one journal record for the batch
+        with self._lock:
+            for book in books:
+                book.id = str(self.next_id)
+                self.next_id += 1
+                self._insert(book, touch=False)
+                self._open_initial_loan(book)
+            if books:
+                with self._cache_lock:
+                    self.version += 1
+                self._record("add_batch", {"books": [book.to_dict() for book in books]})
+        self._maybe_snapshot()
+        return books
+    
+    def iter_books(self) -> Iterable[Book]:
+        # Walks the id index, which tolerates books being added or deleted meanwhile
+        for book_id in self.id_order.iter_from():
+            book = self.books.get(book_id)
+            if book is not None:
+                yield book
+    
     def get_book(self, book_id: str) -> Optional[Book]:
-        for book in self.books:
-            if book.id == book_id:
-                return book
-        return None
+        return self.books.get(book_id)
+    
+    def _get_books(self, book_ids: Iterable[str]) -> List[Book]:
+        books = (self.books.get(book_id) for book_id in list(book_ids))
+        return [book for book in books if book is not None]
+    
+    def get_books_json(self, book_ids: Iterable[str], fields: Optional[Sequence[str]] = None) -> bytes:
+        # Multi-get in the requested order; unknown ids are left out
+        return self._json_list(book_ids, fields)
+    
+    def get_books_by_isbn(self, isbn: str) -> List[Book]:
+        return self._get_books(self.isbn_index.get(isbn, ()))
+    
+    def get_books_by_title(self, title: str) -> List[Book]:
+        return self._get_books(self.title_index.get(normalize_title(title), ()))
     
     def update_book(self, book_id: str, data: Dict[str, Any]) -> Optional[Book]:
-        book = self.get_book(book_id)
-        if not book:
-            return None
+        with self._book_lock(book_id):
+            book = self.get_book(book_id)
+            if not book:
+                return None
+            
+            with self._lock:
+                check_book_data(data)
+                changes = self._update(book, lending_changes(data, book.is_borrowed))
+                self._record("update", {"id": book_id, "changes": changes})
+        self._maybe_snapshot()
+        return book
+    
+    def _update(self, book: Book, data: Dict[str, Any], touch: bool = True) -> Dict[str, Any]:
+        # Returns the changes made, for the journal
+        book_id = book.id
+        # The id is the primary key of the indexes and cannot be changed
+        data = {key: value for key, value in data.items()
+                if key != "id" and key in Book.fields}
+        # Reject malformed values before anything is changed
+        check_book_data(data)
+        reindex = "isbn" in data or "title" in data
+        if reindex:
+            self._unindex_book(book)
+        recount = any(field in data for field in ("genre", "author", "is_borrowed"))
+        if recount:
+            self.stats.remove_book(book)
+        was_borrowed = book.is_borrowed
         
         for key, value in data.items():
-            if hasattr(book, key):
-                setattr(book, key, value)
+            setattr(book, key, value)
         
-        return book
+        # Editing is_borrowed directly still opens or closes a loan
+        if book.is_borrowed and not was_borrowed:
+            self.loans.open(book_id, book.borrower, to_day(book.borrowed_date) or today())
+        elif was_borrowed and not book.is_borrowed:
+            self.loans.close(book_id, to_day(book.return_date) or today())
+        
+        if reindex:
+            self._index_book(book)
+        if recount:
+            self.stats.add_book(book)
+        if recount or "publication_year" in data:
+            self._index_facets(book)
+        if "date_added" in data:
+            self.date_order.insert(self._date_key(book), book.id)
+        if any(field in data for field in self.search_index.fields):
+            self.search_index.add(book.id, book.to_dict(self.search_index.fields))
+        if any(field in data for field in RECOMMENDER_FIELDS):
+            self._content_changed(book_id)
+        if touch:
+            self._touch(book_id)
+        return data
     
     def delete_book(self, book_id: str) -> bool:
-        book = self.get_book(book_id)
-        if not book:
-            return False
-        
-        self.books.remove(book)
+        with self._book_lock(book_id), self._lock:
+            book = self.books.pop(book_id, None)
+            if not book:
+                return False
+            
+            self._unindex_book(book)
+            self.search_index.remove(book_id)
+            self.stats.remove_book(book)
+            self.facets.remove(book_id)
+            self.loans.close(book_id, today())
+            self.id_order.discard(book_id)
+            self.date_order.discard(book_id)
+            book.detach_descriptions()
+            self._content_changed(book_id)
+            self._touch(book_id)
+            self._record("delete", {"id": book_id})
+        self._maybe_snapshot()
         return True
     
-    def borrow_book(self, book_id: str, borrower: str) -> Optional[Book]:
-        book = self.get_book(book_id)
-        if not book or book.is_borrowed:
-            return None
-        
+    def _mark_borrowed(self, book: Book, borrower: str, borrowed_date: Union[int, str],
+                       due_date: Union[None, int, str] = None, touch: bool = True) -> Loan:
         book.is_borrowed = True
-        book.borrowed_date = datetime.now().strftime("%Y-%m-%d")
+        self.stats.borrow_book()
+        book.borrowed_date = borrowed_date
         book.borrower = borrower
+        self._index_facets(book)
+        if touch:
+            self._touch(book.id)
+        return self.loans.open(book.id, borrower, to_day(borrowed_date), to_day(due_date))
+    
+    def _mark_returned(self, book: Book, return_date: Union[int, str], touch: bool = True) -> None:
+        book.is_borrowed = False
+        self.stats.return_book()
+        book.return_date = return_date
+        # The loan ledger keeps who had it
+        book.borrower = None
+        self._index_facets(book)
+        if touch:
+            self._touch(book.id)
+        self.loans.close(book.id, to_day(return_date))
+    
+    def borrow_book(self, book_id: str, borrower: str,
+                    due_date: Union[None, int, str] = None) -> Optional[Book]:
+        # Reject a malformed due date before anything is changed
+        due_day = to_day(due_date)
+        with self._book_lock(book_id):
+            book = self.get_book(book_id)
+            if not book or book.is_borrowed:
+                return None
+            
+            with self._lock:
+                loan = self._mark_borrowed(book, borrower, today(), due_day)
+                self._record("borrow", {"id": book_id, "borrower": borrower,
+                                        "borrowed_date": book.borrowed_date,
+                                        "due_date": format_day(loan.due_day)})
+        self._maybe_snapshot()
         return book
     
     def return_book(self, book_id: str) -> Optional[Book]:
-        book = self.get_book(book_id)
-        if not book or not book.is_borrowed:
-            return None
+        with self._book_lock(book_id):
+            book = self.get_book(book_id)
+            if not book or not book.is_borrowed:
+                return None
+            
+            with self._lock:
+                self._mark_returned(book, today())
+                self._record("return", {"id": book_id, "return_date": book.return_date})
+        self._maybe_snapshot()
+        return book
+    
+    def apply_batch(self, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Apply borrow, return and update operations all together or not at all.
         
-        book.is_borrowed = False
-        book.return_date = datetime.now().strftime("%Y-%m-%d")
+        Operations (see circulation.parse_operation) are checked and applied
+        in order, while holding the locks of every book they touch. The
+        batch costs one version bump and one journal record, however many
+        operations it has.
+        
+        Returns:
+            Each operation's book, as it was right after that operation
+        
+        Raises:
+            BatchRejected: If any operation is malformed or would fail; then
+                nothing has been changed
+        """
+        operations = circulation.parse_operations(operations)
+        results = []
+        with self._locked(operation["id"] for operation in operations):
+            circulation.check_loans(operations, self._loan_state)
+            day = today()
+            records = []
+            saved = self._batch_savepoint(operations)
+            try:
+                for index, operation in enumerate(operations):
+                    book = self.books[operation["id"]]
+                    if operation["op"] == "borrow":
+                        loan = self._mark_borrowed(book, operation["borrower"], day,
+                                                   operation["due_date"], touch=False)
+                        records.append({"op": "borrow", "data": {
+                            "id": book.id, "borrower": book.borrower, "borrowed_date": book.borrowed_date,
+                            "due_date": format_day(loan.due_day)}})
+                    elif operation["op"] == "return":
+                        self._mark_returned(book, day, touch=False)
+                        records.append({"op": "return", "data": {"id": book.id, "return_date": book.return_date}})
+                    else:
+                        changes = self._update(book, lending_changes(operation["changes"], book.is_borrowed),
+                                               touch=False)
+                        records.append({"op": "update", "data": {"id": book.id, "changes": changes}})
+                    results.append(book.to_dict())
+            except Exception as e:
+                # Operations are checked up front, so this is unexpected:
+                # undo the ones already applied rather than keep half a batch
+                self._batch_rollback(saved)
+                raise circulation.BatchRejected(
+                    [circulation.failure(index, circulation.INVALID, str(e))]) from e
+            if records:
+                with self._cache_lock:
+                    self.version += 1
+                    for operation in operations:
+                        self._json_cache.pop(operation["id"], None)
+                self._record("batch", {"records": records})
+        self._maybe_snapshot()
+        return results
+    
+    def _batch_savepoint(self, operations: List[Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], Any]:
+        # The fields each book of the batch may change, as they are now, and
+        # the state of their loans
+        fields: Dict[str, Set[str]] = {}
+        for operation in operations:
+            changed = fields.setdefault(operation["id"], set())
+            if operation["op"] == "update":
+                changed.update(key for key in operation["changes"] if key != "id" and key in Book.fields)
+            if operation["op"] != "update" or "is_borrowed" in operation["changes"]:
+                changed.update(("is_borrowed", "borrowed_date", "return_date", "borrower"))
+        books = {book_id: self.books[book_id].to_dict(sorted(changed)) for book_id, changed in fields.items()}
+        return books, self.loans.savepoint(fields)
+    
+    def _batch_rollback(self, saved: Tuple[Dict[str, Dict[str, Any]], Any]) -> None:
+        books, loans = saved
+        for book_id, data in books.items():
+            # Readers may have seen (and cached) the half-applied book
+            self._update(self.books[book_id], data)
+        # Also drops the loans _update opened or closed while restoring
+        self.loans.rollback(loans)
+    
+    def _loan_state(self, book_id: str) -> Optional[bool]:
+        book = self.books.get(book_id)
+        return None if book is None else book.is_borrowed
+    
+    def get_loans(self, borrower: Optional[str] = None,
+                  book_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Loan history of a borrower (or else of a book), oldest first."""
+        loans = self.loans.for_borrower(borrower) if borrower is not None else self.loans.for_book(book_id)
+        day = today()
+        return [loan.to_dict(day) for loan in loans]
+    
+    def get_overdue_loans(self) -> List[Dict[str, Any]]:
+        """Open loans past their due date, earliest due first."""
+        day = today()
+        with self._lock:
+            loans = self.loans.overdue(day)
+        return [loan.to_dict(day) for loan in loans]
+    
+    def check_overdue(self) -> List[Dict[str, Any]]:
+        """Loans that became overdue since the previous check."""
+        day = today()
+        with self._lock:
+            loans = self.loans.take_newly_overdue(day)
+        return [loan.to_dict(day) for loan in loans]
+    
+    # Persistence support for LibraryStore
+    
+    def restore_book(self, data: Dict[str, Any]) -> Book:
+        book = Book.from_dict(data)
+        if book.id in self.books:
+            self.delete_book(book.id)
+        self._insert(book)
+        self.next_id = max(self.next_id, int(book.id) + 1)
         return book
     
+    def apply_record(self, op: str, data: Dict[str, Any]) -> None:
+        # Replays a journaled mutation exactly as it was first applied
+        if op == "add":
+            self._open_initial_loan(self.restore_book(data))
+            return
+        if op == "add_batch":
+            for book_data in data["books"]:
+                self._open_initial_loan(self.restore_book(book_data))
+            return
+        if op == "batch":
+            for record in data["records"]:
+                self.apply_record(record["op"], record["data"])
+            return
+        
+        book = self.get_book(data["id"])
+        if not book:
+            return
+        if op == "update":
+            # Journaled changes were completed by lending_changes already
+            self._update(book, data["changes"])
+        elif op == "delete":
+            self.delete_book(book.id)
+        elif op == "borrow" and not book.is_borrowed:
+            self._mark_borrowed(book, data["borrower"], data["borrowed_date"], data.get("due_date"))
+        elif op == "return" and book.is_borrowed:
+            self._mark_returned(book, data["return_date"])
+    
+    def snapshot_state(self) -> Dict[str, Any]:
+        return {"next_id": self.next_id}
+    
+    def iter_snapshot_books(self) -> Iterable[Dict[str, Any]]:
+        return (book.to_dict() for book in self.books.values())
+    
+    def restore_loan(self, data: Dict[str, Any]) -> None:
+        self.loans.restore(data)
+    
+    def iter_snapshot_loans(self) -> Iterable[Dict[str, Any]]:
+        return (loan.to_dict() for loan in list(self.loans.loans))
+    
+    def save_image(self, path: str, header: Dict[str, Any]) -> None:
+        # Binary snapshot with the indexes prebuilt (see library_image), for
+        # LibraryStore and LIBRARY_IMAGE; the caller keeps the library still
+        books = list(self.books.values())
+        state = {name: getattr(self, name) for name in IMAGE_STATE}
+        state["books"] = tuple(tuple(getattr(book, slot) for book in books) for slot in IMAGE_SLOTS)
+        library_image.write(path, dict(header, schema=self._image_schema()), state,
+                            ((int(book.id), book.description) for book in books))
+    
+    @classmethod
+    def _image_schema(cls) -> Dict[str, Any]:
+        # Shape of the state an image holds, as this code builds it: the
+        # book slots, and the attributes of each saved index
+        empty = cls()
+        state = {}
+        for name in IMAGE_STATE:
+            value = getattr(empty, name)
+            attributes = getattr(value, "__dict__", None)
+            state[name] = [type(value).__name__] + (sorted(attributes) if attributes is not None else [])
+        return {"slots": list(IMAGE_SLOTS), "state": state}
+    
+    def load_image(self, path: str, expected: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        # Takes over the books and indexes of an image (which must have the
+        # expected header fields, and this code's schema) and returns its
+        # header. Nothing is changed unless the whole image can be used.
+        if self.books:
+            raise ValueError("An image can only be loaded into an empty library")
+        expected = dict(expected or {}, schema=self._image_schema())
+        with library_image.paused_gc():
+            header, state, descriptions, entries = library_image.load(path, expected)
+            columns = state.pop("books")
+            if set(state) != set(IMAGE_STATE) or len(columns) != len(IMAGE_SLOTS):
+                raise ValueError(f"{path} does not hold a library's state")
+            count = len(columns[0]) if columns else 0
+            books = [Book.__new__(Book) for _ in range(count)]
+            # Each column is set on every book by a C loop (map over the
+            # slot's setter), rather than book by book
+            for slot, column in zip(IMAGE_SLOTS, columns):
+                deque(map(getattr(Book, slot).__set__, books, column), maxlen=0)
+            deque(map(Book._description.__set__, books, repeat(None)), maxlen=0)
+            deque(map(Book._descriptions.__set__, books, repeat(self.descriptions)), maxlen=0)
+            self.books = dict(zip((book.id for book in books), books))
+        for name in IMAGE_STATE:
+            setattr(self, name, state[name])
+        self.descriptions.attach_image(descriptions, entries)
+        with self._recommend_lock, self._cache_lock:
+            # The books and loans were replaced: start the recommender over
+            self.recommender = Recommender()
+            self._recommended_loans = 0
+            self._stale_books = None
+            self.version += 1
+        return header
+    
+    def search_books(self, query: str, search_type: str = "all", limit: Optional[int] = None,
+                     fields: Sequence[str] = LIST_FIELDS) -> List[Dict[str, Any]]:
+        book_ids = self.search_index.search(query, search_type, limit)
+        return [book.to_dict(fields) for book in self._get_books(book_ids)]
+    
+    def search_books_fuzzy(self, query: str, search_type: str = "all", limit: Optional[int] = None,
+                           fields: Sequence[str] = LIST_FIELDS) -> Dict[str, Any]:
+        # {"books", "did_you_mean"}: when query matches nothing, the books
+        # matching its corrected spelling, and that spelling
+        book_ids, suggestion = self.search_index.search_or_suggest(query, search_type, limit)
+        return {
+            "books": [book.to_dict(fields) for book in self._get_books(book_ids)],
+            "did_you_mean": suggestion,
+        }
+    
+    def get_similar_json(self, book_id: str, limit: int = SIMILAR_LIMIT,
+                         fields: Optional[Sequence[str]] = None) -> bytes:
+        """
+        {"also_borrowed", "more_like_this"}: up to limit books borrowed by
+        readers of book_id, and books like it (see Recommender).
+        """
+        with self._recommend_lock:
+            self._refresh_recommender()
+            also_borrowed = self.recommender.also_borrowed(book_id, limit)
+            more_like_this = self.recommender.more_like_this(book_id, limit)
+        return (b'{"also_borrowed":' + self._json_list(also_borrowed, fields) +
+                b',"more_like_this":' + self._json_list(more_like_this, fields) + b'}')
+    
+    def _refresh_recommender(self) -> None:
+        # Feeds the recommender the books changed and the loans made since
+        # it last ran (every book and loan the first time). Books changed
+        # meanwhile are queued again, so nothing is missed.
+        with self._cache_lock:
+            stale, self._stale_books = self._stale_books, set()
+        book_ids = list(self.books) if stale is None else stale
+        books = [self.books.get(book_id) for book_id in book_ids]
+        self.recommender.remove_books(book_id for book_id, book in zip(book_ids, books) if book is None)
+        self.recommender.update_books((book.id, book.title, book.author, book.genre, book.description)
+                                      for book in books if book is not None)
+        loans = self.loans.loans
+        end = len(loans)
+        self.recommender.add_loans((loan.book_id, loan.borrower)
+                                   for loan in loans[self._recommended_loans:end])
+        self._recommended_loans = end
+    
     def get_all_books(self) -> List[Dict[str, Any]]:
-        return [book.to_dict() for book in self.books]
+        # list() copies the values in one step, so concurrent writers are harmless
+        books = list(self.books.values())
+        count_scanned(len(books))
+        return [book.to_dict() for book in books]
+    
+    def _borrowed_ids(self) -> List[str]:
+        # The facet index's borrowed postings, in id order: the cost depends
+        # on the number of loans, not on the size of the catalogue
+        return sorted(self.facets.filter(available=False), key=int)
     
     def get_borrowed_books(self) -> List[Dict[str, Any]]:
-        return [book.to_dict() for book in self.books if book.is_borrowed]
+        books = self._get_books(self._borrowed_ids())
+        count_scanned(len(books))
+        return [book.to_dict() for book in books]
+    
+    def get_borrowed_books_json(self, fields: Optional[Sequence[str]] = None) -> bytes:
+        return self._json_list(self._borrowed_ids(), fields)
+    
+    @staticmethod
+    def _page(book_ids: Iterable[str], limit: int) -> Tuple[List[str], Optional[str]]:
+        page = []
+        if limit <= 0:
+            return page, None
+        for book_id in book_ids:
+            if len(page) == limit:
+                # There is at least one more book, so hand out a cursor
+                count_scanned(limit + 1)
+                return page, page[-1]
+            page.append(book_id)
+        count_scanned(len(page))
+        return page, None
+    
+    def _books_page_ids(self, after: Optional[str], limit: int) -> Tuple[List[str], Optional[str]]:
+        cursor = None
+        if after is not None:
+            cursor = self.id_order.cursor(after)
+            if cursor is None:
+                if not after.isdigit():
+                    raise ValueError(f"Invalid cursor: {after}")
+                # The cursor book was deleted; ids are ordered, so resume past it
+                cursor = (int(after), float("inf"))
+        return self._page(self.id_order.iter_from(cursor), limit)
+    
+    def _recent_page_ids(self, after: Optional[str], limit: int) -> Tuple[List[str], Optional[str]]:
+        cursor = None
+        if after is not None:
+            cursor = self.date_order.cursor(after)
+            if cursor is None:
+                raise ValueError(f"Invalid cursor: {after}")
+        return self._page(self.date_order.iter_from(cursor, reverse=True), limit)
+    
+    def get_books_page(self, after: Optional[str] = None,
+                       limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        book_ids, next_cursor = self._books_page_ids(after, limit)
+        return [book.to_dict() for book in self._get_books(book_ids)], next_cursor
+    
+    def get_books_page_json(self, after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                            fields: Optional[Sequence[str]] = None) -> Tuple[bytes, Optional[str]]:
+        book_ids, next_cursor = self._books_page_ids(after, limit)
+        return self._json_list(book_ids, fields), next_cursor
+    
+    def get_filtered_books_json(self, filters: Dict[str, Any], after: Optional[str] = None,
+                                limit: int = DEFAULT_PAGE_SIZE,
+                                fields: Optional[Sequence[str]] = None) -> Tuple[bytes, Optional[str]]:
+        """
+        Page through the books matching filters (see FacetIndex.filter), in
+        id order, with the total and the facet counts of all matches.
+        """
+        book_ids = self.facets.filter(**filters)
+        count_scanned(len(book_ids))
+        facets = json.dumps(self.facets.counts(book_ids), separators=(",", ":")).encode()
+        if after is not None and not after.isdigit():
+            raise ValueError(f"Invalid cursor: {after}")
+        start = int(after) if after is not None else 0
+        # Only the page (plus one, to know if there is more) is sorted
+        numbers = heapq.nsmallest(limit + 1, (number for number in map(int, book_ids)
+                                              if number > start))
+        page, next_cursor = self._page((str(number) for number in numbers), limit)
+        body = (b'{"total":%d,"books":' % len(book_ids) + self._json_list(page, fields) +
+                b',"facets":' + facets + b'}')
+        return body, next_cursor
+    
+    def get_recent_books_page(self, after: Optional[str] = None,
+                              limit: int = 5) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        book_ids, next_cursor = self._recent_page_ids(after, limit)
+        return [book.to_dict() for book in self._get_books(book_ids)], next_cursor
+    
+    def get_recent_books_page_json(self, after: Optional[str] = None, limit: int = 5,
+                                   fields: Optional[Sequence[str]] = None) -> Tuple[bytes, Optional[str]]:
+        book_ids, next_cursor = self._recent_page_ids(after, limit)
+        return self._json_list(book_ids, fields), next_cursor
     
     def get_recently_added_books(self, limit: int = 5) -> List[Dict[str, Any]]:
-        sorted_books = sorted(self.books, key=lambda x: x.date_added, reverse=True)
-        return [book.to_dict() for book in sorted_books[:limit]]
+        return self.get_recent_books_page(limit=limit)[0]
     
     def get_stats(self) -> Dict[str, Any]:
-        total_books = len(self.books)
-        borrowed_books = sum(1 for book in self.books if book.is_borrowed)
-        available_books = total_books - borrowed_books
-        
-        genres = set(book.genre for book in self.books if book.genre)
-        authors = set(book.author for book in self.books if book.author)
-        
-        return {
-            "total_books": total_books,
-            "borrowed_books": borrowed_books,
-            "available_books": available_books,
-            "unique_genres": len(genres),
-            "unique_authors": len(authors)
-        }
+        return self.stats.to_dict()
+    
+    @contextmanager
+    def startup_lock(self) -> Iterator[None]:
+        # An in-memory library belongs to one process; nothing to coordinate
+        yield
+
+# The library is opened on the first request (or call to start()), not at
+# import, so a cold process pays only for the app until it is used. It is
+# SQLite when LIBRARY_BACKEND=sqlite; otherwise in memory, either backed by
+# a journal when LIBRARY_DATA_DIR is set (its JSON lines snapshots come with
+# binary images that load faster, see library_image) or loaded from the
+# prebuilt image at LIBRARY_IMAGE.
+# Only the SQLite backend can be shared by several worker processes, e.g.
+#     LIBRARY_BACKEND=sqlite gunicorn -w 4 index:app
+# LIBRARY_SEED=sample adds the sample books to a new, empty library.
+library: Any = None
+overdue_scheduler: Optional[OverdueScheduler] = None
+_start_lock = threading.Lock()
+
+def open_library() -> Any:
+    opened = sqlite_library.from_env(Book)
+    if opened is not None:
+        return opened
+    opened = Library(DescriptionStore.from_env())
+    atexit.register(opened.descriptions.close)
+    store = LibraryStore.from_env()
+    if store is not None:
+        store.load(opened)
+        atexit.register(store.close)
+    elif os.environ.get("LIBRARY_IMAGE"):
+        opened.load_image(os.environ["LIBRARY_IMAGE"])
+    return opened
+
+def seed_sample_books(library) -> None:
+    sample_books = [
+        Book("The Hobbit", "J.R.R. Tolkien", "Fantasy", 1937, "9780547928227"),
+        Book("Dune", "Frank Herbert", "Science Fiction", 1965, "9780441172719"),
+        Book("Pride and Prejudice", "Jane Austen", "Romance", 1813, "9780141439518"),
+        Book("The Shining", "Stephen King", "Horror", 1977, "9780307743657"),
+        Book("The Alchemist", "Paulo Coelho", "Fiction", 1988, "9780062315007")
+    ]
 
-# Create a library instance
-library = Library()
+    for book in sample_books:
+        library.add_book(book)
 
-# Add some sample books
-sample_books = [
-    Book("The Hobbit", "J.R.R. Tolkien", "Fantasy", 1937, "9780547928227"),
-    Book("Dune", "Frank Herbert", "Science Fiction", 1965, "9780441172719"),
-    Book("Pride and Prejudice", "Jane Austen", "Romance", 1813, "9780141439518"),
-    Book("The Shining", "Stephen King", "Horror", 1977, "9780307743657"),
-    Book("The Alchemist", "Paulo Coelho", "Fiction", 1988, "9780062315007")
-]
+    # Set descriptions for the books
+    library.update_book("1", {"description": "Bilbo Baggins is a hobbit who enjoys a comfortable, unambitious life, rarely traveling any farther than his pantry or cellar. But his contentment is disturbed when the wizard Gandalf and a company of dwarves arrive on his doorstep one day to whisk him away on an adventure."})
+    library.update_book("2", {"description": "Set on the desert planet Arrakis, Dune is the story of the boy Paul Atreides, heir to a noble family tasked with ruling an inhospitable world where the only thing of value is the 'spice' melange, a drug capable of extending life and enhancing consciousness."})
+    library.update_book("3", {"description": "The story follows the main character, Elizabeth Bennet, as she deals with issues of manners, upbringing, morality, education, and marriage in the society of the landed gentry of the British Regency."})
+    library.update_book("4", {"description": "Jack Torrance, his wife Wendy, and their young son Danny move into the Overlook Hotel, where Jack has been hired as the winter caretaker. Cut off from civilization for months, Jack hopes to battle alcoholism and uncontrolled rage while writing a play."})
+    library.update_book("5", {"description": "Paulo Coelho's masterpiece tells the mystical story of Santiago, an Andalusian shepherd boy who yearns to travel in search of a worldly treasure. His quest will lead him to riches far different—and far more satisfying—than he ever imagined."})
 
-for book in sample_books:
-    library.add_book(book)
+    # Mark some books as borrowed
+    library.borrow_book("2", "Alice")
+    library.borrow_book("5", "Bob")
 
-# Set descriptions for the books
-library.books[0].description = "Bilbo Baggins is a hobbit who enjoys a comfortable, unambitious life, rarely traveling any farther than his pantry or cellar. But his contentment is disturbed when the wizard Gandalf and a company of dwarves arrive on his doorstep one day to whisk him away on an adventure."
-library.books[1].description = "Set on the desert planet Arrakis, Dune is the story of the boy Paul Atreides, heir to a noble family tasked with ruling an inhospitable world where the only thing of value is the "spice" melange, a drug capable of extending life and enhancing consciousness."
-library.books[2].description = "The story follows the main character, Elizabeth Bennet, as she deals with issues of manners, upbringing, morality, education, and marriage in the society of the landed gentry of the British Regency."
-library.books[3].description = "Jack Torrance, his wife Wendy, and their young son Danny move into the Overlook Hotel, where Jack has been hired as the winter caretaker. Cut off from civilization for months, Jack hopes to battle alcoholism and uncontrolled rage while writing a play."
-library.books[4].description = "Paulo Coelho's masterpiece tells the mystical story of Santiago, an Andalusian shepherd boy who yearns to travel in search of a worldly treasure. His quest will lead him to riches far different—and far more satisfying—than he ever imagined."
+# Report loans as they become overdue, every LIBRARY_OVERDUE_INTERVAL seconds
+# (0 disables the check; GET /api/loans/overdue is always up to date)
+def log_overdue(loans: List[Dict[str, Any]]) -> None:
+    for loan in loans:
+        app.logger.warning("Loan %s of book %s to %s is overdue (due %s)",
+                           loan["id"], loan["book_id"], loan["borrower"], loan["due_date"])
 
-# Mark some books as borrowed
-library.borrow_book("2", "Alice")
-library.borrow_book("5", "Bob")
+def start() -> Any:
+    """Open, seed and schedule the library on first use (once per process) and return it."""
+    global library, overdue_scheduler
+    if library is not None:
+        return library
+    with _start_lock:
+        if library is None:
+            with library_image.paused_gc():
+                opened = open_library()
+                # The catalogue lives as long as the process: keep later
+                # collections from walking it again
+                gc.freeze()
+            if os.environ.get("LIBRARY_SEED") == "sample":
+                # Worker processes sharing a SQLite database take turns, so
+                # only the first one seeds it
+                with opened.startup_lock():
+                    if len(opened) == 0:
+                        seed_sample_books(opened)
+            overdue_interval = float(os.environ.get("LIBRARY_OVERDUE_INTERVAL", 3600))
+            if overdue_interval > 0:
+                overdue_scheduler = OverdueScheduler(opened.check_overdue, log_overdue, overdue_interval)
+                overdue_scheduler.start()
+            # Published last: other threads never see a half-started library
+            library = opened
+    return library
+
+# Instrumentation: latency, phase times and items scanned for every request,
+# and a cProfile dump of slow requests that ask for it (see Profiler)
+@app.before_request
+def start_instrumentation():
+    request.environ['library.timer'] = metrics.start_request()
+    request.environ['library.profile'] = profiler.start(
+        instrumentation.PROFILE_HEADER in request.headers)
+
+@app.before_request
+def start_library():
+    # The first request opens the library (and its time is counted in it)
+    start()
+
+@app.after_request
+def finish_instrumentation(response):
+    timer = request.environ.pop('library.timer', None)
+    if timer is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    duration = metrics.finish_request(timer, route, request.method, response.status_code)
+    profile = request.environ.pop('library.profile', None)
+    if profile is not None:
+        filename = profiler.finish(profile, route, duration)
+        if filename:
+            response.headers['X-Profile-File'] = os.path.basename(filename)
+    return response
 
 # API Routes
+def page_args(args, default_limit: int) -> Tuple[Optional[str], int]:
+    after = args.get('after')
+    limit = args.get('limit', default=default_limit, type=int)
+    return after, max(0, min(limit, MAX_PAGE_SIZE))
+
+def filter_args(args) -> Optional[Dict[str, Any]]:
+    # Facet filters of GET /api/books, or None when the request has none
+    if not any(name in args for name in FILTER_ARGS):
+        return None
+    filters = {}
+    for name in ('genre', 'author'):
+        if args.get(name):
+            filters[name] = args[name]
+    for name in ('year_from', 'year_to'):
+        if args.get(name):
+            try:
+                filters[name] = int(args[name])
+            except ValueError:
+                raise ValueError(f"Invalid {name}: {args[name]}")
+    if args.get('available'):
+        filters['available'] = args['available'].lower() in ('1', 'true', 'yes')
+    return filters
+
+def fields_arg(args) -> Optional[Tuple[str, ...]]:
+    # ?fields=title,author: the book fields a response should include, or
+    # None (the endpoint's default) when the request names none
+    fields = args.get('fields')
+    if fields is None:
+        return None
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+    for name in names:
+        if name not in Book.fields:
+            raise ValueError(f"Unknown field: {name}")
+    return names or None
+
+# Builders for the cached listings, shared with the ASGI entry point (asgi.py).
+# Each takes the query arguments and returns (JSON body, next cursor).
+
+def books_listing(args) -> Tuple[bytes, Optional[str]]:
+    fields = fields_arg(args)
+    ids = args.get('ids')
+    if ids is not None:
+        # Multi-get: /api/books?ids=1,2,3 resolves several books in one request
+        book_ids = [book_id for book_id in ids.split(',') if book_id][:MAX_PAGE_SIZE]
+        return library.get_books_json(book_ids, fields), None
+    after, limit = page_args(args, DEFAULT_PAGE_SIZE)
+    filters = filter_args(args)
+    if filters is not None:
+        # Filtered listings come back as {"total", "books", "facets"}
+        return library.get_filtered_books_json(filters, after, limit, fields)
+    return library.get_books_page_json(after, limit, fields)
+
+def recent_listing(args) -> Tuple[bytes, Optional[str]]:
+    after, limit = page_args(args, 5)
+    return library.get_recent_books_page_json(after, limit, fields_arg(args))
+
+def borrowed_listing(args) -> Tuple[bytes, Optional[str]]:
+    return library.get_borrowed_books_json(fields_arg(args)), None
+
+def dashboard_listing(args) -> Tuple[bytes, Optional[str]]:
+    # Everything the dashboard page shows, in one response. The cursor
+    # continues the "books" page; ?fields= applies to all three lists.
+    fields = fields_arg(args)
+    books, next_cursor = books_listing(args)
+    recent, _ = library.get_recent_books_page_json(limit=5, fields=fields)
+    stats = json.dumps(library.get_stats(), separators=(",", ":")).encode()
+    body = (b'{"stats":' + stats + b',"books":' + books + b',"recent":' + recent +
+            b',"borrowed":' + library.get_borrowed_books_json(fields) + b'}')
+    return body, next_cursor
+
+def cached_json_response(build: Callable[[], Tuple[bytes, Optional[str]]]):
+    # Unchanged library, unchanged listing: answer conditional polls with 304
+    etag = library.etag
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    try:
+        body, next_cursor = build()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
 @app.route('/api/books', methods=['GET'])
 def get_books():
-    return jsonify(library.get_all_books())
+    return cached_json_response(lambda: books_listing(request.args))
 
 @app.route('/api/books', methods=['POST'])
 def add_book():
     data = request.json
+    try:
+        check_book_data(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     book = Book(
         title=data.get('title'),
         author=data.get('author'),
@@ -166,18 +1138,79 @@ def add_book():
     added_book = library.add_book(book)
     return jsonify(added_book.to_dict()), 201
 
+@app.route('/api/books/bulk', methods=['POST'])
+def bulk_add_books():
+    fmt = request.args.get('format') or bulk_io.detect_format(request.content_type)
+    if fmt not in bulk_io.FORMATS:
+        return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+    
+    # Rows are parsed straight off the request body, one at a time
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    batch_size = request.args.get('batch_size', default=bulk_io.DEFAULT_BATCH_SIZE, type=int)
+    summary = bulk_io.import_rows(
+        bulk_io.read_rows(stream, fmt),
+        lambda batch: library.add_books([Book.from_dict(data) for data in batch]),
+        batch_size=max(1, batch_size)
+    )
+    return jsonify(summary)
+
+@app.route('/api/books/export', methods=['GET'])
+def export_books():
+    fmt = request.args.get('format', default='ndjson')
+    if fmt not in bulk_io.FORMATS:
+        return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+    
+    records = (book.to_dict() for book in library.iter_books())
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(bulk_io.export_chunks(records, fmt), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=books.{fmt}'
+    return response
+
+@app.route('/api/books/search', methods=['GET'])
+def search_books():
+    query = request.args.get('q', default='')
+    search_type = request.args.get('type', default='all')
+    limit = request.args.get('limit', default=None, type=int)
+    try:
+        fields = fields_arg(request.args) or LIST_FIELDS
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get('fuzzy', '').lower() in ('1', 'true', 'yes'):
+        # "Did you mean" mode answers {"books", "did_you_mean"}
+        return jsonify(library.search_books_fuzzy(query, search_type, limit, fields))
+    return jsonify(library.search_books(query, search_type, limit, fields))
+
 @app.route('/api/books/<book_id>', methods=['GET'])
 def get_book(book_id):
+    # The whole book, description included, unless ?fields= narrows it
+    try:
+        fields = fields_arg(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     book = library.get_book(book_id)
     if not book:
         return jsonify({"error": "Book not found"}), 404
     
-    return jsonify(book.to_dict())
+    return jsonify(book.to_dict(fields))
+
+@app.route('/api/books/<book_id>/similar', methods=['GET'])
+def get_similar_books(book_id):
+    # "Readers also borrowed" and "more like this" for the book page
+    if not library.get_book(book_id):
+        return jsonify({"error": "Book not found"}), 404
+    
+    def build() -> Tuple[bytes, Optional[str]]:
+        limit = max(0, min(request.args.get('limit', default=SIMILAR_LIMIT, type=int), TOP_K))
+        return library.get_similar_json(book_id, limit, fields_arg(request.args)), None
+    return cached_json_response(build)
 
 @app.route('/api/books/<book_id>', methods=['PUT'])
 def update_book(book_id):
     data = request.json
-    updated_book = library.update_book(book_id, data)
+    try:
+        updated_book = library.update_book(book_id, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     if not updated_book:
         return jsonify({"error": "Book not found"}), 404
@@ -201,7 +1234,10 @@ def borrow_book(book_id):
     if not borrower:
         return jsonify({"error": "Borrower name is required"}), 400
     
-    book = library.borrow_book(book_id, borrower)
+    try:
+        book = library.borrow_book(book_id, borrower, data.get('due_date'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     if not book:
         return jsonify({"error": "Book not found or already borrowed"}), 404
@@ -217,18 +1253,94 @@ def return_book(book_id):
     
     return jsonify(book.to_dict())
 
+@app.route('/api/circulation/batch', methods=['POST'])
+def circulation_batch():
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list):
+        return jsonify({"error": "Expected {\"operations\": [...]}"}), 400
+    if len(operations) > MAX_CIRCULATION_OPERATIONS:
+        return jsonify({"error": f"At most {MAX_CIRCULATION_OPERATIONS} operations per batch"}), 400
+    
+    try:
+        books = library.apply_batch(operations)
+    except circulation.BatchRejected as e:
+        failed = {error["index"]: error for error in e.errors}
+        results = [{"status": CIRCULATION_STATUS[failed[index]["reason"]],
+                    "body": {"error": failed[index]["error"]}} if index in failed else
+                   {"status": 424, "body": {"error": "Not applied: another operation failed"}}
+                   for index in range(len(operations))]
+        invalid = any(error["reason"] == circulation.INVALID for error in e.errors)
+        return jsonify({"error": str(e), "results": results}), 400 if invalid else 409
+    
+    return jsonify({"results": [{"status": 200, "body": book} for book in books]})
+
 @app.route('/api/books/borrowed', methods=['GET'])
 def get_borrowed_books():
-    return jsonify(library.get_borrowed_books())
+    return cached_json_response(lambda: borrowed_listing(request.args))
 
 @app.route('/api/books/recent', methods=['GET'])
 def get_recent_books():
-    limit = request.args.get('limit', default=5, type=int)
-    return jsonify(library.get_recently_added_books(limit))
+    return cached_json_response(lambda: recent_listing(request.args))
+
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    return cached_json_response(lambda: dashboard_listing(request.args))
+
+@app.route('/api/loans', methods=['GET'])
+def get_loans():
+    borrower = request.args.get('borrower')
+    book_id = request.args.get('book_id')
+    if not borrower and not book_id:
+        return jsonify({"error": "borrower or book_id is required"}), 400
+    
+    return jsonify(library.get_loans(borrower=borrower, book_id=book_id))
+
+@app.route('/api/loans/overdue', methods=['GET'])
+def get_overdue_loans():
+    return jsonify(library.get_overdue_loans())
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     return jsonify(library.get_stats())
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def run_operation(operation: Any) -> bytes:
+    # Dispatches one batched request through the normal routes and returns
+    # its result as {"status": ..., "body": ...} JSON
+    if not isinstance(operation, dict) or not isinstance(operation.get('path'), str):
+        return json.dumps({"status": 400, "body": {"error": "Each operation needs a path"}}).encode()
+    path = operation['path']
+    method = str(operation.get('method', 'GET')).upper()
+    if path.split('?', 1)[0] in BATCH_EXCLUDED_PATHS:
+        return json.dumps({"status": 400, "body": {"error": f"{path} cannot be batched"}}).encode()
+    
+    headers = {}
+    if operation.get('etag'):
+        headers['If-None-Match'] = f'"{operation["etag"]}"'
+    with app.test_request_context(path, method=method, json=operation.get('body'), headers=headers):
+        response = app.make_response(app.full_dispatch_request())
+    body = response.get_data() if response.is_json else b''
+    # Bodies are already JSON, so they are spliced in rather than re-encoded
+    return b'{"status":%d,"body":%s}' % (response.status_code, body or b'null')
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list):
+        return jsonify({"error": "Expected {\"operations\": [...]}"}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_OPERATIONS} operations per batch"}), 400
+    
+    # Operations run in order, each exactly as if it had been sent on its own
+    results = b",".join(run_operation(operation) for operation in operations)
+    return app.response_class(b'{"results":[' + results + b']}', mimetype='application/json')
+
 if __name__ == '__main__':
+    # The development server starts with the sample catalogue
+    os.environ.setdefault('LIBRARY_SEED', 'sample')
     app.run(port=5328, debug=True)
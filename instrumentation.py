@@ -0,0 +1,250 @@
+import contextvars
+import cProfile
+import functools
+import inspect
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Upper bounds of the histogram buckets (Prometheus "le"), plus +Inf
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SCANNED_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# Time not spent in a named phase is reported as this one
+OTHER_PHASE = "other"
+
+# Header that asks for a request to be profiled (when profiling is enabled)
+PROFILE_HEADER = "X-Profile"
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observations, one series per label set."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        """Initialize an empty histogram with the given bucket bounds."""
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self.series: Dict[Tuple[Tuple[str, str], ...], List[Any]] = {}
+
+    def observe(self, labels: Tuple[Tuple[str, str], ...], value: float) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+
+class RequestTimer:
+    """
+    Exclusive time per phase for one request.
+
+    Phases nest (a Library call may serialize books); entering a phase
+    pauses the one around it, so every moment is counted once, in the
+    innermost phase.
+    """
+
+    __slots__ = ("started", "phases", "scanned", "token", "_stack")
+
+    def __init__(self):
+        """Start timing a request."""
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.scanned = 0
+        self.token: Optional[contextvars.Token] = None
+        self._stack: List[List[Any]] = []
+
+    def enter(self, phase: str) -> None:
+        now = time.perf_counter()
+        if self._stack:
+            outer = self._stack[-1]
+            self.phases[outer[0]] = self.phases.get(outer[0], 0.0) + now - outer[1]
+        self._stack.append([phase, now])
+
+    def exit(self) -> None:
+        now = time.perf_counter()
+        phase, started = self._stack.pop()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - started
+        if self._stack:
+            self._stack[-1][1] = now
+
+
+# Timer of the request being handled, per thread or asyncio task
+_current: contextvars.ContextVar[Optional[RequestTimer]] = contextvars.ContextVar("request_timer", default=None)
+
+
+def timed(phase: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator that adds a function's time to phase of the current request."""
+    def decorate(function: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            timer = _current.get()
+            if timer is None:
+                return function(*args, **kwargs)
+            timer.enter(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timer.exit()
+        return wrapper
+    return decorate
+
+
+def timed_methods(phase: str) -> Callable[[type], type]:
+    """Class decorator applying timed(phase) to every public method."""
+    def decorate(cls: type) -> type:
+        for name, value in list(vars(cls).items()):
+            if not name.startswith("_") and inspect.isfunction(value):
+                setattr(cls, name, timed(phase)(value))
+        return cls
+    return decorate
+
+
+def count_scanned(count: int) -> None:
+    """Record that the current request looked at count items."""
+    timer = _current.get()
+    if timer is not None:
+        timer.scanned += count
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels)
+
+
+class Metrics:
+    """
+    Per-route request metrics, rendered in the Prometheus text format.
+
+    Records request latency and items scanned as histograms, time per
+    phase (Library calls, serialization, jsonify, everything else) as
+    counters, and the number of requests by status.
+    """
+
+    def __init__(self):
+        """Initialize empty metrics."""
+        self._lock = threading.Lock()
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.scanned = Histogram(SCANNED_BUCKETS)
+        self.phase_seconds: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self.requests: Dict[Tuple[Tuple[str, str], ...], int] = {}
+
+    def start_request(self) -> RequestTimer:
+        """Start timing the current request (requests may nest, as in a batch)."""
+        timer = RequestTimer()
+        timer.token = _current.set(timer)
+        return timer
+
+    def finish_request(self, timer: RequestTimer, route: str, method: str, status: int) -> float:
+        """Record a finished request and return its duration in seconds."""
+        duration = time.perf_counter() - timer.started
+        try:
+            _current.reset(timer.token)
+        except ValueError:
+            # Finished in another context than it started in
+            _current.set(None)
+        labels = (("route", route), ("method", method))
+        with self._lock:
+            self.latency.observe(labels, duration)
+            self.scanned.observe(labels, timer.scanned)
+            status_labels = labels + (("status", str(status)),)
+            self.requests[status_labels] = self.requests.get(status_labels, 0) + 1
+            phases = dict(timer.phases)
+            phases[OTHER_PHASE] = max(0.0, duration - sum(timer.phases.values()))
+            for phase, seconds in phases.items():
+                key = labels + (("phase", phase),)
+                self.phase_seconds[key] = self.phase_seconds.get(key, 0.0) + seconds
+        return duration
+
+    @staticmethod
+    def _histogram_lines(name: str, histogram: Histogram) -> List[str]:
+        lines = []
+        bounds = [str(bound) for bound in histogram.buckets] + ["+Inf"]
+        for labels, (counts, total, count) in sorted(histogram.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{{{_format_labels(labels + (('le', bound),))}}} {cumulative}")
+            lines.append(f"{name}_sum{{{_format_labels(labels)}}} {total}")
+            lines.append(f"{name}_count{{{_format_labels(labels)}}} {count}")
+        return lines
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                "# HELP library_request_duration_seconds Request latency by route.",
+                "# TYPE library_request_duration_seconds histogram",
+                *self._histogram_lines("library_request_duration_seconds", self.latency),
+                "# HELP library_request_phase_seconds_total Time spent per phase of handling requests.",
+                "# TYPE library_request_phase_seconds_total counter",
+                *(f"library_request_phase_seconds_total{{{_format_labels(labels)}}} {seconds}"
+                  for labels, seconds in sorted(self.phase_seconds.items())),
+                "# HELP library_items_scanned Items (books, ids, search candidates) looked at per request.",
+                "# TYPE library_items_scanned histogram",
+                *self._histogram_lines("library_items_scanned", self.scanned),
+                "# HELP library_requests_total Requests handled, by status.",
+                "# TYPE library_requests_total counter",
+                *(f"library_requests_total{{{_format_labels(labels)}}} {count}"
+                  for labels, count in sorted(self.requests.items())),
+            ]
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """
+    Opt-in cProfile hook for finding slow requests.
+
+    Profiling is off unless a directory is configured. Then a request is
+    profiled when it carries the X-Profile header, or at random with
+    probability sample_rate, and its stats are dumped to the directory
+    when it took at least slow_seconds.
+    """
+
+    def __init__(self, directory: Optional[str], slow_seconds: float = 0.1, sample_rate: float = 0.0):
+        """Configure the profiler (directory None disables it)."""
+        self.directory = directory
+        self.slow_seconds = slow_seconds
+        self.sample_rate = sample_rate
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, environ: Dict[str, str] = os.environ) -> 'Profiler':
+        """Configure from LIBRARY_PROFILE_DIR, LIBRARY_PROFILE_SLOW_MS and LIBRARY_PROFILE_SAMPLE."""
+        return cls(environ.get("LIBRARY_PROFILE_DIR") or None,
+                   slow_seconds=float(environ.get("LIBRARY_PROFILE_SLOW_MS", 100)) / 1000,
+                   sample_rate=float(environ.get("LIBRARY_PROFILE_SAMPLE", 0)))
+
+    def start(self, requested: bool) -> Optional[cProfile.Profile]:
+        """Start profiling this request if it is asked for or sampled."""
+        if not self.directory:
+            return None
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return None
+        return profile
+
+    def finish(self, profile: cProfile.Profile, route: str, duration: float) -> Optional[str]:
+        """Stop profiling; dump the stats if the request was slow and return the file name."""
+        profile.disable()
+        if duration < self.slow_seconds:
+            return None
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        filename = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-"
+                                                f"{int(duration * 1000)}ms-{os.getpid()}-"
+                                                f"{threading.get_ident()}.prof")
+        profile.dump_stats(filename)
+        return filename
@@ -0,0 +1,193 @@
+"""
+Binary images of an in-memory library, for fast cold starts.
+
+An image holds everything index.Library keeps in memory (its books as
+columns and its prebuilt indexes, pickled) plus every description, so
+loading one needs no JSON parsing and no re-indexing. The file is
+memory-mapped: descriptions are never read at load time, only sliced out
+of the mapping when a book's details are asked for.
+
+Layout:
+
+    magic (8 bytes) | state (pickle) | descriptions (UTF-8, back to back)
+    | description index (native 64-bit ints, one per book number)
+    | header (JSON) | header length (8 bytes, little-endian)
+
+The header gives the offset and length of the three sections, plus any
+fields the caller adds (LibraryStore records its sequence number). Each
+description index entry packs a description's offset within the
+descriptions section and its length, like DescriptionStore does (NO_ENTRY
+for none).
+
+Images are pickles: only load ones you built. They are tied to the code
+and the byte order that wrote them, so they are only ever a cache:
+LibraryStore keeps a JSON lines snapshot next to each image it writes and
+falls back to it whenever the image cannot be used. Index.Library records
+the shape of its state in the header, so an image written by code whose
+classes have changed since is refused rather than half loaded.
+
+Build one for LIBRARY_IMAGE with:
+
+    python library_image.py catalogue.img --import books.ndjson
+"""
+import argparse
+import contextlib
+import gc
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+import bulk_io
+from description_store import LENGTH_BITS, NO_ENTRY
+from storage import LibraryStore, fsync_directory
+
+MAGIC = b"LIBIMG01"
+_LENGTH = struct.Struct("<Q")
+
+# Bumped whenever the pickled state changes shape
+FORMAT_VERSION = 1
+
+# The description index starts on an 8-byte boundary, so it can be cast in place
+_ALIGNMENT = 8
+
+
+@contextlib.contextmanager
+def paused_gc() -> Iterator[None]:
+    """
+    Keep the cyclic garbage collector off while a library is loaded.
+
+    A loaded library is one large graph of long-lived objects; collecting
+    while it is built would only walk it over and over.
+    """
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def write(path: str, header: Dict[str, Any], state: Any,
+          descriptions: Iterable[Tuple[int, Optional[str]]]) -> None:
+    """
+    Write an image atomically (readers see the old or the new file).
+
+    Args:
+        path: Image file to (re)place
+        header: Extra header fields, e.g. {"seq": ...}
+        state: Picklable state of the library
+        descriptions: (book number, description) pairs
+    """
+    tmp_name = f"{path}.tmp"
+    sections: Dict[str, Tuple[int, int]] = {}
+    with open(tmp_name, "wb") as f:
+        f.write(MAGIC)
+        start = f.tell()
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        sections["state"] = (start, f.tell() - start)
+
+        start = f.tell()
+        entries = array("Q")
+        for number, description in descriptions:
+            if number >= len(entries):
+                entries.extend([NO_ENTRY] * (number + 1 - len(entries)))
+            if description is not None:
+                data = description.encode("utf-8")
+                entries[number] = (f.tell() - start) << LENGTH_BITS | len(data)
+                f.write(data)
+        sections["descriptions"] = (start, f.tell() - start)
+
+        f.write(b"\0" * (-f.tell() % _ALIGNMENT))
+        sections["description_index"] = (f.tell(), len(entries) * entries.itemsize)
+        entries.tofile(f)
+
+        header_data = json.dumps(dict(header, format=FORMAT_VERSION, byteorder=sys.byteorder,
+                                      sections=sections)).encode()
+        f.write(header_data)
+        f.write(_LENGTH.pack(len(header_data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, path)
+    fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def load(path: str, expected: Optional[Dict[str, Any]] = None
+         ) -> Tuple[Dict[str, Any], Any, memoryview, memoryview]:
+    """
+    Map an image and unpickle its state.
+
+    Args:
+        path: Image file to load
+        expected: Header fields the image must have, checked before
+            anything is unpickled
+
+    Returns:
+        (header, state, descriptions, description index): the last two are
+        views of the mapping, which stays open as long as they are alive
+
+    Raises:
+        ValueError: If the file is not an image, was written by another
+            version or machine, or does not have the expected fields
+    """
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path} is not a library image")
+    header_end = len(view) - _LENGTH.size
+    header_length, = _LENGTH.unpack_from(view, header_end)
+    header = json.loads(bytes(view[header_end - header_length:header_end]))
+    if header.get("format") != FORMAT_VERSION or header.get("byteorder") != sys.byteorder:
+        raise ValueError(f"{path} was written by an incompatible version or machine")
+    for key, value in (expected or {}).items():
+        if header.get(key) != value:
+            raise ValueError(f"{path} has a different {key} than expected")
+
+    def section(name: str) -> memoryview:
+        offset, length = header["sections"][name]
+        return view[offset:offset + length]
+
+    with paused_gc():
+        state = pickle.loads(section("state"))
+    return header, state, section("descriptions"), section("description_index").cast("Q")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Build a library image (see LIBRARY_IMAGE).")
+    parser.add_argument("output", help="image file to write")
+    parser.add_argument("--data-dir", help="start from this LIBRARY_DATA_DIR (snapshot and journal)")
+    parser.add_argument("--import", dest="import_file", help="add the books of a CSV or NDJSON file")
+    parser.add_argument("--sample", action="store_true", help="add the sample books")
+    args = parser.parse_args()
+
+    # Imported here, as index imports this module
+    import index
+
+    library = index.Library()
+    if args.data_dir:
+        store = LibraryStore(args.data_dir, snapshot_every=0)
+        store.load(library)
+        store.close()
+        library.store = None
+    if args.import_file:
+        fmt = bulk_io.detect_format(args.import_file)
+        with open(args.import_file, encoding="utf-8", newline="") as f:
+            summary = bulk_io.import_rows(
+                bulk_io.read_rows(f, fmt),
+                lambda batch: library.add_books([index.Book.from_dict(data) for data in batch]))
+        print(f"imported {summary['imported']} books, {summary['failed']} failed", file=sys.stderr)
+    if args.sample:
+        index.seed_sample_books(library)
+    library.save_image(args.output, {})
+    print(f"wrote {len(library)} books to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
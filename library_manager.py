@@ -1,9 +1,26 @@
 import json
-from datetime import datetime
+import sys
 from typing import List, Dict, Optional, Union, Any
 
+import bulk_io
+from library_stats import LibraryStats
+from search_index import SearchIndex
+from storage import write_json_atomic
+from timestamps import format_day, format_timestamp, now_timestamp, to_day, to_timestamp, today
+
 class Book:
-    """Class representing a book in the library."""
+    """
+    Class representing a book in the library.
+    
+    Books use __slots__, store dates as integers (epoch seconds for
+    date_added, day ordinals for borrowed/return dates) and intern genre and
+    author, so large collections stay compact. The date properties and
+    to_dict still present dates as formatted strings.
+    """
+    
+    __slots__ = ("title", "_author", "_genre", "publication_year", "isbn",
+                 "_date_added", "is_borrowed", "_borrowed_date", "_return_date",
+                 "borrower")
     
     def __init__(self, title: str, author: str, genre: str, 
                  publication_year: int = None, isbn: str = None):
@@ -13,23 +30,70 @@ class Book:
         self.genre = genre
         self.publication_year = publication_year
         self.isbn = isbn
-        self.date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._date_added = now_timestamp()
         self.is_borrowed = False
-        self.borrowed_date = None
-        self.return_date = None
+        self._borrowed_date = None
+        self._return_date = None
+        self.borrower = None
+    
+    @property
+    def author(self) -> str:
+        """The book's author (interned)."""
+        return self._author
+    
+    @author.setter
+    def author(self, value: str) -> None:
+        self._author = sys.intern(value) if isinstance(value, str) else value
+    
+    @property
+    def genre(self) -> str:
+        """The book's genre (interned)."""
+        return self._genre
+    
+    @genre.setter
+    def genre(self, value: str) -> None:
+        self._genre = sys.intern(value) if isinstance(value, str) else value
+    
+    @property
+    def date_added(self) -> Optional[str]:
+        """When the book was added, as "%Y-%m-%d %H:%M:%S"."""
+        return format_timestamp(self._date_added)
+    
+    @date_added.setter
+    def date_added(self, value: Union[None, int, str]) -> None:
+        self._date_added = to_timestamp(value)
+    
+    @property
+    def borrowed_date(self) -> Optional[str]:
+        """When the book was last borrowed, as "%Y-%m-%d"."""
+        return format_day(self._borrowed_date)
+    
+    @borrowed_date.setter
+    def borrowed_date(self, value: Union[None, int, str]) -> None:
+        self._borrowed_date = to_day(value)
+    
+    @property
+    def return_date(self) -> Optional[str]:
+        """When the book was last returned, as "%Y-%m-%d"."""
+        return format_day(self._return_date)
+    
+    @return_date.setter
+    def return_date(self, value: Union[None, int, str]) -> None:
+        self._return_date = to_day(value)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert book object to dictionary for serialization."""
         return {
             "title": self.title,
-            "author": self.author,
-            "genre": self.genre,
+            "author": self._author,
+            "genre": self._genre,
             "publication_year": self.publication_year,
             "isbn": self.isbn,
-            "date_added": self.date_added,
+            "date_added": format_timestamp(self._date_added),
             "is_borrowed": self.is_borrowed,
-            "borrowed_date": self.borrowed_date,
-            "return_date": self.return_date
+            "borrowed_date": format_day(self._borrowed_date),
+            "return_date": format_day(self._return_date),
+            "borrower": self.borrower
         }
     
     @classmethod
@@ -39,13 +103,12 @@ class Book:
             title=data["title"],
             author=data["author"],
             genre=data["genre"],
-            publication_year=data["publication_year"],
-            isbn=data["isbn"]
+            publication_year=data.get("publication_year"),
+            isbn=data.get("isbn")
         )
-        book.date_added = data["date_added"]
-        book.is_borrowed = data["is_borrowed"]
-        book.borrowed_date = data["borrowed_date"]
-        book.return_date = data["return_date"]
+        for key in ("date_added", "is_borrowed", "borrowed_date", "return_date", "borrower"):
+            if data.get(key) is not None:
+                setattr(book, key, data[key])
         return book
     
     def __str__(self) -> str:
@@ -63,62 +126,134 @@ class Library:
         """Initialize a library with a name."""
         self.name = name
         self.books: List[Book] = []
+        # Position of each book in books, by id(book), so removing one moves
+        # only the last book into its place instead of rebuilding the list
+        self._positions: Dict[int, int] = {}
+        # Books by lowercased title and by ISBN, in the order they were added
+        self.title_index: Dict[str, List[Book]] = {}
+        self.isbn_index: Dict[str, List[Book]] = {}
+        self.search_index = SearchIndex()
+        self.stats = LibraryStats()
+    
+    def _register(self, book: Book) -> None:
+        """Add a book to the collection and its indexes."""
+        self._positions[id(book)] = len(self.books)
+        self.books.append(book)
+        self.title_index.setdefault(book.title.lower(), []).append(book)
+        if book.isbn:
+            self.isbn_index.setdefault(book.isbn, []).append(book)
+        self.search_index.add(book, book.to_dict())
+        self.stats.add_book(book)
+    
+    def _unregister(self, book: Book) -> None:
+        """Remove a book from the collection and its indexes."""
+        position = self._positions.pop(id(book))
+        last = self.books.pop()
+        if last is not book:
+            self.books[position] = last
+            self._positions[id(last)] = position
+        self._unindex(self.title_index, book.title.lower(), book)
+        if book.isbn:
+            self._unindex(self.isbn_index, book.isbn, book)
+        self.search_index.remove(book)
+        self.stats.remove_book(book)
+    
+    @staticmethod
+    def _unindex(index: Dict[str, List[Book]], key: str, book: Book) -> None:
+        """Remove book from index[key], dropping the key once it is empty."""
+        remaining = [other for other in index.get(key, ()) if other is not book]
+        if remaining:
+            index[key] = remaining
+        else:
+            index.pop(key, None)
+    
+    def _find_by_title(self, title: str, fuzzy: bool = False) -> List[Book]:
+        """
+        Find the books with title (case-insensitive).
+        
+        If there are none, the closest title is suggested; with fuzzy the
+        books with that title are returned instead, otherwise none.
+        """
+        books = self.title_index.get(title.lower())
+        if books:
+            return books
+        
+        suggestion = self.suggest_title(title)
+        if suggestion is None:
+            print(f"Book '{title}' not found in the library.")
+            return []
+        if not fuzzy:
+            print(f"Book '{title}' not found in the library. Did you mean '{suggestion}'?")
+            return []
+        print(f"Book '{title}' not found in the library, using '{suggestion}'.")
+        return self.title_index[suggestion.lower()]
+    
+    def suggest_title(self, title: str) -> Optional[str]:
+        """Return the title of the book that title most likely misspells, if any."""
+        suggestion = self.search_index.suggest(title, "title")
+        if suggestion is None:
+            return None
+        books = self.title_index.get(suggestion)
+        if not books:
+            # The corrected words may be part of a longer title; accept it
+            # only if it picks out a single one
+            matches = self.search_index.search(suggestion, "title", limit=2)
+            if len(matches) != 1:
+                return None
+            books = [matches[0]]
+        return books[0].title
     
     def add_book(self, book: Book) -> None:
         """Add a book to the library."""
-        self.books.append(book)
+        self._register(book)
         print(f"Added: {book.title} by {book.author}")
     
-    def remove_book(self, title: str = None, isbn: str = None) -> bool:
-        """Remove a book from the library by title or ISBN."""
+    def remove_book(self, title: str = None, isbn: str = None, fuzzy: bool = False) -> bool:
+        """
+        Remove a book from the library by title or ISBN.
+        
+        With fuzzy, a title that matches no book is replaced by the closest
+        one ("did you mean"); otherwise that title is only suggested.
+        """
         if not title and not isbn:
             print("Error: Please provide either a title or ISBN to remove a book.")
             return False
         
-        initial_count = len(self.books)
-        
         if isbn:
-            self.books = [book for book in self.books if book.isbn != isbn]
+            removed = list(self.isbn_index.get(isbn, ()))
+            if not removed:
+                print(f"Book with ISBN {isbn} not found in the library.")
         else:
-            self.books = [book for book in self.books if book.title.lower() != title.lower()]
+            removed = list(self._find_by_title(title, fuzzy))
         
-        if len(self.books) < initial_count:
-            print(f"Book {'with ISBN ' + isbn if isbn else title} removed successfully.")
+        if removed:
+            for book in removed:
+                self._unregister(book)
+            print(f"Book {'with ISBN ' + isbn if isbn else removed[0].title} removed successfully.")
             return True
-        else:
-            print(f"Book {'with ISBN ' + isbn if isbn else title} not found in the library.")
-            return False
+        return False
     
-    def search_books(self, query: str, search_type: str = "all") -> List[Book]:
+    def search_books(self, query: str, search_type: str = "all",
+                     limit: Optional[int] = None, fuzzy: bool = False) -> List[Book]:
         """
         Search for books in the library.
         
         Args:
             query: The search term
             search_type: Where to search - "title", "author", "genre", or "all"
+            limit: Maximum number of results to return (all if None)
+            fuzzy: If nothing matches, search for the corrected query
+                ("did you mean") instead, tolerating typos such as "tolkein"
         
         Returns:
-            A list of matching Book objects
+            A list of matching Book objects, best matches first
         """
-        query = query.lower()
-        results = []
-        
-        for book in self.books:
-            if search_type == "title" and query in book.title.lower():
-                results.append(book)
-            elif search_type == "author" and query in book.author.lower():
-                results.append(book)
-            elif search_type == "genre" and query in book.genre.lower():
-                results.append(book)
-            elif search_type == "all" and (
-                query in book.title.lower() or 
-                query in book.author.lower() or 
-                query in book.genre.lower() or
-                (book.isbn and query in book.isbn.lower())
-            ):
-                results.append(book)
-        
-        return results
+        if not fuzzy:
+            return self.search_index.search(query, search_type, limit)
+        books, suggestion = self.search_index.search_or_suggest(query, search_type, limit)
+        if suggestion is not None:
+            print(f"No books match '{query}'. Did you mean '{suggestion}'?")
+        return books
     
     def display_books(self, books: List[Book] = None) -> None:
         """Display a list of books or all books in the library."""
@@ -137,107 +272,108 @@ class Library:
         
         print(f"{'=' * 80}\n")
     
-    def borrow_book(self, title: str, borrower: str) -> bool:
-        """Mark a book as borrowed."""
-        for book in self.books:
-            if book.title.lower() == title.lower():
-                if book.is_borrowed:
-                    print(f"'{book.title}' is already borrowed.")
-                    return False
-                
-                book.is_borrowed = True
-                book.borrowed_date = datetime.now().strftime("%Y-%m-%d")
-                book.borrower = borrower
-                print(f"'{book.title}' has been borrowed by {borrower}.")
-                return True
+    def borrow_book(self, title: str, borrower: str, fuzzy: bool = False) -> bool:
+        """Mark a book as borrowed (fuzzy: as in remove_book)."""
+        books = self._find_by_title(title, fuzzy)
+        if not books:
+            return False
         
-        print(f"Book '{title}' not found in the library.")
-        return False
+        book = books[0]
+        if book.is_borrowed:
+            print(f"'{book.title}' is already borrowed.")
+            return False
+        
+        book.is_borrowed = True
+        self.stats.borrow_book()
+        book.borrowed_date = today()
+        book.borrower = borrower
+        print(f"'{book.title}' has been borrowed by {borrower}.")
+        return True
     
-    def return_book(self, title: str) -> bool:
-        """Mark a book as returned."""
-        for book in self.books:
-            if book.title.lower() == title.lower():
-                if not book.is_borrowed:
-                    print(f"'{book.title}' is not currently borrowed.")
-                    return False
-                
-                book.is_borrowed = False
-                book.return_date = datetime.now().strftime("%Y-%m-%d")
-                borrower = getattr(book, 'borrower', 'someone')
-                print(f"'{book.title}' has been returned by {borrower}.")
-                return True
+    def return_book(self, title: str, fuzzy: bool = False) -> bool:
+        """Mark a book as returned (fuzzy: as in remove_book)."""
+        books = self._find_by_title(title, fuzzy)
+        if not books:
+            return False
         
-        print(f"Book '{title}' not found in the library.")
-        return False
+        book = books[0]
+        if not book.is_borrowed:
+            print(f"'{book.title}' is not currently borrowed.")
+            return False
+        
+        book.is_borrowed = False
+        self.stats.return_book()
+        book.return_date = today()
+        borrower = book.borrower or 'someone'
+        book.borrower = None
+        print(f"'{book.title}' has been returned by {borrower}.")
+        return True
     
     def get_statistics(self) -> Dict[str, Any]:
         """Get statistics about the library."""
-        total_books = len(self.books)
-        borrowed_books = sum(1 for book in self.books if book.is_borrowed)
-        available_books = total_books - borrowed_books
-        
-        genres = {}
-        authors = {}
-        
-        for book in self.books:
-            genres[book.genre] = genres.get(book.genre, 0) + 1
-            authors[book.author] = authors.get(book.author, 0) + 1
-        
-        top_genres = sorted(genres.items(), key=lambda x: x[1], reverse=True)[:3]
-        top_authors = sorted(authors.items(), key=lambda x: x[1], reverse=True)[:3]
-        
-        return {
-            "total_books": total_books,
-            "borrowed_books": borrowed_books,
-            "available_books": available_books,
-            "unique_genres": len(genres),
-            "unique_authors": len(authors),
-            "top_genres": top_genres,
-            "top_authors": top_authors
-        }
+        return self.stats.to_dict(top=3)
     
     def save_to_file(self, filename: str = "library.json") -> bool:
-        """Save the library to a JSON file."""
+        """Save the library to a JSON file, replacing it atomically."""
         try:
             data = {
                 "name": self.name,
                 "books": [book.to_dict() for book in self.books]
             }
-            
-            # In a real environment, we would use:
-            # with open(filename, 'w') as f:
-            #     json.dump(data, f, indent=4)
-            
-            # For demonstration, we'll just print the JSON
-            print(f"Library would be saved to {filename}")
-            print(json.dumps(data, indent=2)[:200] + "... (truncated)")
+            write_json_atomic(filename, data, indent=4)
+            print(f"Library saved to {filename}")
             return True
         except Exception as e:
             print(f"Error saving library: {e}")
             return False
     
+    def import_file(self, filename: str, fmt: str = None) -> Dict[str, Any]:
+        """
+        Import books from an NDJSON or CSV file.
+        
+        The file is read row by row, so only one batch of rows is held in
+        memory beyond the books themselves.
+        
+        Args:
+            filename: The file to read
+            fmt: "ndjson" or "csv" (guessed from the file name if None)
+        
+        Returns:
+            A summary with imported and failed counts and per-row errors
+        """
+        fmt = fmt or bulk_io.detect_format(filename)
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            summary = bulk_io.import_rows(
+                bulk_io.read_rows(f, fmt),
+                lambda batch: [self._register(Book.from_dict(data)) for data in batch]
+            )
+        
+        print(f"Imported {summary['imported']} book(s) from {filename}, "
+              f"{summary['failed']} row(s) failed.")
+        return summary
+    
+    def export_file(self, filename: str, fmt: str = None) -> int:
+        """Export every book to an NDJSON or CSV file, returning the count."""
+        fmt = fmt or bulk_io.detect_format(filename)
+        with open(filename, 'w', encoding='utf-8', newline='') as f:
+            for chunk in bulk_io.export_chunks((book.to_dict() for book in self.books), fmt):
+                f.write(chunk)
+        
+        print(f"Exported {len(self.books)} book(s) to {filename}")
+        return len(self.books)
+    
     @classmethod
     def load_from_file(cls, filename: str = "library.json") -> Optional['Library']:
         """Load a library from a JSON file."""
         try:
-            # In a real environment, we would use:
-            # with open(filename, 'r') as f:
-            #     data = json.load(f)
-            
-            # For demonstration, we'll create sample data
-            print(f"In a real environment, the library would be loaded from {filename}")
+            with open(filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
             
-            # Create a sample library for demonstration
-            library = cls("Demo Library")
-            sample_books = [
-                Book("The Great Gatsby", "F. Scott Fitzgerald", "Classic", 1925),
-                Book("To Kill a Mockingbird", "Harper Lee", "Fiction", 1960),
-                Book("1984", "George Orwell", "Dystopian", 1949)
-            ]
-            for book in sample_books:
-                library.add_book(book)
+            library = cls(data.get("name", "My Personal Library"))
+            for book_data in data.get("books", []):
+                library._register(Book.from_dict(book_data))
             
+            print(f"Loaded {len(library.books)} book(s) from {filename}")
             return library
         except Exception as e:
             print(f"Error loading library: {e}")
@@ -265,6 +401,11 @@ def demo_library_manager():
     results = my_library.search_books("the", "title")
     my_library.display_books(results)
     
+    # Search with a typo
+    print("\nSearching for 'tolkein' with suggestions:")
+    results = my_library.search_books("tolkein", fuzzy=True)
+    my_library.display_books(results)
+    
     # Borrow a book
     my_library.borrow_book("Dune", "Alice")
     my_library.borrow_book("The Hobbit", "Bob")
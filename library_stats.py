@@ -0,0 +1,119 @@
+from bisect import bisect_left, insort
+from typing import Any, Dict, Hashable, List, Tuple
+
+
+class RankedCounter:
+    """
+    Counter that can report its k most common keys in O(k).
+
+    Keys are grouped into buckets by count and the distinct counts are kept
+    in a sorted list. Counts only ever move by one, so an update touches at
+    most two buckets, and the number of distinct counts stays small (it is
+    bounded by the square root of twice the total count).
+    """
+
+    def __init__(self):
+        """Initialize an empty counter."""
+        self.counts: Dict[Hashable, int] = {}
+        self._buckets: Dict[int, Dict[Hashable, None]] = {}
+        self._levels: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def _move(self, key: Hashable, old: int, new: int) -> None:
+        if old:
+            bucket = self._buckets[old]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[old]
+                del self._levels[bisect_left(self._levels, old)]
+        if new:
+            bucket = self._buckets.get(new)
+            if bucket is None:
+                bucket = self._buckets[new] = {}
+                insort(self._levels, new)
+            bucket[key] = None
+            self.counts[key] = new
+        else:
+            self.counts.pop(key, None)
+
+    def increment(self, key: Hashable) -> None:
+        """Add one to the count of key."""
+        count = self.counts.get(key, 0)
+        self._move(key, count, count + 1)
+
+    def decrement(self, key: Hashable) -> None:
+        """Subtract one from the count of key, forgetting it at zero."""
+        count = self.counts.get(key, 0)
+        if count:
+            self._move(key, count, count - 1)
+
+    def most_common(self, k: int) -> List[Tuple[Hashable, int]]:
+        """Return up to k (key, count) pairs, highest count first."""
+        result = []
+        for level in reversed(self._levels):
+            for key in self._buckets[level]:
+                if len(result) >= k:
+                    return result
+                result.append((key, level))
+        return result
+
+
+class LibraryStats:
+    """
+    Running totals behind the library statistics endpoints.
+
+    The owning library reports every add, remove, borrow and return, so
+    reading the statistics never needs to look at the books themselves.
+    Empty genres and authors are not counted.
+    """
+
+    def __init__(self):
+        """Initialize statistics for an empty library."""
+        self.total_books = 0
+        self.borrowed_books = 0
+        self.genres = RankedCounter()
+        self.authors = RankedCounter()
+
+    def add_book(self, book: Any) -> None:
+        """Count a book that has joined the library."""
+        self.total_books += 1
+        if book.is_borrowed:
+            self.borrowed_books += 1
+        if book.genre:
+            self.genres.increment(book.genre)
+        if book.author:
+            self.authors.increment(book.author)
+
+    def remove_book(self, book: Any) -> None:
+        """Stop counting a book that has left the library."""
+        self.total_books -= 1
+        if book.is_borrowed:
+            self.borrowed_books -= 1
+        if book.genre:
+            self.genres.decrement(book.genre)
+        if book.author:
+            self.authors.decrement(book.author)
+
+    def borrow_book(self) -> None:
+        """Record that an available book has been borrowed."""
+        self.borrowed_books += 1
+
+    def return_book(self) -> None:
+        """Record that a borrowed book has been returned."""
+        self.borrowed_books -= 1
+
+    def to_dict(self, top: int = 0) -> Dict[str, Any]:
+        """Return the statistics, with the top genres and authors if top > 0."""
+        stats = {
+            "total_books": self.total_books,
+            "borrowed_books": self.borrowed_books,
+            "available_books": self.total_books - self.borrowed_books,
+            "unique_genres": len(self.genres),
+            "unique_authors": len(self.authors),
+        }
+        if top > 0:
+            stats["top_genres"] = self.genres.most_common(top)
+            stats["top_authors"] = self.authors.most_common(top)
+        return stats
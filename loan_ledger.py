@@ -0,0 +1,216 @@
+import heapq
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from timestamps import format_day, to_day
+
+logger = logging.getLogger(__name__)
+
+# Length of a loan when the borrower does not ask for a due date
+DEFAULT_LOAN_DAYS = 14
+
+
+class Loan:
+    """One borrowing of one book. Dates are day ordinals."""
+
+    __slots__ = ("id", "book_id", "borrower", "borrowed_day", "due_day", "returned_day")
+
+    def __init__(self, loan_id: int, book_id: str, borrower: str, borrowed_day: int,
+                 due_day: int, returned_day: Optional[int] = None):
+        """Initialize a loan."""
+        self.id = loan_id
+        self.book_id = book_id
+        self.borrower = borrower
+        self.borrowed_day = borrowed_day
+        self.due_day = due_day
+        self.returned_day = returned_day
+
+    @property
+    def is_open(self) -> bool:
+        return self.returned_day is None
+
+    def is_overdue(self, day: int) -> bool:
+        """Whether the loan is still open after its due date."""
+        return self.returned_day is None and self.due_day < day
+
+    def to_dict(self, day: Optional[int] = None) -> Dict[str, Any]:
+        data = {
+            "id": self.id,
+            "book_id": self.book_id,
+            "borrower": self.borrower,
+            "borrowed_date": format_day(self.borrowed_day),
+            "due_date": format_day(self.due_day),
+            "returned_date": format_day(self.returned_day),
+        }
+        if day is not None:
+            data["is_overdue"] = self.is_overdue(day)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Loan':
+        return cls(data["id"], data["book_id"], data["borrower"], to_day(data["borrowed_date"]),
+                   to_day(data["due_date"]), to_day(data.get("returned_date")))
+
+
+class LoanLedger:
+    """
+    Append-only history of loans.
+
+    Loans are never removed: returning a book only sets the returned day of
+    its open loan. Loans are indexed by borrower and by book, and open loans
+    sit in a heap keyed by due day, so finding the loans that have become
+    overdue pops only those entries (O(log n) each) instead of scanning
+    every book. Heap entries of returned loans are skipped when they reach
+    the top.
+
+    Callers serialize mutations (including overdue(), which advances the
+    heap); the read methods return copies and may run concurrently.
+    """
+
+    def __init__(self):
+        """Initialize an empty ledger."""
+        self.loans: List[Loan] = []
+        self.by_borrower: Dict[str, List[Loan]] = {}
+        self.by_book: Dict[str, List[Loan]] = {}
+        self.open_loans: Dict[str, Loan] = {}
+        self._due: List[Tuple[int, int]] = []
+        # Open loans already popped from the heap as overdue, by loan id, and
+        # those among them not yet handed to take_newly_overdue()
+        self._overdue: Dict[int, Loan] = {}
+        self._newly_overdue: List[Loan] = []
+
+    def __len__(self) -> int:
+        return len(self.loans)
+
+    def _append(self, loan: Loan) -> Loan:
+        self.loans.append(loan)
+        self.by_borrower.setdefault(loan.borrower, []).append(loan)
+        self.by_book.setdefault(loan.book_id, []).append(loan)
+        if loan.is_open:
+            self.open_loans[loan.book_id] = loan
+            heapq.heappush(self._due, (loan.due_day, loan.id))
+        return loan
+
+    def open(self, book_id: str, borrower: str, borrowed_day: int,
+             due_day: Optional[int] = None) -> Loan:
+        """Record a new loan of book_id, closing any loan it still had open."""
+        self.close(book_id, borrowed_day)
+        if due_day is None:
+            due_day = borrowed_day + DEFAULT_LOAN_DAYS
+        return self._append(Loan(len(self.loans) + 1, book_id, borrower, borrowed_day, due_day))
+
+    def close(self, book_id: str, returned_day: int) -> Optional[Loan]:
+        """Mark the open loan of book_id as returned, if there is one."""
+        loan = self.open_loans.pop(book_id, None)
+        if loan is None:
+            return None
+        loan.returned_day = returned_day
+        self._overdue.pop(loan.id, None)
+        return loan
+
+    def restore(self, data: Dict[str, Any]) -> Loan:
+        """Re-add a loan saved with to_dict (loans must be restored in id order)."""
+        loan = Loan.from_dict(data)
+        if loan.is_open:
+            # A book has at most one open loan
+            self.close(loan.book_id, loan.borrowed_day)
+        return self._append(loan)
+
+    def savepoint(self, book_ids: Iterable[str]) -> Tuple[int, Dict[str, Tuple[Loan, bool]]]:
+        """Mark the ledger so that rollback() can undo later changes to the loans of book_ids."""
+        open_loans = {}
+        for book_id in book_ids:
+            loan = self.open_loans.get(book_id)
+            if loan is not None:
+                open_loans[book_id] = (loan, loan.id in self._overdue)
+        return len(self.loans), open_loans
+
+    def rollback(self, savepoint: Tuple[int, Dict[str, Tuple[Loan, bool]]]) -> None:
+        """
+        Undo the loans opened and closed since savepoint() was called.
+
+        Only the loans of the books given to savepoint() may have changed,
+        and overdue loans must not have been advanced in between.
+        """
+        count, open_loans = savepoint
+        for loan in reversed(self.loans[count:]):
+            for index, key in ((self.by_borrower, loan.borrower), (self.by_book, loan.book_id)):
+                index[key].pop()
+                if not index[key]:
+                    del index[key]
+            if self.open_loans.get(loan.book_id) is loan:
+                del self.open_loans[loan.book_id]
+        if len(self.loans) > count:
+            del self.loans[count:]
+            self._due = [entry for entry in self._due if entry[1] <= count]
+            heapq.heapify(self._due)
+        for book_id, (loan, overdue) in open_loans.items():
+            loan.returned_day = None
+            self.open_loans[book_id] = loan
+            if overdue:
+                self._overdue[loan.id] = loan
+
+    def for_borrower(self, borrower: str) -> List[Loan]:
+        """Every loan of borrower, oldest first."""
+        return list(self.by_borrower.get(borrower, ()))
+
+    def for_book(self, book_id: str) -> List[Loan]:
+        """Every loan of book_id, oldest first."""
+        return list(self.by_book.get(book_id, ()))
+
+    def advance(self, day: int) -> None:
+        """Pop the open loans due before day from the heap into the overdue set."""
+        while self._due and self._due[0][0] < day:
+            _, loan_id = heapq.heappop(self._due)
+            loan = self.loans[loan_id - 1]
+            if loan.is_open:
+                self._overdue[loan_id] = loan
+                self._newly_overdue.append(loan)
+
+    def take_newly_overdue(self, day: int) -> List[Loan]:
+        """Advance to day and return the loans that became overdue since the last call."""
+        self.advance(day)
+        loans = [loan for loan in self._newly_overdue if loan.is_open]
+        self._newly_overdue = []
+        return loans
+
+    def overdue(self, day: int) -> List[Loan]:
+        """Every open loan past its due date on day, earliest due first."""
+        self.advance(day)
+        return sorted(self._overdue.values(), key=lambda loan: (loan.due_day, loan.id))
+
+
+class OverdueScheduler(threading.Thread):
+    """
+    Background thread that periodically checks for newly overdue loans.
+
+    check() is called every interval seconds and must return the loans that
+    became overdue since the previous call; they are passed to on_overdue.
+    Errors of either are logged and the next check runs as planned.
+    """
+
+    def __init__(self, check: Callable[[], List[Dict[str, Any]]],
+                 on_overdue: Callable[[List[Dict[str, Any]]], None], interval: float):
+        """Configure the scheduler; call start() to run it."""
+        super().__init__(name="overdue-scheduler", daemon=True)
+        self.check = check
+        self.on_overdue = on_overdue
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while True:
+            try:
+                loans = self.check()
+                if loans:
+                    self.on_overdue(loans)
+            except Exception:
+                # One failed check must not end overdue detection for good
+                logger.exception("Checking for overdue loans failed")
+            if self._stopped.wait(self.interval):
+                return
+
+    def stop(self) -> None:
+        """Ask the thread to finish after its current check."""
+        self._stopped.set()
@@ -0,0 +1,88 @@
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+# Entries are (sort key, sequence number, item id)
+Entry = Tuple[Any, int, Hashable]
+
+
+class OrderedIndex:
+    """
+    Items kept sorted by a key, with cursor-based iteration.
+
+    Removal is lazy: the stale entry stays in the sorted list and is skipped
+    during iteration until enough of them accumulate to be worth compacting,
+    so removing an item never shifts the list. Items added in key order (the
+    common case for timestamps and sequential ids) are appended in O(1).
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self._entries: List[Entry] = []
+        self._live: Dict[Hashable, Entry] = {}
+        self._next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __contains__(self, item_id: Hashable) -> bool:
+        return item_id in self._live
+
+    def insert(self, key: Any, item_id: Hashable) -> None:
+        """Add item_id under key, replacing any key it already had."""
+        self.discard(item_id)
+        entry = (key, self._next_seq, item_id)
+        self._next_seq += 1
+        self._live[item_id] = entry
+
+        if not self._entries or self._entries[-1][:2] <= entry[:2]:
+            self._entries.append(entry)
+        else:
+            self._entries.insert(bisect_right(self._entries, entry[:2]), entry)
+
+    def discard(self, item_id: Hashable) -> bool:
+        """Remove item_id if present."""
+        if self._live.pop(item_id, None) is None:
+            return False
+        if len(self._entries) > 2 * len(self._live) + 64:
+            self._compact()
+        return True
+
+    def _compact(self) -> None:
+        live = self._live
+        self._entries = [entry for entry in self._entries if live.get(entry[2]) == entry]
+
+    def cursor(self, item_id: Hashable) -> Optional[Tuple[Any, int]]:
+        """Return the position of item_id for use as an iteration bound."""
+        entry = self._live.get(item_id)
+        return entry[:2] if entry else None
+
+    def iter_from(self, after: Optional[Tuple[Any, float]] = None,
+                  reverse: bool = False) -> Iterator[Hashable]:
+        """
+        Yield item ids in key order, oldest first unless reverse is set.
+
+        Args:
+            after: Position (from cursor) to resume after, exclusive
+            reverse: Iterate from the highest key down
+
+        Returns:
+            An iterator over live item ids
+        """
+        entries = self._entries
+        live = self._live
+
+        if reverse:
+            index = len(entries) - 1 if after is None else bisect_left(entries, after) - 1
+            while index >= 0:
+                entry = entries[index]
+                if live.get(entry[2]) == entry:
+                    yield entry[2]
+                index -= 1
+        else:
+            # Sequence numbers are integers, so this skips the entry at after
+            index = 0 if after is None else bisect_left(entries, (after[0], after[1] + 1))
+            while index < len(entries):
+                entry = entries[index]
+                if live.get(entry[2]) == entry:
+                    yield entry[2]
+                index += 1
@@ -0,0 +1,419 @@
+import re
+import zlib
+from collections import OrderedDict, deque
+from itertools import chain, filterfalse
+from typing import Any, Deque, Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+# Neighbours kept per book, i.e. the most a lookup can return
+TOP_K = 20
+
+# Books whose neighbour lists are cached, per kind of neighbour
+CACHE_SIZE = 10000
+
+# A loan is paired with the books of its reader's previous WINDOW loans
+WINDOW = 20
+
+# Co-borrow counts added one loan at a time are folded into the compressed
+# rows once this many have piled up
+FOLD_SIZE = 200000
+
+# Width of the hashed word vectors (float32, so 4 bytes per book each)
+DIMENSIONS = 128
+
+# Books encoded per NumPy batch
+BATCH_SIZE = 1024
+
+# Score of a shared author and of a shared genre, added to the cosine of the
+# books' word vectors
+AUTHOR_WEIGHT = 0.5
+GENRE_WEIGHT = 0.25
+
+# Words of at least three letters, except those that say nothing about a book
+_WORD_PATTERN = re.compile(r"[a-z0-9]{3,}")
+STOPWORDS = frozenset((
+    "and", "are", "but", "for", "from", "has", "have", "her", "him", "his", "into", "its",
+    "not", "one", "she", "that", "the", "their", "them", "they", "this", "was", "were",
+    "what", "when", "where", "which", "who", "whom", "with", "you", "your",
+))
+
+# (id, title, author, genre, description) of a book to encode
+BookContent = Tuple[Hashable, Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the (at most) k best positive scores, best first, ties in position order."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.zeros(0, dtype=np.intp)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+    return candidates[scores[candidates] > 0]
+
+
+class LruCache:
+    """Mapping that forgets its least recently used entries beyond maxsize."""
+
+    def __init__(self, maxsize: int):
+        """Initialize an empty cache."""
+        self.maxsize = maxsize
+        self._data: 'OrderedDict[Hashable, Any]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        """The value of key (now the most recently used), or None."""
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store value under key, evicting the least recently used entry if full."""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        """Forget key, if cached."""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Forget every entry."""
+        self._data.clear()
+
+
+class CoBorrowMatrix:
+    """
+    Sparse, symmetric matrix of how often two books were borrowed by the
+    same reader within WINDOW loans of each other, with loans per book.
+
+    Books are numbered in the order of their first loan. The counts are
+    kept as a sorted array of keys (row << 32 | column) and an array of
+    counts, so a book's row is found by two binary searches. Loans given
+    to an empty matrix are counted in one vectorised pass; later loans are
+    counted one by one into a dict of dicts, which is folded into the
+    arrays (a merge, not a sort) once it holds FOLD_SIZE counts.
+    """
+
+    def __init__(self):
+        """Initialize an empty matrix."""
+        self._numbers: Dict[Hashable, int] = {}
+        self._ids: List[Hashable] = []
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._loans = np.zeros(0, dtype=np.int64)
+        self._removed = np.zeros(0, dtype=bool)
+        self._added: Dict[int, Dict[int, int]] = {}
+        self._added_size = 0
+        # Books of each reader's last WINDOW loans
+        self._recent: Dict[str, Deque[int]] = {}
+
+    def _number(self, book_id: Hashable) -> int:
+        number = self._numbers.get(book_id)
+        if number is None:
+            number = self._numbers[book_id] = len(self._ids)
+            self._ids.append(book_id)
+        return number
+
+    def _reserve(self) -> None:
+        # Room in the per-book arrays for every book numbered so far
+        size = len(self._loans)
+        if len(self._ids) > size:
+            capacity = max(len(self._ids), 2 * size, 1024)
+            self._loans = np.concatenate((self._loans, np.zeros(capacity - size, dtype=np.int64)))
+            self._removed = np.concatenate((self._removed, np.zeros(capacity - size, dtype=bool)))
+
+    def add(self, loans: Sequence[Tuple[Hashable, Optional[str]]]) -> Optional[Set[Hashable]]:
+        """
+        Count (book id, borrower) loans, in the order they were made.
+
+        Returns:
+            The ids of the books that were borrowed, or None if the loans
+            were counted all at once (only while the matrix was empty)
+        """
+        loans = [loan for loan in loans if loan[1] is not None]
+        if not self._recent and len(loans) > 1:
+            self._add_all(loans)
+            return None
+        borrowed = set()
+        for book_id, borrower in loans:
+            number = self._number(book_id)
+            self._reserve()
+            self._loans[number] += 1
+            recent = self._recent.get(borrower)
+            if recent is None:
+                recent = self._recent[borrower] = deque(maxlen=WINDOW)
+            row = self._added.setdefault(number, {})
+            for other in recent:
+                if other != number:
+                    row[other] = row.get(other, 0) + 1
+                    other_row = self._added.setdefault(other, {})
+                    other_row[number] = other_row.get(number, 0) + 1
+                    self._added_size += 2
+            recent.append(number)
+            borrowed.add(book_id)
+        if self._added_size >= FOLD_SIZE:
+            self._fold()
+        return borrowed
+
+    def _add_all(self, loans: List[Tuple[Hashable, str]]) -> None:
+        numbers = np.fromiter((self._number(book_id) for book_id, _ in loans), dtype=np.int64, count=len(loans))
+        self._reserve()
+        readers: Dict[str, int] = {}
+        codes = np.fromiter((readers.setdefault(borrower, len(readers)) for _, borrower in loans),
+                            dtype=np.int64, count=len(loans))
+        # Each reader's loans together, still in the order they were made:
+        # pairs of loans WINDOW or fewer apart are pairs of co-borrowed books
+        order = np.argsort(codes, kind="stable")
+        books, codes = numbers[order], codes[order]
+        keys = []
+        for distance in range(1, WINDOW + 1):
+            later, earlier = books[distance:], books[:-distance]
+            paired = (codes[distance:] == codes[:-distance]) & (later != earlier)
+            later, earlier = later[paired], earlier[paired]
+            keys += [later << 32 | earlier, earlier << 32 | later]
+        self._keys, self._counts = np.unique(np.concatenate(keys), return_counts=True)
+        self._counts = self._counts.astype(np.int64)
+        self._loans += np.bincount(numbers, minlength=len(self._loans))
+        for number, (_, borrower) in zip(numbers.tolist(), loans):
+            recent = self._recent.get(borrower)
+            if recent is None:
+                recent = self._recent[borrower] = deque(maxlen=WINDOW)
+            recent.append(number)
+
+    def _fold(self) -> None:
+        added = sorted((number << 32 | other, count) for number, row in self._added.items()
+                       for other, count in row.items())
+        keys = np.fromiter((key for key, _ in added), dtype=np.int64, count=len(added))
+        counts = np.fromiter((count for _, count in added), dtype=np.int64, count=len(added))
+        positions = np.searchsorted(self._keys, keys)
+        found = positions < len(self._keys)
+        found[found] = self._keys[positions[found]] == keys[found]
+        self._counts[positions[found]] += counts[found]
+        self._keys = np.insert(self._keys, positions[~found], keys[~found])
+        self._counts = np.insert(self._counts, positions[~found], counts[~found])
+        self._added, self._added_size = {}, 0
+
+    def remove(self, book_id: Hashable) -> None:
+        """Leave a deleted book out of every row from now on."""
+        number = self._numbers.get(book_id)
+        if number is not None:
+            self._removed[number] = True
+
+    def partners(self, book_id: Hashable) -> List[Hashable]:
+        """Ids of every book co-borrowed with book_id."""
+        number = self._numbers.get(book_id)
+        if number is None:
+            return []
+        columns, _ = self._row(number)
+        return [self._ids[column] for column in columns.tolist()]
+
+    def _row(self, number: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = np.searchsorted(self._keys, (number << 32, (number + 1) << 32))
+        columns = self._keys[start:end] & 0xFFFFFFFF
+        counts = self._counts[start:end]
+        added = self._added.get(number)
+        if added:
+            columns = np.concatenate((columns, np.fromiter(added, dtype=np.int64, count=len(added))))
+            counts = np.concatenate((counts, np.fromiter(added.values(), dtype=np.int64, count=len(added))))
+            columns, inverse = np.unique(columns, return_inverse=True)
+            counts = np.bincount(inverse, weights=counts)
+        return columns, counts
+
+    def neighbours(self, book_id: Hashable, k: int) -> List[Hashable]:
+        """
+        Up to k books most co-borrowed with book_id, best first: by the
+        cosine of their loans, count / sqrt(loans of one * loans of the other).
+        """
+        number = self._numbers.get(book_id)
+        if number is None:
+            return []
+        columns, counts = self._row(number)
+        scores = counts / np.sqrt(self._loans[number] * self._loans[columns])
+        scores[self._removed[columns]] = -np.inf
+        return [self._ids[column] for column in columns[top_k(scores, k)].tolist()]
+
+
+class Recommender:
+    """
+    "Readers also borrowed" and "more like this" neighbours of books.
+
+    Co-borrowing is counted in a CoBorrowMatrix, fed the loans as they are
+    made. Content is one row per book in NumPy arrays: a hashed,
+    L2-normalised vector of the words of its title and description, and
+    integer codes of its author and genre. Books are encoded in batches of
+    BATCH_SIZE, and a book's neighbours are found in one vectorised pass
+    over the rows (a matrix-vector product, two comparisons and an
+    argpartition).
+
+    The TOP_K neighbours of each kind are cached per book, least recently
+    used first out, so a repeated lookup costs O(k). Loans drop the cached
+    lists whose scores they change; any change of content empties the
+    content cache, as it can change any book's neighbours.
+
+    Not thread-safe: callers serialize every call.
+    """
+
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        """Initialize an empty recommender."""
+        self._co_borrowed = CoBorrowMatrix()
+        # Content rows, with the rows of removed books reused
+        self._rows: Dict[Hashable, int] = {}
+        self._ids: List[Optional[Hashable]] = []
+        self._free: List[int] = []
+        self._vectors = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self._authors = np.zeros(0, dtype=np.int32)
+        self._genres = np.zeros(0, dtype=np.int32)
+        self._live = np.zeros(0, dtype=bool)
+        self._author_codes: Dict[str, int] = {}
+        self._genre_codes: Dict[str, int] = {}
+        self._also_borrowed = LruCache(cache_size)
+        self._more_like_this = LruCache(cache_size)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, book_id: Hashable) -> bool:
+        return book_id in self._rows
+
+    def add_loans(self, loans: Iterable[Tuple[Hashable, Optional[str]]]) -> None:
+        """Count (book id, borrower) loans, in the order they were made."""
+        borrowed = self._co_borrowed.add(list(loans))
+        if borrowed is None:
+            self._also_borrowed.clear()
+            return
+        # A book's loans are part of its score in the lists of every book
+        # it was borrowed with. When those are many, starting over is cheaper.
+        stale = set(borrowed)
+        for book_id in borrowed:
+            if len(stale) > len(self._also_borrowed):
+                self._also_borrowed.clear()
+                return
+            stale.update(self._co_borrowed.partners(book_id))
+        for book_id in stale:
+            self._also_borrowed.discard(book_id)
+
+    def update_books(self, books: Iterable[BookContent]) -> None:
+        """Encode (or re-encode) the content of books, BATCH_SIZE at a time."""
+        batch = []
+        for book in books:
+            batch.append(book)
+            if len(batch) == BATCH_SIZE:
+                self._encode(batch)
+                batch = []
+        if batch:
+            self._encode(batch)
+
+    def remove_books(self, book_ids: Iterable[Hashable]) -> None:
+        """Forget books that were deleted."""
+        removed = False
+        for book_id in book_ids:
+            row = self._rows.pop(book_id, None)
+            if row is not None:
+                self._ids[row] = None
+                self._live[row] = False
+                self._free.append(row)
+                removed = True
+            self._co_borrowed.remove(book_id)
+        if removed:
+            # Lists naming a removed book just come out shorter until evicted
+            self._more_like_this.clear()
+
+    def also_borrowed(self, book_id: Hashable, limit: int = TOP_K) -> List[Hashable]:
+        """Up to limit books most often borrowed by the readers of book_id, best first."""
+        if book_id not in self._rows:
+            return []
+        neighbours = self._also_borrowed.get(book_id)
+        if neighbours is None:
+            neighbours = self._co_borrowed.neighbours(book_id, TOP_K)
+            self._also_borrowed.put(book_id, neighbours)
+        return neighbours[:limit]
+
+    def more_like_this(self, book_id: Hashable, limit: int = TOP_K) -> List[Hashable]:
+        """Up to limit books closest to book_id in author, genre and words, best first."""
+        row = self._rows.get(book_id)
+        if row is None:
+            return []
+        neighbours = self._more_like_this.get(book_id)
+        if neighbours is None:
+            neighbours = self._content_neighbours(row)
+            self._more_like_this.put(book_id, neighbours)
+        return neighbours[:limit]
+
+    def _content_neighbours(self, row: int) -> List[Hashable]:
+        count = len(self._ids)
+        scores = self._vectors[:count] @ self._vectors[row]
+        author, genre = self._authors[row], self._genres[row]
+        if author >= 0:
+            scores += AUTHOR_WEIGHT * (self._authors[:count] == author)
+        if genre >= 0:
+            scores += GENRE_WEIGHT * (self._genres[:count] == genre)
+        scores[~self._live[:count]] = -np.inf
+        scores[row] = -np.inf
+        return [self._ids[candidate] for candidate in top_k(scores, TOP_K).tolist()]
+
+    @staticmethod
+    def _code(codes: Dict[str, int], value: Optional[str]) -> int:
+        if not value:
+            return -1
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def _allocate(self, book_id: Hashable) -> int:
+        row = self._rows.get(book_id)
+        if row is not None:
+            return row
+        if self._free:
+            row = self._free.pop()
+            self._ids[row] = book_id
+        else:
+            row = len(self._ids)
+            self._ids.append(book_id)
+            if row == len(self._live):
+                self._grow(max(BATCH_SIZE, 2 * row))
+        self._rows[book_id] = row
+        return row
+
+    def _grow(self, capacity: int) -> None:
+        size = len(self._live)
+        for name in ("_vectors", "_authors", "_genres", "_live"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:size] = old
+            setattr(self, name, new)
+
+    def _encode(self, books: List[BookContent]) -> None:
+        # Every distinct word of a book adds 1 + log(its count) to one of
+        # DIMENSIONS columns, with a sign, both taken from its CRC: the
+        # hashing trick, which keeps dot products unbiased with no
+        # vocabulary. Words are hashed once per batch.
+        texts = [_WORD_PATTERN.findall(f"{title or ''} {description or ''}".lower())
+                 for _, title, _, _, description in books]
+        texts = [list(filterfalse(STOPWORDS.__contains__, words)) for words in texts]
+        words = {word: number for number, word in enumerate(dict.fromkeys(chain.from_iterable(texts)))}
+        digests = np.fromiter((zlib.crc32(word.encode()) for word in words), dtype=np.int64, count=len(words))
+        positions = np.repeat(np.arange(len(books), dtype=np.int64), [len(text) for text in texts])
+        numbers = np.fromiter(map(words.__getitem__, chain.from_iterable(texts)), dtype=np.int64,
+                              count=len(positions))
+        width = max(len(words), 1)
+        keys, counts = np.unique(positions * width + numbers, return_counts=True)
+        positions, digests = keys // width, digests[keys % width]
+        values = (1 + np.log(counts)) * np.where(digests & 0x80000000, 1, -1)
+        vectors = np.bincount(positions * DIMENSIONS + digests % DIMENSIONS, weights=values,
+                              minlength=len(books) * DIMENSIONS)
+        vectors = vectors.reshape(len(books), DIMENSIONS).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+        rows = np.array([self._allocate(book[0]) for book in books], dtype=np.intp)
+        self._vectors[rows] = vectors
+        self._authors[rows] = [self._code(self._author_codes, book[2]) for book in books]
+        self._genres[rows] = [self._code(self._genre_codes, book[3]) for book in books]
+        self._live[rows] = True
+        self._more_like_this.clear()
@@ -0,0 +1,241 @@
+import heapq
+import re
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from fuzzy_index import FuzzyIndex, suggest
+from instrumentation import count_scanned
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Relative importance of a match in each field when ranking results
+FIELD_WEIGHTS = {
+    "title": 4,
+    "author": 3,
+    "genre": 2,
+    "isbn": 1,
+}
+
+# Fields consulted for each search_type accepted by search_books
+SEARCH_TYPES = {
+    "title": ("title",),
+    "author": ("author",),
+    "genre": ("genre",),
+    "all": ("title", "author", "genre", "isbn"),
+}
+
+# Fields whose words are corrected by "did you mean" suggestions
+FUZZY_FIELDS = ("title", "author", "genre")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split lowercased text into alphanumeric tokens."""
+    return TOKEN_PATTERN.findall(text)
+
+
+def trigrams(text: str) -> Set[str]:
+    """Return the set of three-character substrings of text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """
+    Incrementally maintained inverted index over book fields.
+
+    Every field keeps two posting maps: whole tokens (used for ranking) and
+    trigrams (used to find substring and prefix matches without scanning
+    the whole catalogue). Candidates from the trigram postings are verified
+    against the stored lowercased text, so results are exactly the books
+    whose field contains the query, as with a plain substring search.
+
+    The words of the FUZZY_FIELDS also go into a FuzzyIndex per field, from
+    which suggest() builds a corrected query for searches that found
+    nothing.
+    """
+
+    def __init__(self, fields: Iterable[str] = tuple(FIELD_WEIGHTS)):
+        """Initialize an empty index over the given fields."""
+        self.fields = tuple(fields)
+        self._texts: Dict[Hashable, Dict[str, str]] = {}
+        self._order: Dict[Hashable, int] = {}
+        self._next_order = 0
+        self._tokens: Dict[str, Dict[str, Set[Hashable]]] = {field: {} for field in self.fields}
+        self._trigrams: Dict[str, Dict[str, Set[Hashable]]] = {field: {} for field in self.fields}
+        self._fuzzy: Dict[str, FuzzyIndex] = {field: FuzzyIndex() for field in self.fields
+                                              if field in FUZZY_FIELDS}
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._texts
+
+    def add(self, key: Hashable, values: Dict[str, Any]) -> None:
+        """Index (or re-index) the document stored under key."""
+        order = self._order.get(key)
+        if key in self._texts:
+            self.remove(key)
+        if order is None:
+            order = self._next_order
+            self._next_order += 1
+
+        texts = {}
+        for field in self.fields:
+            value = values.get(field)
+            text = str(value).lower() if value is not None else ""
+            texts[field] = text
+            fuzzy = self._fuzzy.get(field)
+            for token in set(tokenize(text)):
+                self._tokens[field].setdefault(token, set()).add(key)
+                if fuzzy is not None:
+                    fuzzy.add(token)
+            for gram in trigrams(text):
+                self._trigrams[field].setdefault(gram, set()).add(key)
+
+        self._texts[key] = texts
+        self._order[key] = order
+
+    def remove(self, key: Hashable) -> bool:
+        """Drop the document stored under key from every posting list."""
+        texts = self._texts.pop(key, None)
+        if texts is None:
+            return False
+        self._order.pop(key, None)
+
+        for field, text in texts.items():
+            fuzzy = self._fuzzy.get(field)
+            if fuzzy is not None:
+                for token in set(tokenize(text)):
+                    fuzzy.remove(token)
+            for postings, grams in ((self._tokens[field], set(tokenize(text))),
+                                    (self._trigrams[field], trigrams(text))):
+                for gram in grams:
+                    keys = postings.get(gram)
+                    if keys is None:
+                        continue
+                    keys.discard(key)
+                    if not keys:
+                        del postings[gram]
+        return True
+
+    def _candidates(self, field: str, query: str) -> Iterable[Hashable]:
+        """Return keys whose field may contain query, smallest postings first."""
+        grams = trigrams(query)
+        if not grams:
+            # Queries shorter than a trigram cannot use the postings
+            return list(self._texts)
+
+        postings = self._trigrams[field]
+        lists = []
+        for gram in grams:
+            keys = postings.get(gram)
+            if not keys:
+                return ()
+            lists.append(keys)
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for keys in lists[1:]:
+            candidates &= keys
+            if not candidates:
+                break
+        return candidates
+
+    def _token_matches(self, field: str, query_tokens: List[str]) -> Set[Hashable]:
+        """Return keys whose field contains every query token as a whole word."""
+        postings = self._tokens[field]
+        lists = sorted((postings.get(token, set()) for token in set(query_tokens)), key=len)
+        if not lists:
+            return set()
+        matches = set(lists[0])
+        for keys in lists[1:]:
+            matches &= keys
+        return matches
+
+    @staticmethod
+    def _score(field: str, text: str, query: str, whole_words: bool) -> int:
+        """Score a verified match in a single field."""
+        if text == query:
+            quality = 4
+        elif text.startswith(query):
+            quality = 3
+        elif whole_words:
+            quality = 2
+        else:
+            quality = 1
+        return FIELD_WEIGHTS.get(field, 1) * quality
+
+    def search(self, query: str, search_type: str = "all",
+               limit: Optional[int] = None) -> List[Hashable]:
+        """
+        Find documents whose fields contain query as a substring.
+
+        Args:
+            query: The search term (case-insensitive)
+            search_type: "title", "author", "genre", or "all"
+            limit: Maximum number of keys to return
+
+        Returns:
+            Matching keys, best match first and oldest first within a score
+        """
+        fields = [field for field in SEARCH_TYPES.get(search_type, ()) if field in self.fields]
+        if not fields or (limit is not None and limit <= 0):
+            return []
+
+        query = query.lower()
+        query_tokens = tokenize(query)
+        scores: Dict[Hashable, int] = {}
+
+        # Reads only copy postings in single set operations, so searches are
+        # safe while another thread adds or removes documents
+        scanned = 0
+        for field in fields:
+            token_matches = self._token_matches(field, query_tokens)
+            for key in self._candidates(field, query):
+                scanned += 1
+                texts = self._texts.get(key)
+                if texts is None:
+                    continue
+                text = texts[field]
+                if query in text:
+                    score = self._score(field, text, query, key in token_matches)
+                    scores[key] = scores.get(key, 0) + score
+
+        count_scanned(scanned)
+
+        order = self._order
+        ranked: List[Tuple[int, int, Hashable]] = [
+            (-score, order.get(key, -1), key) for key, score in scores.items()
+        ]
+        # (score, order) pairs are unique, so keys themselves are never compared
+        if limit is not None:
+            ranked = heapq.nsmallest(limit, ranked)
+        else:
+            ranked.sort()
+        return [key for _, _, key in ranked]
+
+    def suggest(self, query: str, search_type: str = "all") -> Optional[str]:
+        """
+        Suggest a correction of query ("did you mean"), for searches that found nothing.
+
+        Returns:
+            query with its misspelled words replaced by the closest indexed
+            words of the searched fields, or None if there is nothing to correct
+        """
+        fields = [field for field in SEARCH_TYPES.get(search_type, ()) if field in self._fuzzy]
+        return suggest(query, (self._fuzzy[field] for field in fields))
+
+    def search_or_suggest(self, query: str, search_type: str = "all",
+                          limit: Optional[int] = None) -> Tuple[List[Hashable], Optional[str]]:
+        """
+        Search for query, falling back to its suggested correction.
+
+        Returns:
+            The matching keys and the correction they were found with (None
+            when query itself matched, or nothing did)
+        """
+        keys = self.search(query, search_type, limit)
+        if keys:
+            return keys, None
+        suggestion = self.suggest(query, search_type)
+        if suggestion is None:
+            return keys, None
+        return self.search(suggestion, search_type, limit), suggestion
@@ -0,0 +1,897 @@
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+import weakref
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import change_notifier
+import circulation
+from book_data import check_book_data, lending_changes
+from facet_index import MAX_FACET_VALUES
+from instrumentation import count_scanned, timed_methods
+from loan_ledger import DEFAULT_LOAN_DAYS
+from fuzzy_index import FuzzyIndex, suggest
+from recommender import Recommender
+from search_index import FIELD_WEIGHTS, FUZZY_FIELDS, SEARCH_TYPES, tokenize
+from timestamps import format_day, format_timestamp, to_day, to_timestamp
+
+# Columns of the books table that clients may set, in table order
+BOOK_FIELDS = ("title", "author", "genre", "publication_year", "isbn", "date_added",
+               "is_borrowed", "borrowed_date", "return_date", "borrower", "description")
+
+# Date columns, with how a value given for one is parsed and then stored
+# (in the format the in-memory Book renders it)
+DATE_COLUMNS = (("date_added", to_timestamp, format_timestamp),
+                ("borrowed_date", to_day, format_day), ("return_date", to_day, format_day))
+
+# Fields of a book in listings unless others are asked for. The description
+# is the last column, so rows read without it skip its overflow pages.
+LIST_FIELDS = ("id",) + tuple(field for field in BOOK_FIELDS if field != "description")
+
+# FTS5 only finds substrings of at least one trigram
+MIN_FTS_QUERY_LENGTH = 3
+
+# Results kept in a worker's read cache; it is emptied when full
+MAX_CACHED_READS = 1024
+
+# Rows kept in book_changes; a recommender further behind re-reads every book
+MAX_BOOK_CHANGES = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT,
+    author TEXT,
+    genre TEXT,
+    publication_year INTEGER,
+    isbn TEXT,
+    date_added TEXT,
+    is_borrowed INTEGER NOT NULL DEFAULT 0,
+    borrowed_date TEXT,
+    return_date TEXT,
+    borrower TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_books_isbn ON books(isbn);
+CREATE INDEX IF NOT EXISTS idx_books_is_borrowed ON books(is_borrowed);
+CREATE INDEX IF NOT EXISTS idx_books_genre ON books(genre);
+CREATE INDEX IF NOT EXISTS idx_books_author ON books(author);
+CREATE INDEX IF NOT EXISTS idx_books_date_added ON books(date_added, id);
+
+-- Running totals kept by triggers so get_stats never scans books
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO counters VALUES ('total_books', 0), ('borrowed_books', 0), ('version', 0);
+-- Bumped whenever the words a "did you mean" suggestion draws on change
+INSERT OR IGNORE INTO counters VALUES ('text_version', 0);
+-- Settings shared by every process using the database
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+INSERT OR IGNORE INTO meta VALUES ('overdue_checked', '');
+CREATE TABLE IF NOT EXISTS genre_counts (genre TEXT PRIMARY KEY, count INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS author_counts (author TEXT PRIMARY KEY, count INTEGER NOT NULL);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, author, genre, isbn,
+    content='books', content_rowid='id', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS books_ai AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts(rowid, title, author, genre, isbn)
+        VALUES (new.id, new.title, new.author, new.genre, new.isbn);
+    UPDATE counters SET value = value + 1 WHERE name IN ('total_books', 'version', 'text_version');
+    UPDATE counters SET value = value + new.is_borrowed WHERE name = 'borrowed_books';
+    INSERT INTO genre_counts SELECT new.genre, 1 WHERE coalesce(new.genre, '') <> ''
+        ON CONFLICT(genre) DO UPDATE SET count = count + 1;
+    INSERT INTO author_counts SELECT new.author, 1 WHERE coalesce(new.author, '') <> ''
+        ON CONFLICT(author) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_ad AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, author, genre, isbn)
+        VALUES ('delete', old.id, old.title, old.author, old.genre, old.isbn);
+    UPDATE counters SET value = value - 1 WHERE name = 'total_books';
+    UPDATE counters SET value = value + 1 WHERE name IN ('version', 'text_version');
+    UPDATE counters SET value = value - old.is_borrowed WHERE name = 'borrowed_books';
+    UPDATE genre_counts SET count = count - 1 WHERE genre = old.genre;
+    DELETE FROM genre_counts WHERE genre = old.genre AND count <= 0;
+    UPDATE author_counts SET count = count - 1 WHERE author = old.author;
+    DELETE FROM author_counts WHERE author = old.author AND count <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_au_version AFTER UPDATE ON books BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_au_fts AFTER UPDATE OF title, author, genre, isbn ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, author, genre, isbn)
+        VALUES ('delete', old.id, old.title, old.author, old.genre, old.isbn);
+    INSERT INTO books_fts(rowid, title, author, genre, isbn)
+        VALUES (new.id, new.title, new.author, new.genre, new.isbn);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_au_text AFTER UPDATE OF title, author, genre ON books
+        WHEN old.title IS NOT new.title OR old.author IS NOT new.author
+             OR old.genre IS NOT new.genre BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'text_version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_au_borrowed AFTER UPDATE OF is_borrowed ON books BEGIN
+    UPDATE counters SET value = value + new.is_borrowed - old.is_borrowed
+        WHERE name = 'borrowed_books';
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_au_genre AFTER UPDATE OF genre ON books
+        WHEN old.genre IS NOT new.genre BEGIN
+    UPDATE genre_counts SET count = count - 1 WHERE genre = old.genre;
+    DELETE FROM genre_counts WHERE genre = old.genre AND count <= 0;
+    INSERT INTO genre_counts SELECT new.genre, 1 WHERE coalesce(new.genre, '') <> ''
+        ON CONFLICT(genre) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_au_author AFTER UPDATE OF author ON books
+        WHEN old.author IS NOT new.author BEGIN
+    UPDATE author_counts SET count = count - 1 WHERE author = old.author;
+    DELETE FROM author_counts WHERE author = old.author AND count <= 0;
+    INSERT INTO author_counts SELECT new.author, 1 WHERE coalesce(new.author, '') <> ''
+        ON CONFLICT(author) DO UPDATE SET count = count + 1;
+END;
+"""
+
+# Loan history, appended to by triggers whenever is_borrowed changes. The
+# partial index holds only open loans, by due date, so finding the overdue
+# ones reads just those index entries.
+LOANS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS loans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id INTEGER NOT NULL,
+    borrower TEXT,
+    borrowed_date TEXT NOT NULL,
+    due_date TEXT NOT NULL,
+    returned_date TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_loans_borrower ON loans(borrower, id);
+CREATE INDEX IF NOT EXISTS idx_loans_book ON loans(book_id, id);
+CREATE INDEX IF NOT EXISTS idx_loans_open_due ON loans(due_date, id) WHERE returned_date IS NULL;
+
+CREATE TRIGGER IF NOT EXISTS books_ai_loan AFTER INSERT ON books WHEN new.is_borrowed BEGIN
+    INSERT INTO loans (book_id, borrower, borrowed_date, due_date)
+        SELECT new.id, new.borrower, day, date(day, '+{DEFAULT_LOAN_DAYS} days')
+        FROM (SELECT coalesce(new.borrowed_date, date('now', 'localtime')) AS day);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_au_loan_open AFTER UPDATE OF is_borrowed ON books
+        WHEN new.is_borrowed AND NOT old.is_borrowed BEGIN
+    INSERT INTO loans (book_id, borrower, borrowed_date, due_date)
+        SELECT new.id, new.borrower, day, date(day, '+{DEFAULT_LOAN_DAYS} days')
+        FROM (SELECT coalesce(new.borrowed_date, date('now', 'localtime')) AS day);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_au_loan_close AFTER UPDATE OF is_borrowed ON books
+        WHEN old.is_borrowed AND NOT new.is_borrowed BEGIN
+    UPDATE loans SET returned_date = coalesce(new.return_date, date('now', 'localtime'))
+        WHERE book_id = new.id AND returned_date IS NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_ad_loan AFTER DELETE ON books WHEN old.is_borrowed BEGIN
+    UPDATE loans SET returned_date = date('now', 'localtime')
+        WHERE book_id = old.id AND returned_date IS NULL;
+END;
+"""
+
+# Books whose recommender fields were added, changed or deleted, in order.
+# Each process's recommender reads the rows past the last one it saw. Every
+# 1000th row prunes the log down to MAX_BOOK_CHANGES rows.
+CHANGES_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS book_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS books_ai_changes AFTER INSERT ON books BEGIN
+    INSERT INTO book_changes (book_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_ad_changes AFTER DELETE ON books BEGIN
+    INSERT INTO book_changes (book_id) VALUES (old.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_au_changes AFTER UPDATE OF title, author, genre, description ON books
+        WHEN old.title IS NOT new.title OR old.author IS NOT new.author
+             OR old.genre IS NOT new.genre OR old.description IS NOT new.description BEGIN
+    INSERT INTO book_changes (book_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_changes_prune AFTER INSERT ON book_changes
+        WHEN new.seq % 1000 = 0 BEGIN
+    DELETE FROM book_changes WHERE seq <= new.seq - {MAX_BOOK_CHANGES};
+END;
+"""
+
+
+class _ThreadConnection:
+    # Holds a thread's connection in the pool's thread-local; when the thread
+    # ends, this is dropped and the pool's finalizer closes the connection
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+
+class ConnectionPool:
+    """
+    One SQLite connection per thread, created on first use and closed when
+    the thread ends.
+
+    SQLite connections must not be shared between threads, so a threaded
+    WSGI server gets one connection per worker thread. Servers that start a
+    thread per request (like Werkzeug's) would otherwise leave a connection,
+    and its file descriptors, behind for every request. ":memory:" is mapped
+    to a shared-cache in-memory database so every thread sees the same data.
+    """
+
+    def __init__(self, path: str):
+        """Prepare a pool for the database at path."""
+        self._uri = path == ":memory:"
+        self.path = f"file:library-{uuid.uuid4().hex}?mode=memory&cache=shared" if self._uri else path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Set[sqlite3.Connection] = set()
+        # Keeps a shared in-memory database alive while threads come and go
+        # (owned by the pool, not by the thread that happened to create it)
+        self._anchor = self._connect() if self._uri else None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections may be closed by another thread's finalizer, but are
+        # only ever used by the thread they belong to
+        conn = sqlite3.connect(self.path, uri=self._uri, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        if not self._uri:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Return this thread's connection."""
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = _ThreadConnection(self._connect())
+            self._local.holder = holder
+            weakref.finalize(holder, self._release, holder.conn)
+            with self._lock:
+                self._connections.add(holder.conn)
+        return holder.conn
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._connections.discard(conn)
+        conn.close()
+
+    def close_all(self) -> None:
+        """Close every connection handed out by the pool."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+            if self._anchor is not None:
+                self._anchor.close()
+                self._anchor = None
+        self._local = threading.local()
+
+
+@timed_methods("library")
+class SqliteLibrary:
+    """
+    Library backed by SQLite, with the same interface as index.Library.
+
+    Books are returned as instances of book_class (built with from_dict),
+    so the API layer can keep calling to_dict on them.
+
+    Several processes (e.g. gunicorn workers) can serve the same database
+    file. Each keeps a cache of read results, valid for one version of the
+    database; writers publish the new version through a ChangeNotifier
+    after every commit, so other processes drop their caches on their next
+    read without querying the database to find out. The ETag's instance id
+    is stored in the database, so every worker gives the same ETags.
+    """
+
+    def __init__(self, path: str, book_class: Callable[..., Any]):
+        """Open (creating if needed) the database at path."""
+        self.book_class = book_class
+        self.pool = ConnectionPool(path)
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA + LOANS_SCHEMA + CHANGES_SCHEMA)
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('instance_id', ?)", (uuid.uuid4().hex[:12],))
+        self.instance_id = self.conn.execute("SELECT value FROM meta WHERE name = 'instance_id'").fetchone()[0]
+        self.notifier = change_notifier.for_database(path, lambda: self._counter("version"))
+        self._cache: Dict[Hashable, Any] = {}
+        self._cache_version: Optional[int] = None
+        self._cache_lock = threading.Lock()
+        # Words of the FUZZY_FIELDS for suggestions, built on first use and
+        # then, once the text_version counter shows they changed, fed the
+        # books changed since (with the values each book was indexed under,
+        # so its old words can be removed) and the last book_changes row seen
+        self._fuzzy: Dict[str, FuzzyIndex] = {}
+        self._fuzzy_values: Dict[str, Tuple[Optional[str], ...]] = {}
+        self._fuzzy_version: Optional[int] = None
+        self._fuzzy_changes: Optional[int] = None
+        self._fuzzy_lock = threading.Lock()
+        # Neighbours for get_similar_json, with the last book_changes row and
+        # loan it has seen (None until it is built)
+        self.recommender = Recommender()
+        self._recommended_changes: Optional[int] = None
+        self._recommended_loans = 0
+        self._recommend_lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return self.pool.connection()
+
+    def _counter(self, name: str) -> int:
+        return self.conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._counter("total_books")
+
+    @property
+    def version(self) -> int:
+        if self.notifier is not None:
+            return self.notifier.version
+        return self._counter("version")
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # Commits, then tells every process the database has changed
+        with self.conn as conn:
+            yield conn
+        if self.notifier is not None:
+            self.notifier.publish(self._counter("version"))
+
+    def _cached(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        # Reads of an unchanged database are answered from this worker's cache
+        version = self.version
+        with self._cache_lock:
+            if self._cache_version != version:
+                self._cache.clear()
+                self._cache_version = version
+            elif key in self._cache:
+                return self._cache[key]
+        value = compute()
+        with self._cache_lock:
+            if self._cache_version == version:
+                if len(self._cache) >= MAX_CACHED_READS:
+                    self._cache.clear()
+                self._cache[key] = value
+        return value
+
+    @contextlib.contextmanager
+    def startup_lock(self) -> Iterator[None]:
+        """Hold a lock shared by every process using the database, e.g. to seed it once."""
+        if self.notifier is None:
+            yield
+            return
+        with self.notifier.lock():
+            yield
+
+    @property
+    def etag(self) -> str:
+        return f"{self.instance_id}-{self.version}"
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        data = dict(row)
+        data["id"] = str(data["id"])
+        if "is_borrowed" in data:
+            data["is_borrowed"] = bool(data["is_borrowed"])
+        return data
+
+    @staticmethod
+    def _columns(fields: Sequence[str]) -> str:
+        # Columns to read for fields; the id is always read, as pages and
+        # multi-gets are keyed by it
+        for field in fields:
+            if field != "id" and field not in BOOK_FIELDS:
+                raise ValueError(f"Unknown field: {field}")
+        columns = ["id", *(field for field in fields if field != "id")]
+        return ", ".join(f"books.{column}" for column in columns)
+
+    def _project(self, row: sqlite3.Row, fields: Sequence[str]) -> Dict[str, Any]:
+        data = self._row_to_dict(row)
+        return {field: data[field] for field in fields}
+
+    def _json_list(self, rows: List[sqlite3.Row], fields: Sequence[str] = LIST_FIELDS) -> bytes:
+        count_scanned(len(rows))
+        return json.dumps([self._project(row, fields) for row in rows], separators=(",", ":")).encode()
+
+    def _to_book(self, row: Optional[sqlite3.Row]) -> Optional[Any]:
+        return self.book_class.from_dict(self._row_to_dict(row)) if row else None
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, book: Any) -> None:
+        values = [getattr(book, field) for field in BOOK_FIELDS]
+        values[BOOK_FIELDS.index("is_borrowed")] = int(bool(book.is_borrowed))
+        cursor = conn.execute(
+            f"INSERT INTO books ({', '.join(BOOK_FIELDS)}) "
+            f"VALUES ({', '.join('?' for _ in BOOK_FIELDS)})", values)
+        book.id = str(cursor.lastrowid)
+
+    def add_book(self, book: Any) -> Any:
+        with self._transaction() as conn:
+            self._insert(conn, book)
+        return book
+
+    def add_books(self, books: List[Any]) -> List[Any]:
+        # One transaction for the whole batch
+        with self._transaction() as conn:
+            for book in books:
+                self._insert(conn, book)
+        return books
+
+    def iter_books(self) -> Iterator[Any]:
+        for row in self.conn.execute("SELECT * FROM books ORDER BY id"):
+            yield self._to_book(row)
+
+    def get_book(self, book_id: str) -> Optional[Any]:
+        data = self._cached(("book", book_id), lambda: self._book_dict(book_id))
+        return self.book_class.from_dict(data) if data else None
+
+    def _book_dict(self, book_id: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def get_books_json(self, book_ids: List[str], fields: Optional[Sequence[str]] = None) -> bytes:
+        fields = LIST_FIELDS if fields is None else tuple(fields)
+        return self._cached(("books", tuple(book_ids), fields), lambda: self._books_json(book_ids, fields))
+
+    def _books_json(self, book_ids: List[str], fields: Sequence[str]) -> bytes:
+        ids = [int(book_id) for book_id in book_ids if book_id.isdigit()]
+        rows = self.conn.execute(f"SELECT {self._columns(fields)} FROM books "
+                                 "WHERE id IN (SELECT value FROM json_each(?))",
+                                 (json.dumps(ids),)).fetchall()
+        by_id = {row["id"]: row for row in rows}
+        return self._json_list([by_id[book_id] for book_id in ids if book_id in by_id], fields)
+
+    def get_books_by_isbn(self, isbn: str) -> List[Any]:
+        rows = self.conn.execute("SELECT * FROM books WHERE isbn = ?", (isbn,)).fetchall()
+        return [self._to_book(row) for row in rows]
+
+    def update_book(self, book_id: str, data: Dict[str, Any]) -> Optional[Any]:
+        check_book_data(data)
+        with self._transaction() as conn:
+            self._update(conn, book_id, data)
+        return self.get_book(book_id)
+
+    @staticmethod
+    def _update(conn: sqlite3.Connection, book_id: str, data: Dict[str, Any]) -> None:
+        changes = {key: value for key, value in data.items() if key in BOOK_FIELDS}
+        if changes.get("is_borrowed"):
+            row = conn.execute("SELECT is_borrowed FROM books WHERE id = ?", (book_id,)).fetchone()
+            if row is not None:
+                changes = lending_changes(changes, bool(row[0]))
+        if "is_borrowed" in changes:
+            changes["is_borrowed"] = int(bool(changes["is_borrowed"]))
+        for field, parse, render in DATE_COLUMNS:
+            if field in changes:
+                changes[field] = render(parse(changes[field]))
+        if changes:
+            assignments = ", ".join(f"{key} = ?" for key in changes)
+            conn.execute(f"UPDATE books SET {assignments} WHERE id = ?", [*changes.values(), book_id])
+
+    def delete_book(self, book_id: str) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM books WHERE id = ?", (book_id,))
+        return cursor.rowcount > 0
+
+    def borrow_book(self, book_id: str, borrower: str, due_date: Optional[str] = None) -> Optional[Any]:
+        # A single conditional UPDATE, so two threads cannot borrow the same copy
+        borrowed_date = datetime.now().strftime("%Y-%m-%d")
+        due_date = format_day(to_day(due_date))
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE books SET is_borrowed = 1, borrowed_date = ?, borrower = ? "
+                "WHERE id = ? AND is_borrowed = 0", (borrowed_date, borrower, book_id))
+            if cursor.rowcount and due_date:
+                # The trigger opened the loan with the default due date
+                conn.execute("UPDATE loans SET due_date = ? WHERE book_id = ? AND returned_date IS NULL",
+                             (due_date, book_id))
+        return self.get_book(book_id) if cursor.rowcount else None
+
+    def return_book(self, book_id: str) -> Optional[Any]:
+        return_date = datetime.now().strftime("%Y-%m-%d")
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE books SET is_borrowed = 0, return_date = ?, borrower = NULL "
+                "WHERE id = ? AND is_borrowed = 1", (return_date, book_id))
+        return self.get_book(book_id) if cursor.rowcount else None
+
+    def apply_batch(self, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Apply borrow, return and update operations all together or not at all.
+
+        The whole batch is one write transaction (and one commit and
+        notification), taken before the operations are checked so no other
+        writer can change their books in between.
+
+        Returns:
+            Each operation's book, as it was right after that operation
+
+        Raises:
+            BatchRejected: If any operation is malformed or would fail; then
+                nothing has been changed
+        """
+        operations = circulation.parse_operations(operations)
+        day = datetime.now().strftime("%Y-%m-%d")
+        results = []
+        with self._transaction() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+
+            def is_borrowed(book_id: str) -> Optional[bool]:
+                row = conn.execute("SELECT is_borrowed FROM books WHERE id = ?", (book_id,)).fetchone()
+                return None if row is None else bool(row[0])
+
+            circulation.check_loans(operations, is_borrowed)
+            for operation in operations:
+                book_id = operation["id"]
+                if operation["op"] == "borrow":
+                    conn.execute("UPDATE books SET is_borrowed = 1, borrowed_date = ?, borrower = ? "
+                                 "WHERE id = ?", (day, operation["borrower"], book_id))
+                    if operation["due_date"] is not None:
+                        conn.execute("UPDATE loans SET due_date = ? WHERE book_id = ? AND returned_date IS NULL",
+                                     (format_day(operation["due_date"]), book_id))
+                elif operation["op"] == "return":
+                    conn.execute("UPDATE books SET is_borrowed = 0, return_date = ?, borrower = NULL "
+                                 "WHERE id = ?", (day, book_id))
+                else:
+                    self._update(conn, book_id, operation["changes"])
+                row = conn.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
+                results.append(self._row_to_dict(row))
+        return results
+
+    @staticmethod
+    def _loan_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        data = dict(row)
+        data["book_id"] = str(data["book_id"])
+        data["is_overdue"] = bool(data["is_overdue"])
+        return data
+
+    def _loans(self, where: str, params: List[Any]) -> List[Dict[str, Any]]:
+        today = date.today().isoformat()
+        rows = self.conn.execute(
+            "SELECT id, book_id, borrower, borrowed_date, due_date, returned_date, "
+            f"returned_date IS NULL AND due_date < ? AS is_overdue FROM loans WHERE {where}",
+            [today, *params]).fetchall()
+        return [self._loan_to_dict(row) for row in rows]
+
+    def get_loans(self, borrower: Optional[str] = None,
+                  book_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        if borrower is not None:
+            return self._loans("borrower = ? ORDER BY id", [borrower])
+        return self._loans("book_id = ? ORDER BY id", [book_id])
+
+    def get_overdue_loans(self) -> List[Dict[str, Any]]:
+        today = date.today().isoformat()
+        return self._loans("returned_date IS NULL AND due_date < ? ORDER BY due_date, id", [today])
+
+    def check_overdue(self) -> List[Dict[str, Any]]:
+        # Loans that fell due between the previous check and today. The last
+        # check day is kept in the database, so when several processes check,
+        # only the first one each day reports the loans.
+        today = date.today().isoformat()
+        with self.conn as conn:
+            since = conn.execute("SELECT value FROM meta WHERE name = 'overdue_checked'").fetchone()[0]
+            cursor = conn.execute("UPDATE meta SET value = ? WHERE name = 'overdue_checked' AND value = ?",
+                                  (today, since))
+        if not cursor.rowcount or since == today:
+            return []
+        if not since:
+            return self.get_overdue_loans()
+        return self._loans("returned_date IS NULL AND due_date >= ? AND due_date < ? "
+                           "ORDER BY due_date, id", [since, today])
+
+    def search_books(self, query: str, search_type: str = "all", limit: Optional[int] = None,
+                     fields: Sequence[str] = LIST_FIELDS) -> List[Dict[str, Any]]:
+        fields = tuple(fields)
+        return self._cached(("search", query, search_type, limit, fields),
+                            lambda: self._search_books(query, search_type, limit, fields))
+
+    def _search_books(self, query: str, search_type: str, limit: Optional[int],
+                      fields: Sequence[str]) -> List[Dict[str, Any]]:
+        columns = self._columns(fields)
+        searched = SEARCH_TYPES.get(search_type)
+        if not searched or (limit is not None and limit <= 0):
+            return []
+        limit_sql = -1 if limit is None else limit
+
+        if len(query) < MIN_FTS_QUERY_LENGTH:
+            condition = " OR ".join(f"instr(lower(coalesce({field}, '')), ?) > 0" for field in searched)
+            rows = self.conn.execute(
+                f"SELECT {columns} FROM books WHERE {condition} ORDER BY id LIMIT ?",
+                [query.lower()] * len(searched) + [limit_sql]).fetchall()
+        else:
+            phrase = '"' + query.replace('"', '""') + '"'
+            match = f"{{{' '.join(searched)}}} : {phrase}"
+            weights = ", ".join(str(float(FIELD_WEIGHTS[field])) for field in ("title", "author", "genre", "isbn"))
+            rows = self.conn.execute(
+                f"SELECT {columns} FROM books_fts JOIN books ON books.id = books_fts.rowid "
+                f"WHERE books_fts MATCH ? ORDER BY bm25(books_fts, {weights}), books.id LIMIT ?",
+                (match, limit_sql)).fetchall()
+        return [self._project(row, fields) for row in rows]
+
+    def _fuzzy_indexes(self) -> Dict[str, FuzzyIndex]:
+        with self._fuzzy_lock:
+            # Read before the changes, so a change made meanwhile is seen again
+            version = self._counter("text_version")
+            if self._fuzzy_version == version:
+                return self._fuzzy
+            last, rows, deleted = self._changed_books(self._fuzzy_changes, FUZZY_FIELDS)
+            if deleted is None:
+                self._fuzzy = {field: FuzzyIndex() for field in FUZZY_FIELDS}
+                self._fuzzy_values = {}
+            for book_id in deleted or ():
+                self._index_words(book_id, None)
+            for row in rows:
+                self._index_words(str(row[0]), tuple(row[1:]))
+            self._fuzzy_version, self._fuzzy_changes = version, last
+            return self._fuzzy
+
+    def _index_words(self, book_id: str, values: Optional[Tuple[Optional[str], ...]]) -> None:
+        # Replaces the words of book_id (values of the FUZZY_FIELDS, or None
+        # for a deleted book) in the fuzzy indexes
+        for words, sign in ((self._fuzzy_values.pop(book_id, None), -1), (values, 1)):
+            if words is None:
+                continue
+            for field, value in zip(FUZZY_FIELDS, words):
+                if value is None:
+                    continue
+                index = self._fuzzy[field]
+                for token in set(tokenize(str(value).lower())):
+                    if sign > 0:
+                        index.add(token)
+                    else:
+                        index.remove(token)
+        if values is not None:
+            # Authors and genres repeat across books; keep one copy of each
+            self._fuzzy_values[book_id] = tuple(sys.intern(value) if isinstance(value, str) and field != "title"
+                                                else value for field, value in zip(FUZZY_FIELDS, values))
+
+    def suggest(self, query: str, search_type: str = "all") -> Optional[str]:
+        fields = [field for field in SEARCH_TYPES.get(search_type, ()) if field in FUZZY_FIELDS]
+        if not fields:
+            return None
+        indexes = self._fuzzy_indexes()
+        return suggest(query, (indexes[field] for field in fields))
+
+    def search_books_fuzzy(self, query: str, search_type: str = "all", limit: Optional[int] = None,
+                           fields: Sequence[str] = LIST_FIELDS) -> Dict[str, Any]:
+        books = self.search_books(query, search_type, limit, fields)
+        suggestion = None
+        if not books:
+            suggestion = self.suggest(query, search_type)
+            if suggestion is not None:
+                books = self.search_books(suggestion, search_type, limit, fields)
+        return {"books": books, "did_you_mean": suggestion}
+
+    def get_similar_json(self, book_id: str, limit: int = 5,
+                         fields: Optional[Sequence[str]] = None) -> bytes:
+        fields = LIST_FIELDS if fields is None else tuple(fields)
+        return self._cached(("similar", book_id, limit, fields),
+                            lambda: self._similar_json(book_id, limit, fields))
+
+    def _similar_json(self, book_id: str, limit: int, fields: Sequence[str]) -> bytes:
+        with self._recommend_lock:
+            self._refresh_recommender()
+            also_borrowed = self.recommender.also_borrowed(book_id, limit)
+            more_like_this = self.recommender.more_like_this(book_id, limit)
+        return (b'{"also_borrowed":' + self._books_json(also_borrowed, fields) +
+                b',"more_like_this":' + self._books_json(more_like_this, fields) + b'}')
+
+    def _changed_books(self, position: Optional[int],
+                       columns: Sequence[str]) -> Tuple[int, List[sqlite3.Row], Optional[List[str]]]:
+        """
+        Books changed (by any process) past book_changes row position.
+
+        Returns:
+            The last row read; the id and columns of each changed book still
+            there; and the ids of those deleted. If position is None (first
+            use) or the changes since were pruned, every book is returned
+            and the deleted ids are None: the caller starts over.
+        """
+        conn = self.conn
+        first, last = conn.execute("SELECT min(seq), max(seq) FROM book_changes").fetchone()
+        last = last or 0
+        select = f"SELECT id, {', '.join(columns)} FROM books"
+        if position is None or (first is not None and first > position + 1):
+            return last, conn.execute(select).fetchall(), None
+        if last <= position:
+            return position, [], []
+        # Rows are read past the last seen, so a book changed meanwhile is
+        # just read again next time
+        changed = conn.execute("SELECT DISTINCT book_id FROM book_changes WHERE seq > ? AND seq <= ?",
+                               (position, last)).fetchall()
+        rows = conn.execute(f"{select} WHERE id IN (SELECT value FROM json_each(?))",
+                            (json.dumps([row[0] for row in changed]),)).fetchall()
+        found = {str(row[0]) for row in rows}
+        return last, rows, [str(row[0]) for row in changed if str(row[0]) not in found]
+
+    def _refresh_recommender(self) -> None:
+        # Feeds this process's recommender the books changed (by any process)
+        # and the loans made since it last ran
+        last, rows, deleted = self._changed_books(self._recommended_changes,
+                                                  ("title", "author", "genre", "description"))
+        if deleted is None:
+            self.recommender = Recommender()
+            self._recommended_loans = 0
+        else:
+            self.recommender.remove_books(deleted)
+        self.recommender.update_books((str(row[0]), *row[1:]) for row in rows)
+        self._recommended_changes = last
+
+        conn = self.conn
+
+        loans = conn.execute("SELECT id, book_id, borrower FROM loans WHERE id > ? ORDER BY id",
+                             (self._recommended_loans,)).fetchall()
+        self.recommender.add_loans((str(row[1]), row[2]) for row in loans)
+        if loans:
+            self._recommended_loans = loans[-1][0]
+
+    def get_all_books(self) -> List[Dict[str, Any]]:
+        rows = self.conn.execute("SELECT * FROM books ORDER BY id").fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def _borrowed_rows(self, columns: str = "*") -> List[sqlite3.Row]:
+        return self.conn.execute(f"SELECT {columns} FROM books WHERE is_borrowed = 1 ORDER BY id").fetchall()
+
+    def get_borrowed_books(self) -> List[Dict[str, Any]]:
+        return [self._row_to_dict(row) for row in self._borrowed_rows()]
+
+    def get_borrowed_books_json(self, fields: Optional[Sequence[str]] = None) -> bytes:
+        fields = LIST_FIELDS if fields is None else tuple(fields)
+        return self._cached(("borrowed", fields),
+                            lambda: self._json_list(self._borrowed_rows(self._columns(fields)), fields))
+
+    @staticmethod
+    def _page(rows: List[sqlite3.Row], limit: int) -> Tuple[List[sqlite3.Row], Optional[str]]:
+        page = rows[:limit]
+        return page, (str(page[-1]["id"]) if len(rows) > limit and page else None)
+
+    def _books_page_rows(self, after: Optional[str], limit: int,
+                         columns: str = "*") -> Tuple[List[sqlite3.Row], Optional[str]]:
+        if after is not None and not after.isdigit():
+            raise ValueError(f"Invalid cursor: {after}")
+        if limit <= 0:
+            return [], None
+        rows = self.conn.execute(
+            f"SELECT {columns} FROM books WHERE id > ? ORDER BY id LIMIT ?",
+            (int(after or 0), limit + 1)).fetchall()
+        return self._page(rows, limit)
+
+    def _recent_page_rows(self, after: Optional[str], limit: int,
+                          columns: str = "*") -> Tuple[List[sqlite3.Row], Optional[str]]:
+        if limit <= 0:
+            return [], None
+        if after is None:
+            rows = self.conn.execute(
+                f"SELECT {columns} FROM books ORDER BY date_added DESC, id DESC LIMIT ?",
+                (limit + 1,)).fetchall()
+        else:
+            cursor = self.conn.execute(
+                "SELECT coalesce(date_added, ''), id FROM books WHERE id = ?", (after,)).fetchone()
+            if cursor is None:
+                raise ValueError(f"Invalid cursor: {after}")
+            rows = self.conn.execute(
+                f"SELECT {columns} FROM books WHERE (coalesce(date_added, ''), id) < (?, ?) "
+                "ORDER BY date_added DESC, id DESC LIMIT ?",
+                (cursor[0], cursor[1], limit + 1)).fetchall()
+        return self._page(rows, limit)
+
+    def get_books_page(self, after: Optional[str] = None,
+                       limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        rows, next_cursor = self._books_page_rows(after, limit)
+        return [self._row_to_dict(row) for row in rows], next_cursor
+
+    def get_books_page_json(self, after: Optional[str] = None, limit: int = 100,
+                            fields: Optional[Sequence[str]] = None) -> Tuple[bytes, Optional[str]]:
+        fields = LIST_FIELDS if fields is None else tuple(fields)
+
+        def compute() -> Tuple[bytes, Optional[str]]:
+            rows, next_cursor = self._books_page_rows(after, limit, self._columns(fields))
+            return self._json_list(rows, fields), next_cursor
+        return self._cached(("page", after, limit, fields), compute)
+
+    def get_filtered_books_json(self, filters: Dict[str, Any], after: Optional[str] = None, limit: int = 100,
+                                fields: Optional[Sequence[str]] = None) -> Tuple[bytes, Optional[str]]:
+        fields = LIST_FIELDS if fields is None else tuple(fields)
+        return self._cached(("filtered", tuple(sorted(filters.items())), after, limit, fields),
+                            lambda: self._filtered_books_json(filters, after, limit, fields))
+
+    def _filtered_books_json(self, filters: Dict[str, Any], after: Optional[str], limit: int,
+                             fields: Sequence[str]) -> Tuple[bytes, Optional[str]]:
+        clauses, params = [], []
+        for column in ("genre", "author"):
+            if filters.get(column) is not None:
+                clauses.append(f"{column} = ?")
+                params.append(filters[column])
+        if filters.get("year_from") is not None:
+            clauses.append("publication_year >= ?")
+            params.append(filters["year_from"])
+        if filters.get("year_to") is not None:
+            clauses.append("publication_year <= ?")
+            params.append(filters["year_to"])
+        if filters.get("available") is not None:
+            clauses.append("is_borrowed = ?")
+            params.append(0 if filters["available"] else 1)
+        where = " AND ".join(clauses) or "1"
+
+        conn = self.conn
+        total = conn.execute(f"SELECT COUNT(*) FROM books WHERE {where}", params).fetchone()[0]
+        facets = {}
+        for column in ("genre", "author", "publication_year"):
+            rows = conn.execute(
+                f"SELECT {column}, COUNT(*) FROM books WHERE {where} AND {column} IS NOT NULL "
+                f"AND {column} <> '' GROUP BY {column} ORDER BY COUNT(*) DESC LIMIT ?",
+                [*params, MAX_FACET_VALUES]).fetchall()
+            facets[column] = {row[0]: row[1] for row in rows}
+        rows = conn.execute(f"SELECT is_borrowed = 0, COUNT(*) FROM books WHERE {where} "
+                            "GROUP BY is_borrowed ORDER BY COUNT(*) DESC", params).fetchall()
+        facets["available"] = {bool(row[0]): row[1] for row in rows}
+
+        if after is not None:
+            if not after.isdigit():
+                raise ValueError(f"Invalid cursor: {after}")
+            where += " AND id > ?"
+            params.append(int(after))
+        rows = conn.execute(f"SELECT {self._columns(fields)} FROM books WHERE {where} ORDER BY id LIMIT ?",
+                            [*params, limit + 1]).fetchall()
+        page, next_cursor = self._page(rows, limit)
+        body = (b'{"total":%d,"books":' % total + self._json_list(page, fields) + b',"facets":' +
+                json.dumps(facets, separators=(",", ":")).encode() + b'}')
+        return body, next_cursor
+
+    def get_recent_books_page(self, after: Optional[str] = None,
+                              limit: int = 5) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        rows, next_cursor = self._recent_page_rows(after, limit)
+        return [self._row_to_dict(row) for row in rows], next_cursor
+
+    def get_recent_books_page_json(self, after: Optional[str] = None, limit: int = 5,
+                                   fields: Optional[Sequence[str]] = None) -> Tuple[bytes, Optional[str]]:
+        fields = LIST_FIELDS if fields is None else tuple(fields)
+
+        def compute() -> Tuple[bytes, Optional[str]]:
+            rows, next_cursor = self._recent_page_rows(after, limit, self._columns(fields))
+            return self._json_list(rows, fields), next_cursor
+        return self._cached(("recent", after, limit, fields), compute)
+
+    def get_recently_added_books(self, limit: int = 5) -> List[Dict[str, Any]]:
+        return self.get_recent_books_page(limit=limit)[0]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self._cached(("stats",), self._stats))
+
+    def _stats(self) -> Dict[str, Any]:
+        conn = self.conn
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        total_books = counters["total_books"]
+        borrowed_books = counters["borrowed_books"]
+        return {
+            "total_books": total_books,
+            "borrowed_books": borrowed_books,
+            "available_books": total_books - borrowed_books,
+            "unique_genres": conn.execute("SELECT count(*) FROM genre_counts").fetchone()[0],
+            "unique_authors": conn.execute("SELECT count(*) FROM author_counts").fetchone()[0],
+        }
+
+    def close(self) -> None:
+        self.pool.close_all()
+        if self.notifier is not None:
+            self.notifier.close()
+
+
+def from_env(book_class: Callable[..., Any],
+             environ: Dict[str, str] = os.environ) -> Optional[SqliteLibrary]:
+    """Build a SqliteLibrary if LIBRARY_BACKEND=sqlite, else None."""
+    if environ.get("LIBRARY_BACKEND", "memory") != "sqlite":
+        return None
+    return SqliteLibrary(environ.get("LIBRARY_DB_PATH", "library.db"), book_class)
@@ -0,0 +1,311 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+SNAPSHOT_FILE = "snapshot.jsonl"
+IMAGE_FILE = "snapshot.img"
+JOURNAL_FILE = "journal.jsonl"
+
+logger = logging.getLogger(__name__)
+
+
+def fsync_directory(path: str) -> None:
+    """Make a rename inside path durable (no-op where unsupported)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_json_atomic(filename: str, data: Any, indent: Optional[int] = None) -> None:
+    """Write data as JSON so that readers see either the old or the new file."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    tmp_name = f"{filename}.tmp"
+    with open(tmp_name, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, filename)
+    fsync_directory(directory)
+
+
+class Journal:
+    """
+    Append-only write-ahead log of library operations, one JSON record per line.
+
+    Records are handed to the OS on every append but only fsynced in batches:
+    after fsync_every records, or once fsync_interval seconds have passed
+    since the last fsync, whichever comes first. A timer thread syncs records
+    still pending when the interval runs out, so the bound holds even if no
+    more records arrive. An fsync_every and fsync_interval of 0 leave
+    durability to the OS (and to explicit sync() calls).
+    """
+
+    def __init__(self, filename: str, fsync_every: int = 1, fsync_interval: float = 0.0):
+        """Open (creating if needed) the journal file for appending."""
+        self.filename = filename
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._file = open(filename, "a", encoding="utf-8")
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        # Guards the file against the timer's syncs
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Write a record, fsyncing if the current batch is full."""
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._pending += 1
+
+            if self.fsync_every and self._pending >= self.fsync_every:
+                self._sync()
+            elif self.fsync_interval:
+                remaining = self._last_sync + self.fsync_interval - time.monotonic()
+                if remaining <= 0:
+                    self._sync()
+                elif self._timer is None:
+                    self._timer = threading.Timer(remaining, self._sync_pending)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def _sync_pending(self) -> None:
+        # Timer callback: the interval has run out since the first pending record
+        with self._lock:
+            self._timer = None
+            if not self._file.closed:
+                self._sync()
+
+    def sync(self) -> None:
+        """Force every appended record to stable storage."""
+        with self._lock:
+            self._sync()
+
+    def _sync(self) -> None:
+        if self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def truncate(self) -> None:
+        """Discard every record (after they have been captured in a snapshot)."""
+        with self._lock:
+            self._file.close()
+            self._file = open(self.filename, "w", encoding="utf-8")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+
+    def close(self) -> None:
+        """Sync and close the journal file."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    @staticmethod
+    def read(filename: str) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the records of a journal file in order.
+
+        A torn final line (from a crash mid-write) is cut off the file so
+        that later appends start on a clean line.
+        """
+        if not os.path.exists(filename):
+            return
+        good_offset = 0
+        with open(filename, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good_offset += len(line)
+                yield record
+        if good_offset < os.path.getsize(filename):
+            with open(filename, "r+b") as f:
+                f.truncate(good_offset)
+
+
+class LibraryStore:
+    """
+    Durable storage for a library: a compacted snapshot plus a journal.
+
+    Every mutation is appended to the journal with an increasing sequence
+    number. Once snapshot_every records have accumulated, snapshot_due
+    becomes true and the library is expected to call snapshot() at a point
+    where its books are consistent; the whole library is then written to a
+    new snapshot (atomically replacing the old one) and the journal is
+    emptied. On startup the snapshot is loaded and any journal records
+    newer than it are replayed, so a crash between writing a snapshot and
+    truncating the journal is harmless.
+
+    The library must provide restore_book(data), restore_loan(data),
+    apply_record(op, data), snapshot_state(), iter_snapshot_books() and
+    iter_snapshot_loans(). Loans follow the books in the snapshot, as
+    {"loan": data} lines.
+
+    The JSON lines snapshot does not depend on the code's internals and is
+    always written. A library that also provides save_image(path, header)
+    and load_image(path, expected) (returning the header) also gets a
+    binary image with each snapshot, unless images is False. Loading an
+    image restores the library without parsing or indexing anything. The
+    image is only a cache of the snapshot: it is used if it was written
+    with the same sequence number and can be loaded by the running code,
+    and otherwise the snapshot is read (and the journal replayed) instead.
+    """
+
+    def __init__(self, directory: str, fsync_every: int = 1,
+                 fsync_interval: float = 0.0, snapshot_every: int = 10000,
+                 images: bool = True):
+        """Configure a store kept in directory (created if missing)."""
+        self.directory = directory
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.images = images
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.image_path = os.path.join(directory, IMAGE_FILE)
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.library = None
+        self.journal: Optional[Journal] = None
+        self.seq = 0
+        self._since_snapshot = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, environ: Dict[str, str] = os.environ) -> Optional['LibraryStore']:
+        """Build a store from LIBRARY_DATA_DIR and friends, or None if unset."""
+        directory = environ.get("LIBRARY_DATA_DIR")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            fsync_every=int(environ.get("LIBRARY_FSYNC_EVERY", 1)),
+            fsync_interval=float(environ.get("LIBRARY_FSYNC_INTERVAL", 0.0)),
+            snapshot_every=int(environ.get("LIBRARY_SNAPSHOT_EVERY", 10000)),
+            images=environ.get("LIBRARY_SNAPSHOT_FORMAT", "image") != "jsonl",
+        )
+
+    def _read_header(self) -> Dict[str, Any]:
+        with open(self.snapshot_path, "rb") as f:
+            return json.loads(f.readline())
+
+    def _read_snapshot(self) -> Iterator[Dict[str, Any]]:
+        with open(self.snapshot_path, "rb") as f:
+            f.readline()
+            for line in f:
+                yield json.loads(line)
+
+    def _load_image(self, library: Any, seq: int) -> bool:
+        # Whether the image of the snapshot at seq could be loaded
+        if not (self.images and hasattr(library, "load_image") and os.path.exists(self.image_path)):
+            return False
+        try:
+            library.load_image(self.image_path, {"seq": seq})
+        except Exception as e:
+            logger.warning("Loading %s from its snapshot instead of its image: %s", self.directory, e)
+            return False
+        return True
+
+    def load(self, library: Any) -> Any:
+        """Fill library from disk and start journaling its mutations."""
+        if os.path.exists(self.snapshot_path):
+            header = self._read_header()
+            self.seq = header.get("seq", 0)
+            if not self._load_image(library, self.seq):
+                for data in self._read_snapshot():
+                    if "loan" in data:
+                        library.restore_loan(data["loan"])
+                    else:
+                        library.restore_book(data)
+                library.next_id = max(library.next_id, header.get("next_id", 1))
+        elif hasattr(library, "load_image") and os.path.exists(self.image_path):
+            # Written when images were the only snapshot
+            header = library.load_image(self.image_path)
+            self.seq = header.get("seq", 0)
+
+        for record in Journal.read(self.journal_path):
+            if record["seq"] <= self.seq:
+                continue
+            library.apply_record(record["op"], record["data"])
+            self.seq = record["seq"]
+            self._since_snapshot += 1
+
+        self.library = library
+        self.journal = Journal(self.journal_path, self.fsync_every, self.fsync_interval)
+        library.store = self
+        return library
+
+    def append(self, op: str, data: Dict[str, Any]) -> None:
+        """Journal one mutation."""
+        self.seq += 1
+        self.journal.append({"seq": self.seq, "op": op, "data": data})
+        self._since_snapshot += 1
+
+    @property
+    def snapshot_due(self) -> bool:
+        """Whether enough records have been journaled to compact them."""
+        return bool(self.snapshot_every) and self._since_snapshot >= self.snapshot_every
+
+    def snapshot(self) -> None:
+        """Write the whole library to a fresh snapshot and empty the journal."""
+        self._write_json_snapshot()
+        # The previous image no longer matches the snapshot either way
+        if self.images and hasattr(self.library, "save_image"):
+            try:
+                self.library.save_image(self.image_path, {"seq": self.seq})
+            except Exception as e:
+                logger.warning("Could not write the image of %s: %s", self.directory, e)
+                self._remove_image()
+        else:
+            self._remove_image()
+
+        self.journal.truncate()
+        self._since_snapshot = 0
+
+    def _remove_image(self) -> None:
+        if os.path.exists(self.image_path):
+            os.remove(self.image_path)
+
+    def _write_json_snapshot(self) -> None:
+        header = dict(self.library.snapshot_state(), seq=self.seq)
+        tmp_name = f"{self.snapshot_path}.tmp"
+        with open(tmp_name, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            for data in self.library.iter_snapshot_books():
+                f.write(json.dumps(data, separators=(",", ":")) + "\n")
+            for data in self.library.iter_snapshot_loans():
+                f.write(json.dumps({"loan": data}, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, self.snapshot_path)
+        fsync_directory(self.directory)
+
+    def sync(self) -> None:
+        """Force pending journal records to disk."""
+        if self.journal:
+            self.journal.sync()
+
+    def close(self) -> None:
+        """Sync and close the journal."""
+        if self.journal:
+            self.journal.close()
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.pop("LIBRARY_DATA_DIR", None)
+os.environ.pop("LIBRARY_BACKEND", None)
+os.environ["LIBRARY_OVERDUE_INTERVAL"] = "0"
+
+import index  # noqa: E402
+from sqlite_library import SqliteLibrary  # noqa: E402
+from timestamps import format_day, format_timestamp  # noqa: E402
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    library = SqliteLibrary(str(tmp_path / "library.db"), index.Book)
+    library.add_books([index.Book("Dune", "Frank Herbert", "Science Fiction", 1965)])
+    monkeypatch.setattr(index, "library", library)
+    return index.app.test_client()
+
+
+def test_update_stores_numeric_dates_in_the_library_format(client):
+    # Numbers are accepted as dates, like the in-memory backend does, but
+    # must be stored as formatted text so the row can be read back
+    response = client.put("/api/books/1", json={"date_added": 1700000000, "return_date": 738000})
+    assert response.status_code == 200
+    assert response.get_json()["date_added"] == format_timestamp(1700000000)
+    assert response.get_json()["return_date"] == format_day(738000)
+
+    assert client.get("/api/books/1").status_code == 200
+    assert client.put("/api/books/1", json={"title": "Dune Messiah"}).status_code == 200
+
+
+def test_batch_update_stores_numeric_dates_in_the_library_format(client):
+    operations = [{"op": "update", "id": "1", "changes": {"return_date": 738000}}]
+    response = client.post("/api/circulation/batch", json={"operations": operations})
+    assert response.status_code == 200
+    assert response.get_json()["results"][0]["body"]["return_date"] == format_day(738000)
+    assert client.get("/api/books/1").get_json()["return_date"] == format_day(738000)
@@ -0,0 +1,63 @@
+import time
+from datetime import date, datetime
+from typing import Optional, Union
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def to_timestamp(value: Union[None, int, float, str]) -> Optional[int]:
+    """Convert a "%Y-%m-%d %H:%M:%S" or "%Y-%m-%d" string to epoch seconds."""
+    if value is None:
+        return value
+    if isinstance(value, (int, float)):
+        # Only times that can be rendered back (see format_timestamp)
+        try:
+            datetime.fromtimestamp(value)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError(f"Invalid date: {value!r}")
+        return int(value)
+    for fmt in (DATETIME_FORMAT, DATE_FORMAT):
+        try:
+            return int(time.mktime(time.strptime(value, fmt)))
+        except (TypeError, ValueError):
+            continue
+    raise ValueError(f"Invalid date: {value!r}")
+
+
+def format_timestamp(value: Optional[int]) -> Optional[str]:
+    """Render epoch seconds in the library's "%Y-%m-%d %H:%M:%S" format."""
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value).strftime(DATETIME_FORMAT)
+
+
+def to_day(value: Union[None, int, str]) -> Optional[int]:
+    """Convert a "%Y-%m-%d" string (or longer timestamp) to a day ordinal."""
+    if value is None:
+        return value
+    if isinstance(value, int):
+        if not 1 <= value <= date.max.toordinal():
+            raise ValueError(f"Invalid date: {value!r}")
+        return value
+    try:
+        return date.fromisoformat(value[:10]).toordinal()
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date: {value!r}")
+
+
+def format_day(value: Optional[int]) -> Optional[str]:
+    """Render a day ordinal in the library's "%Y-%m-%d" format."""
+    if value is None:
+        return None
+    return date.fromordinal(value).isoformat()
+
+
+def now_timestamp() -> int:
+    """Return the current time in epoch seconds."""
+    return int(time.time())
+
+
+def today() -> int:
+    """Return today's day ordinal."""
+    return date.today().toordinal()